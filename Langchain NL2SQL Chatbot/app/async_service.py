@@ -0,0 +1,99 @@
+import asyncio
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from config import load_config
+
+
+class Job:
+    """Handle for one coroutine running on the service loop: a future to poll plus a stream of progress events."""
+
+    def __init__(self, name: str) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.future = None
+        self.started_at = time.time()
+        self._events = queue.Queue()
+
+    def emit(self, event: str):
+        print(f"[job {self.id}] {event}")
+        self._events.put(event)
+
+    def drain_events(self) -> list:
+        events = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def result(self, timeout: float = None):
+        return self.future.result(timeout=timeout)
+
+
+class AsyncExecutionService:
+    """
+    One asyncio event loop on a background thread, shared by every Streamlit session in the process.
+
+    Pages submit coroutines and get a `Job` back instead of blocking the script thread on LLM and
+    database calls; concurrent sessions overlap their I/O on the shared loop.
+    """
+
+    def __init__(self, max_jobs: int = 256) -> None:
+        self.max_jobs = max_jobs
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="async-execution", daemon=True)
+        self._thread.start()
+
+    def submit(self, name: str, coroutine_fn, *args, **kwargs) -> Job:
+        """Schedule `coroutine_fn(job, *args, **kwargs)` on the loop and return its job."""
+        job = Job(name)
+        job.future = asyncio.run_coroutine_threadsafe(coroutine_fn(job, *args, **kwargs), self._loop)
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_async_service() -> AsyncExecutionService:
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = AsyncExecutionService(max_jobs=load_config()["async_execution"]["max_jobs"])
+        return _service
+
+
+def get_job(job_id: str):
+    """Look up a submitted job without starting the service; None if it never ran in this process."""
+    with _service_lock:
+        service = _service
+    return service.get(job_id) if service is not None and job_id else None
+
+
+def wait_for_job(job: Job, status, poll_interval: float = None):
+    """Poll a job from the Streamlit script, writing its progress events into `status` until it finishes."""
+    poll_interval = poll_interval or load_config()["async_execution"]["poll_interval"]
+    while not job.done():
+        for event in job.drain_events():
+            status.write(event)
+        time.sleep(poll_interval)
+    for event in job.drain_events():
+        status.write(event)
+    return job.result()
@@ -0,0 +1,207 @@
+import json
+import math
+import operator
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+
+from langchain_core.documents import Document
+from pyprojroot import here
+
+from config import load_config
+
+BM25_FILE = "bm25_index.json"
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if len(token) > 1]
+
+
+COMPARISONS = {
+    "$eq": operator.eq,
+    "$ne": operator.ne,
+    "$gt": operator.gt,
+    "$gte": operator.ge,
+    "$lt": operator.lt,
+    "$lte": operator.le,
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+}
+LOGICAL_OPERATORS = ("$and", "$or")
+
+
+def check_filter(where: dict):
+    """Raise ValueError for a Chroma `where` filter that `_matches` cannot apply exactly as Chroma would."""
+    for key, condition in (where or {}).items():
+        if key in LOGICAL_OPERATORS:
+            if not isinstance(condition, list):
+                raise ValueError(f"{key} expects a list of filters")
+            for clause in condition:
+                check_filter(clause)
+        elif key.startswith("$"):
+            raise ValueError(f"Unsupported filter operator {key!r}")
+        elif isinstance(condition, dict):
+            for name in condition:
+                if name not in COMPARISONS:
+                    raise ValueError(f"Unsupported filter operator {name!r} on {key!r}")
+
+
+def _matches_field(metadata: dict, key: str, condition) -> bool:
+    if key not in metadata:
+        # Chroma only matches chunks that have the field, whatever the operator.
+        return False
+    conditions = condition if isinstance(condition, dict) else {"$eq": condition}
+    try:
+        return all(COMPARISONS[name](metadata[key], operand) for name, operand in conditions.items())
+    except TypeError:
+        return False
+
+
+def _matches(metadata: dict, where: dict) -> bool:
+    """Chroma `where` semantics: field equality, $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin, nested $and/$or."""
+    for key, condition in (where or {}).items():
+        if key == "$and":
+            matched = all(_matches(metadata, clause) for clause in condition)
+        elif key == "$or":
+            matched = any(_matches(metadata, clause) for clause in condition)
+        else:
+            matched = _matches_field(metadata, key, condition)
+        if not matched:
+            return False
+    return True
+
+
+class BM25Index:
+    """
+    Keyword index over the same chunks as the Chroma collection, keyed by the same chunk ids.
+
+    Chunk text, metadata and term frequencies are persisted to one JSON file next to the vector DB;
+    PrepareVectorDB adds and deletes chunks as it syncs the collection and saves at the end of a run.
+    The inverted index and document frequencies are kept in memory, and readers reload the file when
+    it changed on disk, so a running app sees newly ingested documents.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75) -> None:
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._docs = {}
+        self._postings = defaultdict(dict)
+        self._total_length = 0
+        self._mtime = None
+        self._lock = threading.RLock()
+        self._load()
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def _load(self):
+        with self._lock:
+            self._docs, self._postings, self._total_length = {}, defaultdict(dict), 0
+            if not self.exists:
+                self._mtime = None
+                return
+            self._mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                for chunk_id, doc in json.load(f).items():
+                    self._index(chunk_id, doc)
+
+    def _reload_if_changed(self):
+        mtime = os.path.getmtime(self.path) if self.exists else None
+        if mtime != self._mtime:
+            print("Reloading BM25 index")
+            self._load()
+
+    def _index(self, chunk_id: str, doc: dict):
+        self._docs[chunk_id] = doc
+        self._total_length += doc["length"]
+        for term, frequency in doc["terms"].items():
+            self._postings[term][chunk_id] = frequency
+
+    def _unindex(self, chunk_id: str):
+        doc = self._docs.pop(chunk_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc["length"]
+        for term in doc["terms"]:
+            self._postings[term].pop(chunk_id, None)
+            if not self._postings[term]:
+                del self._postings[term]
+
+    def add(self, ids: list, texts: list, metadatas: list):
+        with self._lock:
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                tokens = tokenize(text)
+                self._unindex(chunk_id)
+                self._index(chunk_id, {"text": text, "metadata": metadata or {}, "length": len(tokens),
+                                       "terms": dict(Counter(tokens))})
+
+    def delete(self, ids: list):
+        with self._lock:
+            for chunk_id in ids:
+                self._unindex(chunk_id)
+
+    def rebuild_from(self, vectordb):
+        """Index every chunk already in the Chroma collection, e.g. one built before this index existed."""
+        stored = vectordb.get(include=["documents", "metadatas"])
+        with self._lock:
+            self._docs, self._postings, self._total_length = {}, defaultdict(dict), 0
+            self.add(stored["ids"], stored["documents"], stored["metadatas"])
+        print(f"BM25 index rebuilt from {len(stored['ids'])} stored chunks")
+
+    def save(self):
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._docs, f)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+
+    def search(self, query: str, k: int = 10, filter: dict = None) -> list:
+        """
+        (Document, BM25 score) pairs for the `k` best-scoring chunks, best first. Raises ValueError for
+        a `filter` that cannot be applied like Chroma applies it (see `check_filter`).
+        """
+        check_filter(filter)
+        self._reload_if_changed()
+        with self._lock:
+            count = len(self._docs)
+            if not count:
+                return []
+            average_length = self._total_length / count
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, frequency in postings.items():
+                    length_norm = 1 - self.b + self.b * self._docs[chunk_id]["length"] / average_length
+                    scores[chunk_id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+            ranked = sorted(scores.items(), key=lambda item: -item[1])
+            results = []
+            for chunk_id, score in ranked:
+                doc = self._docs[chunk_id]
+                if _matches(doc["metadata"], filter):
+                    results.append((Document(page_content=doc["text"], metadata=doc["metadata"]), score))
+                    if len(results) >= k:
+                        break
+            return results
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_bm25_index() -> BM25Index:
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = BM25Index(os.path.join(str(here(load_config()["unstructured_data"]["vectordb"])), BM25_FILE))
+        return _index
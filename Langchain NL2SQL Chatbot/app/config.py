@@ -0,0 +1,10 @@
+import yaml
+from functools import lru_cache
+from pyprojroot import here
+
+
+@lru_cache(maxsize=None)
+def load_config():
+    """Load the shared tools_config.yml once per process."""
+    with open(here("Langchain NL2SQL Chatbot/configs/tools_config.yml")) as cfg:
+        return yaml.load(cfg, Loader=yaml.FullLoader)
@@ -1,8 +1,9 @@
 from crewai import Agent, Crew, Process, Task
 from crewai_tools import tool
 from textwrap import dedent
-from tools import decide_route, lookup_vector_db, sql_tool, list_tables, tables_schema, execute_sql, check_sql, create_visualization
+from tools import decide_route, lookup_vector_db, sql_tool, list_tables, tables_schema, join_path, find_values, fetch_sql_rows, check_sql, create_visualization, visualization_tool
 from langchain_utils import get_llm
+from config import load_config
 
 llm = get_llm()
 sql_dev = Agent(
@@ -15,12 +16,16 @@ sql_dev = Agent(
         
         Always use list_tables first to see available tables, then use tables_schema to understand
         the structure of the tables you need. Make sure to use the exact column names from the schema.
+        When a query spans tables that do not reference each other directly, use join_path to find
+        the intermediate tables and join columns instead of guessing them.
+        When the question names a specific value (a product, country, customer...), use find_values
+        to get the exact literal stored in the database before filtering on it.
         
         Use the `sql_tool` to get the executed SQL response from it, by passing the `query` and `messages` to it.
         """
     ),
     llm=llm,
-    tools=[list_tables, tables_schema, execute_sql, check_sql, sql_tool],
+    tools=[list_tables, tables_schema, join_path, find_values, fetch_sql_rows, check_sql, sql_tool],
     allow_delegation=False,
 )
 
@@ -97,81 +102,71 @@ visualization_expert = Agent(
     allow_delegation=False,
 )
 
-extract_data = Task(
-    description=dedent(
-        """
-        Extract data that is required for the query {query} with messages {messages}.
-        
-        First, use list_tables to see available tables.
-        Then use tables_schema to understand the structure of relevant tables.
-        Make sure to use exact column names from the schema in your SQL query.
-        
-        Include both the SQL query you used and its results in your response.
-        Format your response as:
-        QUERY: <the SQL query>
-        RESULTS: <the query results>
-        """
-    ),
-    expected_output="SQL query and its results",
-    agent=sql_dev,
+EXTRACT_DATA_DESCRIPTION = dedent(
+    """
+    Extract data that is required for the query {query} with messages {messages}.
+    
+    First, use list_tables to see available tables.
+    Then use tables_schema to understand the structure of relevant tables.
+    Make sure to use exact column names from the schema in your SQL query.
+    Run the final query with fetch_sql_rows and pass on every row it returns, not a sample.
+    
+    Include both the SQL query you used and its results in your response.
+    Format your response as:
+    QUERY: <the SQL query>
+    RESULTS: <the query results>
+    """
 )
 
-routing_task = Task(
-    description=dedent(
-        """
-        Analyze the incoming query to determine whether it requires data from the SQL database or from unstructured documents.
-        Return either "SQL" or "Unstructured".
-        """
-    ),
-    expected_output="Data source indicator"
+VISUALIZE_DATA_DESCRIPTION = dedent(
+    """
+    Review the SQL query and results, then create an appropriate visualization.
+    
+    You will receive:
+    QUERY: <the SQL query>
+    RESULTS: <the query results>
+
+    Your task is to directly execute the create_visualization tool with appropriate parameters based on the data.
+    Choose parameters based on:
+    - For time-based data → use line chart
+    - For category comparisons → use bar chart
+    - For numeric relationships → use scatter plot
+    - For distributions → use box or histogram
+    - For proportions → use pie chart
+    """
 )
 
-visualize_data = Task(
-    description=dedent(
-        """
-        Review the SQL query and results, then create an appropriate visualization.
-        
-        You will receive:
-        QUERY: <the SQL query>
-        RESULTS: <the query results>
-
-        Your task is to directly execute the create_visualization tool with appropriate parameters based on the data.
-        Choose parameters based on:
-        - For time-based data → use line chart
-        - For category comparisons → use bar chart
-        - For numeric relationships → use scatter plot
-        - For distributions → use box or histogram
-        - For proportions → use pie chart
-        """
-    ),
-    expected_output="Visualization tool execution",
-    agent=visualization_expert,
-    context=[extract_data],
+ANALYZE_DATA_DESCRIPTION = dedent(
+    """
+    Analyze the data from the database and the visualization if one was created.
+    Provide insights about the data and how the visualization helps understand it better.
+    """
 )
 
-analyze_data = Task(
-    description=dedent(
-        """
-        Analyze the data from the database and the visualization if one was created.
-        Provide insights about the data and how the visualization helps understand it better.
-        """
-    ),
-    expected_output="Detailed analysis text incorporating both data and visualization insights",
-    agent=data_analyst,
-    context=[extract_data, visualize_data],
+# In parallel mode the analyst works from the extracted data while the chart is still being drawn
+ANALYZE_DATA_PARALLEL_DESCRIPTION = dedent(
+    """
+    Analyze the data from the database.
+    Provide insights about the data; a visualization of the same query is being created alongside your analysis.
+    """
+)
+
+WRITE_REPORT_DESCRIPTION = dedent(
+    """
+    Write an executive summary of the report from the analysis and visualization. 
+    If there's a visualization, reference it in your summary.
+    The report must be less than 100 words.
+    """
 )
 
-write_report = Task(
+routing_task = Task(
     description=dedent(
         """
-        Write an executive summary of the report from the analysis and visualization. 
-        If there's a visualization, reference it in your summary.
-        The report must be less than 100 words.
+        Analyze the incoming query to determine whether it requires data from the SQL database or from unstructured documents.
+        Return either "SQL" or "Unstructured".
         """
     ),
-    expected_output="Markdown report",
-    agent=report_writer,
-    context=[analyze_data],
+    expected_output="Data source indicator"
 )
 
 routing_expert = Agent(
@@ -188,15 +183,99 @@ routing_expert = Agent(
     tools=[decide_route]
 )
 
+
+def build_data_insights_crew(parallel: bool = None, figure_sink: list = None, task_callback=None) -> Crew:
+    """
+    Build a fresh insights crew, so concurrent runs never share agent or task state.
+
+    In parallel mode the graph is extract_data -> (visualize_data, analyze_data) -> write_report: both
+    middle tasks only need the extracted data, so they run concurrently and join in the report.
+    With `figure_sink`, figures are collected there instead of drawn on the page. `task_callback(name, output)`
+    is called as each task finishes.
+    """
+    if parallel is None:
+        parallel = load_config()["data_insights"]["parallel"]
+
+    def callback(name):
+        if task_callback is None:
+            return None
+        return lambda output: task_callback(name, output)
+
+    developer = sql_dev.copy()
+    visualizer = visualization_expert.copy()
+    if figure_sink is not None:
+        visualizer.tools = [visualization_tool(figure_sink)]
+    analyst = data_analyst.copy()
+    writer = report_writer.copy()
+
+    extract = Task(
+        description=EXTRACT_DATA_DESCRIPTION,
+        expected_output="SQL query and its results",
+        agent=developer,
+        callback=callback("extract_data"),
+    )
+    visualize = Task(
+        description=VISUALIZE_DATA_DESCRIPTION,
+        expected_output="Visualization tool execution",
+        agent=visualizer,
+        context=[extract],
+        async_execution=parallel,
+        callback=callback("visualize_data"),
+    )
+    if parallel:
+        analyze = Task(
+            description=ANALYZE_DATA_PARALLEL_DESCRIPTION,
+            expected_output="Detailed analysis text of the data",
+            agent=analyst,
+            context=[extract],
+            async_execution=True,
+            callback=callback("analyze_data"),
+        )
+        report_context = [analyze, visualize]
+    else:
+        analyze = Task(
+            description=ANALYZE_DATA_DESCRIPTION,
+            expected_output="Detailed analysis text incorporating both data and visualization insights",
+            agent=analyst,
+            context=[extract, visualize],
+            callback=callback("analyze_data"),
+        )
+        report_context = [analyze]
+    report = Task(
+        description=WRITE_REPORT_DESCRIPTION,
+        expected_output="Markdown report",
+        agent=writer,
+        context=report_context,
+        callback=callback("write_report"),
+    )
+
+    return Crew(
+        agents=[developer, visualizer, analyst, writer],
+        tasks=[extract, visualize, analyze, report],
+        process=Process.sequential,
+        verbose=2,
+        memory=False,
+        output_log_file="crew.log",
+    )
+
+
 # Create the crew
-data_insights_crew = Crew(
-    agents=[sql_dev, visualization_expert, data_analyst, report_writer],
-    tasks=[extract_data, visualize_data, analyze_data, write_report],
-    process=Process.sequential,
-    verbose=2,
-    memory=False,
-    output_log_file="crew.log",
-)
+data_insights_crew = build_data_insights_crew()
+extract_data, visualize_data, analyze_data, write_report = data_insights_crew.tasks
+
+
+async def arun_data_insights(job, inputs):
+    """
+    Run the insights crew on the async execution service. Figures from `create_visualization` are
+    collected instead of drawn, since the tools do not run on the page's script thread.
+    Returns (report, figures).
+    """
+    figures = []
+    job.emit("Running the data insights crew")
+    report = await build_data_insights_crew(figure_sink=figures).kickoff_async(inputs=inputs)
+    job.emit(f"Report written with {len(figures)} visualization(s)")
+    return str(report), figures
+
 
 # Export the crew
-__all__ = ['data_insights_crew','sql_dev','vector_db_lookup_agent','data_analyst','report_writer','visualization_expert','extract_data','visualize_data','analyze_data','write_report','routing_expert']
+__all__ = ['arun_data_insights','build_data_insights_crew','data_insights_crew','sql_dev','vector_db_lookup_agent','data_analyst','report_writer','visualization_expert','extract_data','visualize_data','analyze_data','write_report','routing_expert']
@@ -0,0 +1,102 @@
+import os
+import threading
+
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import create_engine
+
+from config import load_config
+
+_engines = {}
+_async_engines = {}
+_databases = {}
+_lock = threading.Lock()
+
+
+def get_connection_string(driver: str = "pymysql") -> str:
+    url = load_config()["sql_engine"].get("url")
+    if url and driver == "pymysql":
+        return url
+    db_user = os.getenv("db_user")
+    db_password = os.getenv("db_password")
+    db_host = os.getenv("db_host")
+    db_name = os.getenv("db_name")
+    return f"mysql+{driver}://{db_user}:{db_password}@{db_host}/{db_name}"
+
+
+def _pool_kwargs(url: str, for_async: bool = False) -> dict:
+    """
+    QueuePool settings from `sql_engine`. With async execution enabled the sync and the asyncio engine
+    split one budget (the sync pool gets the larger half), so together they never exceed
+    pool_size + max_overflow connections.
+    """
+    if url.startswith("sqlite"):
+        # SQLite picks its own pool class; QueuePool sizing does not apply.
+        return {}
+    app_config = load_config()
+    pool_config = app_config["sql_engine"]
+    pool_size, max_overflow = pool_config["pool_size"], pool_config["max_overflow"]
+    if app_config["async_execution"]["enabled"]:
+        if for_async:
+            pool_size, max_overflow = max(pool_size // 2, 1), max_overflow // 2
+        else:
+            pool_size, max_overflow = pool_size - pool_size // 2, max_overflow - max_overflow // 2
+    return dict(
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_config["pool_timeout"],
+        pool_recycle=pool_config["pool_recycle"],
+        pool_pre_ping=pool_config["pool_pre_ping"],
+    )
+
+
+def get_engine(url: str = None, local_infile: bool = False):
+    """
+    Return the process-wide pooled engine for `url` (the MySQL database from the environment by default).
+    Every module shares one pool per URL instead of opening its own connections.
+    `local_infile` gives a separate pool whose connections may run LOAD DATA LOCAL INFILE.
+    """
+    url = url or get_connection_string()
+    key = (url, local_infile)
+    engine = _engines.get(key)
+    if engine is not None:
+        return engine
+    with _lock:
+        if key not in _engines:
+            connect_args = {"local_infile": True} if local_infile else {}
+            _engines[key] = create_engine(url, connect_args=connect_args, **_pool_kwargs(url))
+        return _engines[key]
+
+
+def get_async_engine(url: str = None):
+    """
+    Pooled asyncio engine (aiomysql by default) for the async execution service.
+    Must only be used from the service's event loop, since aiomysql connections are bound to the loop.
+    """
+    # Imported here: the asyncio extension needs greenlet, which only the async path should require.
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    url = url or get_connection_string(driver="aiomysql")
+    with _lock:
+        if url not in _async_engines:
+            _async_engines[url] = create_async_engine(url, **_pool_kwargs(url, for_async=True))
+        return _async_engines[url]
+
+
+def get_sql_database(url: str = None) -> SQLDatabase:
+    """LangChain SQLDatabase wrapper bound to the shared engine."""
+    url = url or get_connection_string()
+    db = _databases.get(url)
+    if db is not None:
+        return db
+    engine = get_engine(url)
+    with _lock:
+        if url not in _databases:
+            _databases[url] = SQLDatabase(engine)
+        return _databases[url]
+
+
+def dispose_all():
+    """Close every pooled connection, e.g. before forking worker processes."""
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
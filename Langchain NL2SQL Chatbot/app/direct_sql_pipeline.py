@@ -0,0 +1,142 @@
+import asyncio
+import re
+
+from langchain_core.output_parsers import StrOutputParser
+
+from config import load_config
+from join_graph import get_join_graph
+from langchain_utils import create_history, get_llm
+from prompts import final_prompt
+from result_store import get_result_store
+from schema_catalog import get_schema_catalog
+from sql_governor import QueryRejected
+from sql_validator import get_sql_validator
+from table_details import table_chain
+from table_selector import get_table_selector
+from value_index import get_value_index
+
+
+def extract_sql(generation: str) -> str:
+    """Pull the bare SQL statement out of an LLM generation (code fences, `SQLQuery:` prefixes)."""
+    fenced = re.search(r"```(?:sql)?\s*(.*?)```", generation, re.DOTALL | re.IGNORECASE)
+    if fenced:
+        generation = fenced.group(1)
+    generation = re.sub(r"^\s*SQLQuery:\s*", "", generation, flags=re.IGNORECASE)
+    return generation.strip()
+
+
+def select_tables(question: str) -> list:
+    """
+    Tables relevant to `question`, restricted to tables that actually exist: embedding retrieval with
+    foreign-key expansion (`table_selector`), or the `table_details.table_chain` LLM call when disabled.
+    """
+    available = get_schema_catalog().list_tables()
+    if load_config()["table_selector"]["enabled"]:
+        selected = [table for table in get_table_selector().select(question) if table in available]
+    else:
+        selected = [table for table in table_chain.invoke({"question": question}) if table in available]
+    return selected or available
+
+
+async def aselect_tables(question: str) -> list:
+    available = await asyncio.to_thread(get_schema_catalog().list_tables)
+    if load_config()["table_selector"]["enabled"]:
+        selected = [table for table in await get_table_selector().aselect(question) if table in available]
+    else:
+        selected = [table for table in await table_chain.ainvoke({"question": question}) if table in available]
+    return selected or available
+
+
+def build_table_info(tables: list, question: str) -> str:
+    """
+    `{table_info}` for the generation prompt: with `join_graph.enabled`, the selected tables plus the
+    intermediate tables needed to join them, wide tables pruned to the relevant columns, and the join
+    paths spelled out; otherwise the full DDL of the selected tables.
+    With `value_index.enabled`, the exact values the question's phrases link to are appended.
+    """
+    if load_config()["join_graph"]["enabled"]:
+        table_info = get_join_graph().table_info(tables, question)
+    else:
+        table_info = get_schema_catalog().get_table_info(tables)
+    if load_config()["value_index"]["enabled"]:
+        hints = get_value_index().hints(question)
+        if hints:
+            print("Value hints:", hints)
+            table_info += "\n\n" + hints
+    return table_info
+
+
+def _generation_inputs(inputs, table_info: str) -> dict:
+    return {
+        "input": inputs["query"],
+        "table_info": table_info,
+        "top_k": load_config()["primary_agent"]["top_k"],
+        "messages": create_history(inputs.get("messages", [])).messages,
+    }
+
+
+def _rejection(validation, sql: str):
+    """
+    Message for a query that may not run, or None when it may. Queries the parser could not read are
+    refused too: nothing else checks them on this path, and asking the LLM checker would cost a third call.
+    """
+    if validation.ambiguous:
+        return ("The generated query could not be verified and was not run:\n"
+                + "\n".join(f"- {issue}" for issue in validation.issues) + f"\n\n```sql\n{sql}\n```")
+    if validation.issues:
+        return "The generated query was rejected:\n" + "\n".join(f"- {issue}" for issue in validation.issues) + f"\n\n```sql\n{sql}\n```"
+    return None
+
+
+def _emit(job, event: str):
+    if job is not None:
+        job.emit(event)
+
+
+def run_direct_pipeline(inputs) -> str:
+    """
+    Answer a question with a fixed pipeline instead of the agent loop:
+    table selection, one generation call with `prompts.final_prompt`, sqlglot validation, then execution.
+    Makes exactly two LLM calls and returns the same `QUERY: ... RESULTS: <result reference>` text as `sql_crew`.
+    """
+    tables = select_tables(inputs["query"])
+    print("Direct pipeline tables:", tables)
+    table_info = build_table_info(tables, inputs["query"])
+
+    generate_query = final_prompt | get_llm() | StrOutputParser()
+    sql = extract_sql(generate_query.invoke(_generation_inputs(inputs, table_info)))
+    print("Direct pipeline SQL:", sql)
+
+    rejection = _rejection(get_sql_validator().validate(sql), sql)
+    if rejection:
+        return rejection
+
+    try:
+        result_set = get_result_store().execute(sql)
+    except QueryRejected as e:
+        return f"{e}\n\n```sql\n{sql}\n```"
+    return f"QUERY: {sql}\nRESULTS: {result_set.reference}"
+
+
+async def arun_direct_pipeline(inputs, job=None) -> str:
+    """`run_direct_pipeline` on the async service: async OpenAI calls and the aiomysql driver, with progress events."""
+    _emit(job, "Selecting relevant tables")
+    tables = await aselect_tables(inputs["query"])
+    _emit(job, f"Using tables: {', '.join(tables)}")
+    table_info = await asyncio.to_thread(build_table_info, tables, inputs["query"])
+
+    _emit(job, "Generating SQL")
+    generate_query = final_prompt | get_llm() | StrOutputParser()
+    sql = extract_sql(await generate_query.ainvoke(_generation_inputs(inputs, table_info)))
+
+    _emit(job, "Validating SQL")
+    rejection = _rejection(await asyncio.to_thread(get_sql_validator().validate, sql), sql)
+    if rejection:
+        return rejection
+
+    _emit(job, "Executing query")
+    try:
+        result_set = await get_result_store().aexecute(sql)
+    except QueryRejected as e:
+        return f"{e}\n\n```sql\n{sql}\n```"
+    return f"QUERY: {sql}\nRESULTS: {result_set.reference}"
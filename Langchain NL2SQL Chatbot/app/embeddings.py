@@ -0,0 +1,156 @@
+import argparse
+import hashlib
+import re
+import tempfile
+import threading
+from typing import List
+
+import numpy as np
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_core.embeddings import Embeddings
+from pyprojroot import here
+
+from config import load_config
+
+EMBEDDING_PROVIDERS = ("openai", "local", "hashing")
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Dependency-free embeddings: word unigrams and character trigrams hashed into a fixed-size,
+    unit-normalized vector. Deterministic and instant, so useful offline and in tests, though it
+    only captures lexical overlap.
+    """
+
+    def __init__(self, dimensions: int = 1024) -> None:
+        self.dimensions = dimensions
+
+    def _features(self, text: str) -> List[str]:
+        text = text.lower()
+        words = TOKEN_PATTERN.findall(text)
+        trigrams = [f"#{word[i:i + 3]}" for word in words for i in range(max(len(word) - 2, 1))]
+        return words + trigrams
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in self._features(text):
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class LocalEmbeddings(Embeddings):
+    """sentence-transformers model on the CPU (optionally through its ONNX backend), encoded in batches."""
+
+    def __init__(self, model_name: str, batch_size: int = 64, backend: str = "torch", device: str = "cpu") -> None:
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        kwargs = {"backend": backend} if backend != "torch" else {}
+        self.model = SentenceTransformer(model_name, device=device, **kwargs)
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        with self._lock:
+            vectors = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                        convert_to_numpy=True, show_progress_bar=False)
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def _build_provider(provider: str, embeddings_config: dict):
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings(model=embeddings_config["openai_model"], chunk_size=embeddings_config["batch_size"]), \
+            embeddings_config["openai_model"]
+    if provider == "local":
+        return LocalEmbeddings(embeddings_config["local_model"], batch_size=embeddings_config["batch_size"],
+                               backend=embeddings_config["local_backend"]), embeddings_config["local_model"]
+    if provider == "hashing":
+        dimensions = embeddings_config["hashing_dimensions"]
+        return HashingEmbeddings(dimensions), f"hashing-{dimensions}"
+    raise ValueError(f"Unknown embedding provider {provider!r}, expected one of {EMBEDDING_PROVIDERS}")
+
+
+_embeddings = {}
+_namespaces = {}
+_embeddings_lock = threading.Lock()
+
+
+def _provider(purpose: str) -> str:
+    embeddings_config = load_config()["embeddings"]
+    return embeddings_config["vector_store_provider"] if purpose == "vector_store" else embeddings_config["provider"]
+
+
+def _cache_namespace(provider: str, model_name: str) -> str:
+    """Key prefix of the embedding cache; LocalFileStore only accepts letters, digits and _ . - / in keys."""
+    return f"{provider}/{re.sub(r'[^a-zA-Z0-9_.-]', '_', model_name)}/"
+
+
+def _cached(underlying: Embeddings, provider: str, model_name: str, cache_dir: str, batch_size: int) -> Embeddings:
+    return CacheBackedEmbeddings.from_bytes_store(
+        underlying,
+        LocalFileStore(cache_dir),
+        namespace=_cache_namespace(provider, model_name),
+        batch_size=batch_size,
+        query_embedding_cache=True,
+    )
+
+
+def get_embeddings(purpose: str = "default") -> Embeddings:
+    """
+    Shared embeddings client for `purpose`, wrapped in a persistent cache keyed by a hash of the text.
+
+    `purpose="vector_store"` uses `embeddings.vector_store_provider`, since an existing collection can
+    only be queried with the model it was built with; everything else uses `embeddings.provider`.
+    The cache is namespaced by provider and model, so switching either never returns stale vectors.
+    """
+    embeddings_config = load_config()["embeddings"]
+    provider = _provider(purpose)
+    with _embeddings_lock:
+        if provider not in _embeddings:
+            underlying, model_name = _build_provider(provider, embeddings_config)
+            _namespaces[provider] = f"{provider}:{model_name}"
+            _embeddings[provider] = _cached(underlying, provider, model_name, str(here(embeddings_config["cache_dir"])),
+                                            embeddings_config["batch_size"])
+        return _embeddings[provider]
+
+
+def get_embeddings_namespace(purpose: str = "default") -> str:
+    """The "provider:model" namespace of `get_embeddings(purpose)`; vectors from different namespaces never mix."""
+    get_embeddings(purpose)
+    return _namespaces[_provider(purpose)]
+
+
+if __name__ == "__main__":
+    # Smoke test of the cached wrapper, e.g.: python embeddings.py --provider hashing
+    parser = argparse.ArgumentParser(description="Embed one string through the cache-backed embeddings.")
+    parser.add_argument("--provider", choices=EMBEDDING_PROVIDERS, help="Defaults to embeddings.provider")
+    args = parser.parse_args()
+
+    embeddings_config = load_config()["embeddings"]
+    provider = args.provider or embeddings_config["provider"]
+    underlying, model_name = _build_provider(provider, embeddings_config)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cached = _cached(underlying, provider, model_name, cache_dir, embeddings_config["batch_size"])
+        document = cached.embed_documents(["How many customers are in France?"])[0]
+        query = cached.embed_query("How many customers are in France?")
+        assert cached.embed_documents(["How many customers are in France?"])[0] == document
+        assert query == cached.embed_query("How many customers are in France?")
+        print(f"{provider}:{model_name}: {len(document)} dimensions, cached under {_cache_namespace(provider, model_name)}")
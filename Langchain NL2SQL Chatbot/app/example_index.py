@@ -0,0 +1,390 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List
+
+import numpy as np
+from langchain_core.example_selectors import BaseExampleSelector
+from pyprojroot import here
+
+from config import load_config
+from embeddings import get_embeddings, get_embeddings_namespace
+from query_cache import normalize_question
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only.
+    fcntl = None
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class ExampleIndex:
+    """
+    On-disk few-shot example bank with precomputed embeddings.
+
+    Examples are appended to `examples.jsonl` and their unit-normalized embeddings to `vectors.f32`
+    (raw float32 rows in the same order), so a new worker memory-maps the vectors instead of embedding
+    every example again, and adding an example is two appends rather than a rebuild. Other processes
+    pick up appended examples on their next search. `meta.json` records the embedding namespace; if
+    the configured embeddings change, the vectors are recomputed once from the stored examples.
+
+    The bank grows from answered questions, so additions are de-duplicated (same normalized question,
+    or an embedding within `dedup_threshold`) and capped at `max_examples`: once over the cap, the
+    least-selected examples are evicted and the files compacted. Seed examples are never evicted.
+    An example a user accepted is the exception to de-duplication: it replaces the SQL of an entry
+    with the same question (the files are rewritten) and is added alongside merely similar ones.
+    Selection counts are kept in memory and merged into `usage.json` every `usage_flush_interval` seconds.
+    """
+
+    def __init__(self, directory: str, embeddings, namespace: str, seed_examples: List[Dict] = None,
+                 max_examples: int = 5000, dedup_threshold: float = 0.97, usage_flush_interval: float = 60) -> None:
+        self.directory = directory
+        self.embeddings = embeddings
+        self.namespace = namespace
+        self.seed_examples = [{**example, "source": "seed"} for example in seed_examples or []]
+        self.max_examples = max_examples
+        self.dedup_threshold = dedup_threshold
+        self.usage_flush_interval = usage_flush_interval
+        self.examples_path = os.path.join(directory, "examples.jsonl")
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.usage_path = os.path.join(directory, "usage.json")
+        self.dimensions = None
+        self._generation = None
+        self._examples = []
+        self._examples_offset = 0
+        self._vectors = None
+        self._vectors_size = 0
+        self._pending_usage = {}
+        self._usage_flushed_at = time.time()
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def _file_lock(self):
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_meta(self, generation: int = 0):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"namespace": self.namespace, "dimensions": self.dimensions, "generation": generation}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def _reset(self):
+        self._examples, self._examples_offset = [], 0
+        self._vectors, self._vectors_size = None, -1
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return self._count()
+
+    def _count(self) -> int:
+        rows = 0 if self._vectors is None else len(self._vectors)
+        return min(rows, len(self._examples))
+
+    def _read_new_examples(self):
+        if not os.path.exists(self.examples_path):
+            return
+        with open(self.examples_path, "rb") as f:
+            f.seek(self._examples_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # A writer is mid-append; pick the line up next time.
+                self._examples.append(json.loads(line))
+                self._examples_offset += len(line)
+
+    def _refresh(self):
+        """Load examples and remap vectors appended since the last look, by this or any other process."""
+        meta = self._read_meta()
+        if meta is not None and meta["namespace"] != self.namespace:
+            with self._file_lock():
+                self._rebuild()
+            meta = self._read_meta()
+        if meta is None:
+            if self.seed_examples:
+                with self._file_lock():
+                    if self._read_meta() is None:
+                        print(f"Seeding example index with {len(self.seed_examples)} examples")
+                        self._append(self.seed_examples)
+                meta = self._read_meta()
+            if meta is None:
+                return
+        self._catch_up(meta)
+
+    def _catch_up(self, meta: dict):
+        """Read appended examples and remap the vectors; never seeds or rebuilds, so it is safe under the file lock."""
+        self.dimensions = meta["dimensions"]
+        if meta.get("generation", 0) != self._generation:
+            # The files were compacted (or this is the first look): reload them from the start.
+            self._reset()
+            self._generation = meta.get("generation", 0)
+        self._read_new_examples()
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if size != self._vectors_size:
+            rows = size // (4 * self.dimensions)
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimensions)) if rows else None
+            self._vectors_size = size
+
+    def _embed(self, examples: List[Dict]) -> np.ndarray:
+        return _normalize(np.asarray(self.embeddings.embed_documents([example["input"] for example in examples]),
+                                     dtype=np.float32))
+
+    def _append(self, examples: List[Dict], vectors: np.ndarray = None) -> List[str]:
+        """Append examples and their vectors. Caller holds the file lock."""
+        self._read_new_examples()
+        if vectors is None:
+            vectors = self._embed(examples)
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+            self._write_meta()
+        records = []
+        for example in examples:
+            record = {"id": example.get("id") or uuid.uuid4().hex[:12], "input": example["input"],
+                      "query": example["query"], "source": example.get("source", "manual"),
+                      "added_at": example.get("added_at") or time.time()}
+            records.append(record)
+
+        with open(self.vectors_path, "ab") as f:
+            # Drop vectors left behind by a writer that died before appending their examples.
+            f.truncate(len(self._examples) * self.dimensions * 4)
+            f.write(vectors.tobytes())
+        with open(self.examples_path, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        return [record["id"] for record in records]
+
+    def _rebuild(self):
+        """Recompute every vector with the current embeddings. Caller holds the file lock."""
+        meta = self._read_meta()
+        if meta is not None and meta["namespace"] == self.namespace:
+            return
+        self._reset()
+        self._read_new_examples()
+        print(f"Re-embedding {len(self._examples)} examples for {self.namespace}")
+        vectors = self._embed(self._examples) if self._examples else np.zeros((0, 0), dtype=np.float32)
+        self.dimensions = vectors.shape[1] if self._examples else None
+        tmp_path = f"{self.vectors_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(vectors.tobytes())
+        os.replace(tmp_path, self.vectors_path)
+        self._vectors, self._vectors_size = None, -1
+        if self.dimensions is None:
+            os.remove(self.meta_path)
+            return
+        self._write_meta(generation=(meta or {}).get("generation", 0) + 1)
+
+    def _duplicate_of(self, example: Dict, vector: np.ndarray, vectors, examples):
+        question = normalize_question(example["input"])
+        for existing in examples:
+            if normalize_question(existing["input"]) == question:
+                return existing
+        if vectors is not None and len(vectors):
+            scores = np.asarray(vectors @ vector)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.dedup_threshold:
+                return examples[best]
+        return None
+
+    def add(self, examples: List[Dict]) -> List[str]:
+        """
+        Append question/SQL pairs ({"input", "query", optional "source"}). Returns the id stored for each;
+        a duplicate returns the id of the example it matched. An "accepted" example replaces the SQL of
+        an existing entry with the same question instead of being dropped.
+        """
+        new_vectors = self._embed(examples)
+        with self._lock:
+            self._refresh()
+            with self._file_lock():
+                meta = self._read_meta()
+                if meta is not None:
+                    self._catch_up(meta)
+                count = self._count()
+                vectors, existing = (self._vectors[:count] if count else None), self._examples[:count]
+                ids, fresh, fresh_vectors, replacements = [], [], [], {}
+                for example, vector in zip(examples, new_vectors):
+                    accepted = example.get("source") == "accepted"
+                    # Accepted examples only match on the question itself, so a similar question
+                    # with different SQL is kept as well.
+                    duplicate = self._duplicate_of(example, vector, None if accepted else vectors, existing)
+                    if duplicate is not None and accepted and duplicate["query"] != example["query"]:
+                        print(f"Replacing the SQL of example: {duplicate['input']}")
+                        position = next(i for i, other in enumerate(existing) if other is duplicate)
+                        replacements[position] = ({**duplicate, "input": example["input"], "query": example["query"],
+                                                   "source": "accepted", "added_at": time.time()}, vector)
+                        ids.append(duplicate["id"])
+                        continue
+                    if duplicate is None:
+                        duplicate = self._duplicate_of(example, vector, None, fresh)
+                    if duplicate is None:
+                        example = {**example, "id": example.get("id") or uuid.uuid4().hex[:12]}
+                        fresh.append(example)
+                        fresh_vectors.append(vector)
+                        ids.append(example["id"])
+                    else:
+                        print(f"Example already in the bank: {duplicate['input']}")
+                        self._record_usage(duplicate["id"])
+                        ids.append(duplicate["id"])
+                if replacements:
+                    examples_now = list(existing)
+                    vectors_now = np.array(vectors, dtype=np.float32)
+                    for position, (record, vector) in replacements.items():
+                        examples_now[position], vectors_now[position] = record, vector
+                    self._write_all(examples_now, vectors_now, meta)
+                    self._catch_up(self._read_meta())
+                if fresh:
+                    self._append(fresh, np.asarray(fresh_vectors, dtype=np.float32))
+            self._refresh()
+            if self._count() > self.max_examples:
+                self.evict()
+        return ids
+
+    def _record_usage(self, example_id: str):
+        hits, _ = self._pending_usage.get(example_id, (0, 0.0))
+        self._pending_usage[example_id] = (hits + 1, time.time())
+
+    def _read_usage(self) -> dict:
+        if not os.path.exists(self.usage_path):
+            return {}
+        with open(self.usage_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def flush_usage(self):
+        """Merge selection counts gathered in this process into usage.json."""
+        with self._lock:
+            pending, self._pending_usage = self._pending_usage, {}
+            self._usage_flushed_at = time.time()
+        if not pending:
+            return
+        with self._file_lock():
+            usage = self._read_usage()
+            for example_id, (hits, last_used) in pending.items():
+                previous = usage.get(example_id, {"hits": 0, "last_used": 0.0})
+                usage[example_id] = {"hits": previous["hits"] + hits, "last_used": max(previous["last_used"], last_used)}
+            self._write_usage(usage)
+
+    def _write_usage(self, usage: dict):
+        tmp_path = f"{self.usage_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(usage, f)
+        os.replace(tmp_path, self.usage_path)
+
+    def _write_all(self, examples: List[Dict], vectors: np.ndarray, meta: dict):
+        """Rewrite both files and bump the generation so every process reloads them. Caller holds the file lock."""
+        tmp_vectors, tmp_examples = f"{self.vectors_path}.tmp", f"{self.examples_path}.tmp"
+        with open(tmp_vectors, "wb") as f:
+            f.write(vectors.tobytes())
+        with open(tmp_examples, "w", encoding="utf-8") as f:
+            for example in examples:
+                f.write(json.dumps(example) + "\n")
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_examples, self.examples_path)
+        self._write_meta(generation=meta.get("generation", 0) + 1)
+        self._reset()
+        self._generation = None
+
+    def evict(self):
+        """Drop the least-used non-seed examples until the bank is 10% under `max_examples`, then compact."""
+        self.flush_usage()
+        with self._lock, self._file_lock():
+            meta = self._read_meta()
+            self._catch_up(meta)
+            count = self._count()
+            target = int(self.max_examples * 0.9)
+            if count <= self.max_examples:
+                return
+            usage = self._read_usage()
+
+            def rank(example):
+                used = usage.get(example["id"], {"hits": 0, "last_used": 0.0})
+                return used["hits"], max(used["last_used"], example.get("added_at", 0.0))
+
+            candidates = sorted((example for example in self._examples[:count] if example.get("source") != "seed"), key=rank)
+            evicted = {example["id"] for example in candidates[:count - target]}
+            keep = [i for i, example in enumerate(self._examples[:count]) if example["id"] not in evicted]
+            print(f"Evicting {len(evicted)} least-used examples from the example bank")
+
+            vectors = np.asarray(self._vectors[keep], dtype=np.float32)
+            self._write_all([self._examples[i] for i in keep], vectors, meta)
+            self._write_usage({example_id: used for example_id, used in usage.items() if example_id not in evicted})
+        with self._lock:
+            self._refresh()
+
+    def search(self, question: str, k: int = 2):
+        """The `k` most similar examples to `question` as (example, cosine similarity) pairs."""
+        with self._lock:
+            self._refresh()
+            count = self._count()
+            if count == 0:
+                return []
+            vectors, examples = self._vectors[:count], self._examples[:count]
+        query = _normalize(np.asarray(self.embeddings.embed_query(question), dtype=np.float32))
+        scores = np.asarray(vectors @ query)
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        with self._lock:
+            for i in top:
+                self._record_usage(examples[i]["id"])
+            flush = time.time() - self._usage_flushed_at > self.usage_flush_interval
+        if flush:
+            self.flush_usage()
+        return [(examples[i], float(scores[i])) for i in top]
+
+
+class ExampleIndexSelector(BaseExampleSelector):
+    """Few-shot example selector backed by the persistent `ExampleIndex`."""
+
+    def __init__(self, index: ExampleIndex, k: int = 2, input_key: str = "input") -> None:
+        self.index = index
+        self.k = k
+        self.input_key = input_key
+
+    def add_example(self, example: Dict[str, str]):
+        return self.index.add([example])[0]
+
+    def select_examples(self, input_variables: Dict[str, str]) -> List[dict]:
+        matches = self.index.search(input_variables[self.input_key], k=self.k)
+        return [{"input": example["input"], "query": example["query"]} for example, _ in matches]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_example_index(seed_examples: List[Dict] = None) -> ExampleIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            index_config = load_config()["example_index"]
+            _index = ExampleIndex(
+                str(here(index_config["directory"])),
+                get_embeddings(),
+                namespace=get_embeddings_namespace(),
+                seed_examples=seed_examples,
+                max_examples=index_config["max_examples"],
+                dedup_threshold=index_config["dedup_threshold"],
+                usage_flush_interval=index_config["usage_flush_interval"],
+            )
+        return _index
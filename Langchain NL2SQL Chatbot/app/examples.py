@@ -25,18 +25,26 @@ examples = [
     }
 ]
 
-from langchain_community.vectorstores import Chroma
-from langchain_core.example_selectors import SemanticSimilarityExampleSelector
-from langchain_openai import OpenAIEmbeddings
+from example_index import ExampleIndexSelector, get_example_index
+from config import load_config
 import streamlit as st
 
+def render_accept_example(question, sql, key):
+    """👍 button under a generated query; accepted pairs go into the few-shot bank."""
+    if not question or not sql or load_config()["example_bank"]["auto_add"] == "off":
+        return
+    if st.button("👍 Good query", key=f"accept-example-{key}", help="Use this question and query as a few-shot example"):
+        from query_service import learn_example
+
+        learn_example(question, sql, source="accepted")
+        st.toast("Added to the example bank")
+
 @st.cache_resource
 def get_example_selector():
-    example_selector = SemanticSimilarityExampleSelector.from_examples(
-        examples,
-        OpenAIEmbeddings(),
-        Chroma,
-        k=2,
-        input_keys=["input"],
+    # Examples live in a persistent index with precomputed embeddings; the built-in ones seed it once.
+    example_selector = ExampleIndexSelector(
+        get_example_index(seed_examples=examples),
+        k=load_config()["example_index"]["k"],
+        input_key="input",
     )
-    return example_selector
\ No newline at end of file
+    return example_selector
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+MANIFEST_FILE = ".ingestion_manifest.json"
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestionManifest:
+    """
+    Record of which upload files have been loaded into the database.
+
+    One JSON entry per file name with its content hash, row count, target table, load mode and time.
+    The manifest lives next to the uploads so it moves with them, and is rewritten atomically.
+    PrepareVectorDB keeps one for the document store too, with a collection as the "table" and
+    chunks as the "rows".
+    """
+
+    def __init__(self, files_dir: str, file_name: str = MANIFEST_FILE) -> None:
+        self.path = os.path.join(files_dir, file_name)
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    def get(self, file: str):
+        return self.entries.get(file)
+
+    def is_current(self, file: str, sha256: str) -> bool:
+        entry = self.entries.get(file)
+        return entry is not None and entry["sha256"] == sha256
+
+    def record(self, file: str, sha256: str, table: str, rows: int, mode: str, **extra):
+        with self._lock:
+            self.entries[file] = {
+                "sha256": sha256,
+                "table": table,
+                "rows": rows,
+                "mode": mode,
+                "ingested_at": time.time(),
+                **extra,
+            }
+            self.save()
+
+    def remove(self, file: str):
+        with self._lock:
+            if self.entries.pop(file, None) is not None:
+                self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from pyprojroot import here
+
+from config import load_config
+from query_cache import normalize_question
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    cache_key TEXT NOT NULL,
+    question TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    report TEXT,
+    figures TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_cache_key ON jobs (cache_key, status, updated_at);
+CREATE TABLE IF NOT EXISTS job_tasks (
+    job_id TEXT NOT NULL,
+    task_name TEXT NOT NULL,
+    output TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS job_tasks_job_id ON job_tasks (job_id, created_at);
+"""
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+@contextmanager
+def _transaction(db_path: str):
+    """A connection that commits (or rolls back) on exit and is then closed."""
+    conn = _connect(db_path)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def _update_job(db_path: str, job_id: str, **fields):
+    fields["updated_at"] = time.time()
+    assignments = ", ".join(f"{name} = ?" for name in fields)
+    with _transaction(db_path) as conn:
+        conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+
+def _record_task(db_path: str, job_id: str, task_name: str, output):
+    with _transaction(db_path) as conn:
+        conn.execute(
+            "INSERT INTO job_tasks (job_id, task_name, output, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, task_name, str(output), time.time()),
+        )
+
+
+def run_insight_job(db_path: str, job_id: str, question: str):
+    """
+    Worker-process entry point: run the insights crew for one job, persisting each task's output as it
+    completes and the final report plus figures (as Plotly JSON) at the end.
+    """
+    from data_insights_agents import build_data_insights_crew
+
+    _update_job(db_path, job_id, status=RUNNING)
+    figures = []
+    try:
+        crew = build_data_insights_crew(
+            figure_sink=figures,
+            task_callback=lambda name, output: _record_task(db_path, job_id, name, output),
+        )
+        report = crew.kickoff(inputs={"query": question, "messages": []})
+        _update_job(db_path, job_id, status=DONE, report=str(report),
+                    figures=json.dumps([figure.to_json() for figure in figures]))
+    except Exception as e:
+        _update_job(db_path, job_id, status=FAILED, error=str(e))
+
+
+class InsightJobQueue:
+    """
+    Local job queue for Data Insights reports.
+
+    Jobs are persisted in SQLite and executed by a process pool, so a 30-90 s crew run neither blocks
+    the Streamlit worker nor dies with a proxy timeout. Finished reports are cached by normalized
+    question plus schema fingerprint: resubmitting within `cache_ttl_seconds` returns the existing job,
+    and an identical question that is still running is joined rather than started twice.
+    """
+
+    def __init__(self, db_path: str, max_workers: int = 2, cache_ttl_seconds: float = 3600,
+                 timeout_seconds: float = 900) -> None:
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.timeout_seconds = timeout_seconds
+        self._executor_lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with _transaction(db_path) as conn:
+            conn.executescript(SCHEMA)
+            # Jobs that were in flight when the previous process died will never finish.
+            conn.execute("UPDATE jobs SET status = ?, error = ? WHERE status IN (?, ?)",
+                         (FAILED, "Interrupted by a restart", QUEUED, RUNNING))
+        self._executor = self._new_executor()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_broken(self, executor: ProcessPoolExecutor):
+        with self._executor_lock:
+            if self._executor is executor:
+                print("Insight worker pool is broken, starting a new one")
+                self._executor = self._new_executor()
+
+    def _fail_unfinished(self, job_id: str, error: str):
+        """Mark a job failed unless its worker already recorded an outcome."""
+        with _transaction(self.db_path) as conn:
+            conn.execute("UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                         (FAILED, error, time.time(), job_id, QUEUED, RUNNING))
+
+    def _job_finished(self, job_id: str, executor: ProcessPoolExecutor, future):
+        # run_insight_job records its own failures; this catches the ones it never got to, e.g. a worker
+        # that crashed or could not import the crew.
+        error = "Cancelled" if future.cancelled() else future.exception()
+        if error is None:
+            return
+        if isinstance(error, BrokenProcessPool):
+            self._replace_broken(executor)
+        print(f"Insight job {job_id} failed in its worker: {error!r}")
+        self._fail_unfinished(job_id, f"The worker running this report failed: {error}")
+
+    def _start(self, job_id: str, question: str):
+        for attempt in range(2):
+            with self._executor_lock:
+                executor = self._executor
+            try:
+                future = executor.submit(run_insight_job, self.db_path, job_id, question)
+            except BrokenProcessPool:
+                self._replace_broken(executor)
+                if attempt:
+                    raise
+                continue
+            future.add_done_callback(lambda done, executor=executor: self._job_finished(job_id, executor, done))
+            return
+
+    @staticmethod
+    def cache_key(question: str, fingerprint: str) -> str:
+        return hashlib.sha256(f"{fingerprint}:{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def submit(self, question: str, fingerprint: str) -> str:
+        """Queue a report for `question` and return its job id (an existing one on a cache hit)."""
+        cache_key = self.cache_key(question, fingerprint)
+        with _transaction(self.db_path) as conn:
+            # In-flight jobs older than the timeout are presumed dead and not joined.
+            existing = conn.execute(
+                "SELECT id FROM jobs WHERE cache_key = ? AND "
+                "((status IN (?, ?) AND created_at > ?) OR (status = ? AND updated_at > ?)) "
+                "ORDER BY updated_at DESC LIMIT 1",
+                (cache_key, QUEUED, RUNNING, time.time() - self.timeout_seconds,
+                 DONE, time.time() - self.cache_ttl_seconds),
+            ).fetchone()
+            if existing is not None:
+                print("Reusing insight job", existing["id"])
+                return existing["id"]
+            job_id = uuid.uuid4().hex[:12]
+            now = time.time()
+            conn.execute(
+                "INSERT INTO jobs (id, cache_key, question, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, cache_key, question, QUEUED, now, now),
+            )
+        try:
+            self._start(job_id, question)
+        except Exception as e:
+            self._fail_unfinished(job_id, f"Could not start the report: {e}")
+        return job_id
+
+    def get(self, job_id: str):
+        """Job status, report, figures (Plotly JSON strings) and completed task outputs, or None."""
+        with _transaction(self.db_path) as conn:
+            job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            tasks = conn.execute(
+                "SELECT task_name, output, created_at FROM job_tasks WHERE job_id = ? ORDER BY created_at",
+                (job_id,),
+            ).fetchall()
+        job = dict(job)
+        job["figures"] = json.loads(job["figures"]) if job["figures"] else []
+        job["tasks"] = [dict(task) for task in tasks]
+        return job
+
+    def wait(self, job_id: str, status, poll_interval: float = 1.0, timeout: float = None):
+        """
+        Poll a job from a page, writing each finished task into `status`, until it is done or failed.
+        A job still unfinished `timeout` seconds (the queue's timeout by default) after it was created
+        is marked failed.
+        """
+        timeout = timeout or self.timeout_seconds
+        seen = 0
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                return {"id": job_id, "status": FAILED, "error": "Unknown report job", "figures": [], "tasks": []}
+            if job["status"] not in (DONE, FAILED) and time.time() - job["created_at"] > timeout:
+                self._fail_unfinished(job_id, f"Timed out after {timeout:.0f}s")
+                job = self.get(job_id)
+            for task in job["tasks"][seen:]:
+                status.write(f"Finished `{task['task_name']}`")
+            seen = len(job["tasks"])
+            if job["status"] in (DONE, FAILED):
+                return job
+            time.sleep(poll_interval)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_insight_job_queue() -> InsightJobQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            jobs_config = load_config()["insight_jobs"]
+            _queue = InsightJobQueue(
+                str(here(jobs_config["db_path"])),
+                max_workers=jobs_config["max_workers"],
+                cache_ttl_seconds=jobs_config["cache_ttl_seconds"],
+                timeout_seconds=jobs_config["timeout_seconds"],
+            )
+        return _queue
@@ -0,0 +1,202 @@
+import os
+import re
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import List
+
+from config import load_config
+from ingestion_manifest import IngestionManifest
+from schema_catalog import get_schema_catalog
+
+WORD_PATTERN = re.compile(r"[A-Za-z][a-z]*|\d+")
+
+
+@dataclass(frozen=True)
+class JoinEdge:
+    table: str
+    columns: tuple
+    referred_table: str
+    referred_columns: tuple
+    inferred: bool = False
+
+    def condition(self) -> str:
+        return " AND ".join(
+            f"{self.table}.{column} = {self.referred_table}.{referred}"
+            for column, referred in zip(self.columns, self.referred_columns)
+        )
+
+    def other(self, table: str) -> str:
+        return self.referred_table if table == self.table else self.table
+
+
+def _words(name: str) -> set:
+    """Lower-cased words of an identifier: customerNumber -> {customer, number}, credit_limit -> {credit, limit}."""
+    return {word.lower() for word in WORD_PATTERN.findall(name)}
+
+
+class JoinGraph:
+    """
+    Undirected graph of the schema's join paths.
+
+    Edges come from the reflected foreign keys plus the keys inferred for uploaded tables (recorded in
+    the ingestion manifest), and the graph is rebuilt only when the schema fingerprint changes. It
+    answers shortest join paths between tables, connects a set of tables through the intermediate
+    tables they need, and renders table info that leaves out the columns a question does not need.
+    """
+
+    def __init__(self, catalog, manifest_dir: str = None, max_columns_unpruned: int = 12) -> None:
+        self.catalog = catalog
+        self.manifest_dir = manifest_dir
+        self.max_columns_unpruned = max_columns_unpruned
+        self._fingerprint = None
+        self._edges = {}
+        self._lock = threading.Lock()
+
+    def _inferred_foreign_keys(self) -> List[JoinEdge]:
+        if not self.manifest_dir or not os.path.isdir(self.manifest_dir):
+            return []
+        edges = []
+        for entry in IngestionManifest(self.manifest_dir).entries.values():
+            for fk in entry.get("foreign_keys", []):
+                edges.append(JoinEdge(entry["table"], (fk["column"],), fk["referred_table"], (fk["referred_column"],), inferred=True))
+        return edges
+
+    def _build(self):
+        tables = set(self.catalog.list_tables())
+        edges = {table: [] for table in tables}
+        seen = set()
+
+        def add(edge: JoinEdge):
+            key = (edge.table, edge.columns, edge.referred_table, edge.referred_columns)
+            if key in seen or edge.table not in tables or edge.referred_table not in tables:
+                return
+            seen.add(key)
+            edges[edge.table].append(edge)
+            edges[edge.referred_table].append(edge)
+
+        for table in tables:
+            for fk in self.catalog.get_foreign_keys(table):
+                add(JoinEdge(table, tuple(fk["constrained_columns"]), fk["referred_table"], tuple(fk["referred_columns"])))
+        for edge in self._inferred_foreign_keys():
+            add(edge)
+        return edges
+
+    @property
+    def edges(self) -> dict:
+        fingerprint = self.catalog.fingerprint()
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                self._edges = self._build()
+                self._fingerprint = fingerprint
+                print(f"Join graph built: {sum(len(e) for e in self._edges.values()) // 2} edges")
+            return self._edges
+
+    def shortest_path(self, source: str, target: str) -> List[JoinEdge]:
+        """Edges of the shortest join path from `source` to `target` (BFS); None if they are not connected."""
+        edges = self.edges
+        if source not in edges or target not in edges:
+            return None
+        previous = {source: None}
+        queue = deque([source])
+        while queue:
+            table = queue.popleft()
+            if table == target:
+                break
+            for edge in edges[table]:
+                other = edge.other(table)
+                if other not in previous:
+                    previous[other] = (table, edge)
+                    queue.append(other)
+        if target not in previous:
+            return None
+        path = []
+        table = target
+        while previous[table] is not None:
+            table, edge = previous[table]
+            path.append(edge)
+        return list(reversed(path))
+
+    def connect(self, tables: List[str]):
+        """
+        `tables` plus the intermediate tables needed to join them, and the edges used: the union of
+        shortest paths from the first table to each other one.
+        """
+        if not tables:
+            return [], []
+        connected, used = list(tables), []
+        for table in tables[1:]:
+            for edge in self.shortest_path(tables[0], table) or []:
+                if edge not in used:
+                    used.append(edge)
+                for name in (edge.table, edge.referred_table):
+                    if name not in connected:
+                        connected.append(name)
+        return connected, used
+
+    def describe_path(self, source: str, target: str) -> str:
+        path = self.shortest_path(source, target)
+        if path is None:
+            return f"No join path between {source} and {target}."
+        if not path:
+            return f"{source} is the same table as {target}."
+        lines, current = [source], source
+        for edge in path:
+            current = edge.other(current)
+            lines.append(f"JOIN {current} ON {edge.condition()}" + (" -- inferred key" if edge.inferred else ""))
+        return "\n".join(lines)
+
+    def _pruned_table_info(self, table: str, columns: List[dict], connected: List[str], question_words: set) -> str:
+        """CREATE TABLE with only the key columns, name-like columns and the columns the question mentions."""
+        primary_key = self.catalog.get_primary_key(table)
+        keys = set(primary_key)
+        for edge in self.edges.get(table, []):
+            keys.update(edge.columns if edge.table == table else edge.referred_columns)
+        kept = [column for column in columns
+                if column["name"] in keys or _words(column["name"]) & question_words or "name" in _words(column["name"])]
+        lines = [f"\t{column['name']} {column['type']}" for column in kept]
+        if primary_key:
+            lines.append(f"\tPRIMARY KEY ({', '.join(primary_key)})")
+        for edge in self.edges.get(table, []):
+            if edge.table == table and edge.referred_table in connected:
+                lines.append(f"\tFOREIGN KEY({', '.join(edge.columns)}) REFERENCES "
+                             f"{edge.referred_table} ({', '.join(edge.referred_columns)})")
+        return (f"CREATE TABLE {table} (\n" + ",\n".join(lines) + "\n)\n"
+                f"/* {len(columns) - len(kept)} more columns omitted */")
+
+    def table_info(self, tables: List[str], question: str = "") -> str:
+        """
+        Schema text for `{table_info}`: the selected tables plus any intermediate tables needed to join
+        them, followed by the join paths. Tables wider than `max_columns_unpruned` are cut down to their
+        keys and the columns whose names overlap the question; the rest keep the full DDL and sample rows.
+        """
+        connected, used = self.connect(tables)
+        question_words = _words(question)
+        question_words |= {word.rstrip("s") for word in question_words}
+        blocks = []
+        for table in connected:
+            columns = self.catalog.get_columns(table)
+            if len(columns) > self.max_columns_unpruned:
+                blocks.append(self._pruned_table_info(table, columns, connected, question_words))
+            else:
+                blocks.append(self.catalog.get_table_info([table]))
+        if used:
+            blocks.append("Join paths:\n" + "\n".join(
+                f"- {edge.condition()}" + (" (inferred key)" if edge.inferred else "") for edge in used))
+        return "\n\n".join(blocks)
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_join_graph() -> JoinGraph:
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            graph_config = load_config()["join_graph"]
+            _graph = JoinGraph(
+                get_schema_catalog(),
+                manifest_dir=graph_config["manifest_dir"],
+                max_columns_unpruned=graph_config["max_columns_unpruned"],
+            )
+        return _graph
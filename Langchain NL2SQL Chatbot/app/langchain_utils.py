@@ -12,7 +12,7 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 LANGCHAIN_TRACING_V2 = os.getenv("LANGCHAIN_TRACING_V2")
 LANGCHAIN_API_KEY = os.getenv("LANGCHAIN_API_KEY")
 
-from langchain_community.utilities.sql_database import SQLDatabase
+from db_engine import get_sql_database
 from langchain.chains import create_sql_query_chain
 from langchain_openai import ChatOpenAI
 from langchain_community.tools.sql_database.tool import QuerySQLDataBaseTool
@@ -43,7 +43,7 @@ def get_llm():
 @st.cache_resource
 def get_chain():
     print("Creating chain")
-    db = SQLDatabase.from_uri(f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}")
+    db = get_sql_database()
     llm = get_llm()
     generate_query = create_sql_query_chain(llm, db, final_prompt) 
     
@@ -1,12 +1,18 @@
 import streamlit as st
 from openai import OpenAI
-from sql_query_agents import sql_crew
 from nosql_agents import sql_crew_nosql
 import os
 import pandas as pd
 from pyprojroot import here
 import yaml
 from tools import display_table
+from query_service import arun_sql_query, run_sql_query, split_response, SQL_MODES
+from async_service import get_async_service, get_job, wait_for_job
+from result_store import is_result_reference
+from result_view import render_result
+from examples import render_accept_example
+from config import load_config
+from value_index import get_value_index
 
 import pandas as pd
 from prepare_sql_db import PrepareSQLFromTabularData
@@ -21,6 +27,10 @@ db_name = os.getenv("db_name")
 STREAMLIT = os.getenv("STREAMLIT")
 client = OpenAI(api_key=STREAMLIT)
 
+# Index the database's text values for entity linking while the user is still typing.
+if load_config()["value_index"]["enabled"]:
+    get_value_index().warm_up()
+
 # Set a default model
 if "openai_model" not in st.session_state:
     st.session_state["openai_model"] = "gpt-3.5-turbo"
@@ -174,46 +184,86 @@ with st.sidebar:
         "Search Mode", options=["SQL Query", "Update Databases", "Structured Data Analysis"], index=0
     )
     st.info(mode_descriptions[mode][0])
+    sql_mode = st.radio(
+        "SQL Execution Mode", options=list(SQL_MODES),
+        index=SQL_MODES.index(load_config()["primary_agent"]["sql_mode"])
+    )
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
-def sql_query_agent(inputs):
+def run_on_async_service(inputs, sql_mode=None, job=None):
+    """Submit the question to the async execution service (or resume `job`) and stream its progress."""
+    if job is None:
+        job = get_async_service().submit("sql_query", arun_sql_query, inputs, sql_mode)
+    st.session_state.pending_sql_job = job.id
+    with st.status("Working on your question...") as status:
+        try:
+            response = wait_for_job(job, status)
+        except Exception:
+            st.session_state.pending_sql_job = None
+            status.update(label="Query failed", state="error")
+            raise
+        status.update(label="Query finished", state="complete")
+    st.session_state.pending_sql_job = None
+    return response
+
+def last_question():
+    """The latest user message, i.e. the question a resumed job is answering."""
+    for message in reversed(st.session_state.messages):
+        if message["role"] == "user":
+            return message["content"]
+    return None
+
+def sql_query_agent(inputs, sql_mode=None, job=None):
     try:
-        response = sql_crew.kickoff(inputs=inputs)
+        if job is not None or load_config()["async_execution"]["enabled"]:
+            response = run_on_async_service(inputs, sql_mode, job)
+        else:
+            response = run_sql_query(inputs, mode=sql_mode)
 
         print("response", response)
         
         # Parse query and results
-        if "QUERY:" in response and "RESULTS:" in response:
-            parts = response.split("RESULTS:")
-            query_part = parts[0].replace("QUERY:", "").strip()
-            results = parts[1].strip().replace("`", "").replace(";\n", "\n").strip()
-            
+        query_part, results = split_response(response)
+        if query_part is not None:
             # Display the SQL query
             st.markdown("The following query was executed:")
             st.markdown("```sql\n" + query_part + "\n```")
             # st.code(query_part, language="sql")
-            
-            # Display the results in a table
-            df = display_table.run(results)
-            st.dataframe(
-                df,
-                use_container_width=True,
-                hide_index=True
-            )
-            
-            # Save in session state
+            question = inputs["query"] if inputs else last_question()
+            render_accept_example(question, query_part, key=len(st.session_state.messages))
             st.session_state.messages.append({
                 "role": "assistant",
                 "content": "```sql\n" + query_part + "\n```",
-                "type": "markdown"
-            })
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": df,
-                "type": "dataframe"
+                "type": "markdown",
+                "question": question,
+                "sql": query_part
             })
+
+            if is_result_reference(results):
+                # Rows stay in the result store; page through them instead of re-parsing text
+                reference = results.strip().strip("`").split()[0]
+                render_result(reference, key=len(st.session_state.messages))
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": reference,
+                    "type": "result"
+                })
+            else:
+                results = results.replace("`", "").replace(";\n", "\n").strip()
+                # Display the results in a table
+                df = display_table.run(results)
+                st.dataframe(
+                    df,
+                    use_container_width=True,
+                    hide_index=True
+                )
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": df,
+                    "type": "dataframe"
+                })
         else:
             st.markdown(response)
             st.session_state.messages.append({
@@ -245,7 +295,7 @@ def update_databases_agent(inputs):
         
         # Run your pipeline to create the SQL database from the uploaded file(s)
         pipeline = PrepareSQLFromTabularData(upload_dir)
-        pipeline.run_pipeline()
+        st.success(pipeline.run_pipeline())
 
     # Add the functionality of the agent
 
@@ -257,12 +307,14 @@ def get_recent_messages(messages, limit=10):
     return messages[-limit:] if len(messages) > limit else messages
 
 # Display chat messages from history on app rerun
-for message in st.session_state.messages:
+for index, message in enumerate(st.session_state.messages):
     with st.chat_message(message["role"]):
         if "visualization" in message:
             st.components.v1.html(message["visualization"], height=500)
         elif message["type"] == "markdown":
             st.markdown(message["content"])
+            if "sql" in message:
+                render_accept_example(message["question"], message["sql"], key=index)
         elif message["type"] == "image":
             st.image(message["content"],
                      use_container_width=True)
@@ -272,9 +324,17 @@ for message in st.session_state.messages:
                 use_container_width=True,
                 hide_index=True
             )
+        elif message["type"] == "result":
+            render_result(message["content"], key=index)
         else:
             st.markdown(message["content"])
 
+# Pick up a question whose job was still running when the page re-ran
+pending_job = get_job(st.session_state.get("pending_sql_job"))
+if pending_job is not None:
+    with st.chat_message("assistant"):
+        sql_query_agent(None, job=pending_job)
+
 # Accept user input
 if prompt := st.chat_input("Ask me anything about the database"):
     st.session_state.messages.append({"role": "user", "content": prompt, "type": "markdown"})
@@ -291,7 +351,7 @@ if prompt := st.chat_input("Ask me anything about the database"):
                 }
                 print(mode)
                 if mode == "SQL Query":
-                    sql_query_agent(inputs)
+                    sql_query_agent(inputs, sql_mode)
                 elif mode == "Update Databases":
                     uploaded_file = st.file_uploader("Upload a CSV or XLSX file to create new tables", type=["csv", "xlsx"])
                     if uploaded_file:
@@ -307,7 +367,7 @@ if prompt := st.chat_input("Ask me anything about the database"):
                         print("Done here")
                         # Run your pipeline to create the SQL database from the uploaded file(s)
                         pipeline = PrepareSQLFromTabularData(upload_dir)
-                        pipeline.run_pipeline()
+                        st.success(pipeline.run_pipeline())
                 elif mode == "Structured Data Analysis":
                     # structured_data_analysis_agent(inputs)
                     pass
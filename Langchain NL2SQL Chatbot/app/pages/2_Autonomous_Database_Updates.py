@@ -2,8 +2,9 @@ import streamlit as st
 import os
 import yaml
 from pyprojroot import here
-from prepare_sql_db import PrepareSQLFromTabularData
+from prepare_sql_db import INGESTION_MODES, PrepareSQLFromTabularData
 from prepare_vector_db import PrepareVectorDB
+from schema_diagram import get_schema_diagram_renderer
 
 st.set_page_config(
     page_title="Autonomous Database Updates",
@@ -18,7 +19,26 @@ st.write("Upload any csv or xlsx to automatically update your database")
 
 # Structured data upload
 # st.header("Upload Structured Data")
-st.image('database_schema_diagram_old.jpeg')
+diagram_renderer = get_schema_diagram_renderer()
+# Show whatever was rendered last straight away; a newer diagram appears on the next rerun once it is ready.
+st.image(diagram_renderer.latest() or 'database_schema_diagram_old.jpeg')
+if diagram_renderer.is_rendering():
+    st.caption("The schema diagram is being updated in the background.")
+else:
+    diagram_renderer.render_async()
+diagram_tables = st.session_state.get("diagram_tables")
+if diagram_tables:
+    # Same key as PrepareSQLFromTabularData._visualize_schema: one subgraph for all loaded tables.
+    subgraph = diagram_renderer.cached(diagram_tables)
+    if subgraph:
+        st.image(subgraph, caption=f"{', '.join(diagram_tables)} and related tables")
+ingestion_mode = st.radio(
+    "Ingestion Mode",
+    INGESTION_MODES,
+    horizontal=True,
+    help="replace: recreate the table from the file. append: insert only rows added since the last upload. "
+         "upsert: insert rows, updating those whose key already exists.",
+)
 uploaded_file = st.file_uploader("Upload CSV or XLSX file", type=["csv", "xlsx"])
 if uploaded_file:
     try:
@@ -29,10 +49,13 @@ if uploaded_file:
         with open(file_path, "wb") as f:
             f.write(uploaded_file.getbuffer())
         
-        pipeline = PrepareSQLFromTabularData(upload_dir)
+        pipeline = PrepareSQLFromTabularData(upload_dir, mode=ingestion_mode)
         with st.spinner("Processing data..."):
             result = pipeline.run_pipeline()
             st.success(result)
+        if pipeline.loaded_tables:
+            st.session_state.diagram_tables = pipeline.loaded_tables
+            st.caption("Updated schema diagrams are rendering in the background.")
         
     except Exception as e:
         st.error(f"Error processing file: {str(e)}")
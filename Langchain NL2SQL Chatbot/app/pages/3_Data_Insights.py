@@ -1,5 +1,11 @@
 import streamlit as st
-from data_insights_agents import data_insights_crew
+from data_insights_agents import arun_data_insights, build_data_insights_crew
+from async_service import get_async_service, wait_for_job
+from config import load_config
+from value_index import get_value_index
+from insight_jobs import get_insight_job_queue
+from schema_catalog import get_schema_catalog
+import plotly.io as pio
 from tools import display_table
 
 import streamlit as st
@@ -15,6 +21,7 @@ from tools import display_table
 import pandas as pd
 from prepare_sql_db import PrepareSQLFromTabularData
 from prepare_vector_db import PrepareVectorDB
+from vector_store import get_vector_store
 
 db_user = os.getenv("db_user")
 db_password = os.getenv("db_password")
@@ -26,6 +33,13 @@ st.set_page_config(
     page_icon="📈",
 )
 
+# Reports may look up documents; open the vector store while the user is still typing.
+get_vector_store().warm_up()
+
+# Index the database's text values for entity linking while the user is still typing.
+if load_config()["value_index"]["enabled"]:
+    get_value_index().warm_up()
+
 # Set OpenAI API key from Streamlit secrets
 STREAMLIT = os.getenv("STREAMLIT")
 client = OpenAI(api_key=STREAMLIT)
@@ -60,11 +74,40 @@ def display_analysis_content(content):
     else:
         st.markdown(content)
 
+def insight_job_content(job):
+    if job["status"] == "failed":
+        return [{"type": "markdown", "data": f"An error occurred: {job['error']}"}]
+    content = [{"type": "visualization", "data": pio.from_json(figure)} for figure in job["figures"]]
+    content.append({"type": "markdown", "data": job["report"]})
+    return content
+
+def run_insight_job(prompt=None, job_id=None):
+    """Queue the report (or resume `job_id`) on the background job queue and follow it until it finishes."""
+    job_queue = get_insight_job_queue()
+    if job_id is None:
+        job_id = job_queue.submit(prompt, get_schema_catalog().fingerprint())
+    st.session_state.pending_insight_job = job_id
+    with st.status("Running the insights crew in the background...") as status:
+        job = job_queue.wait(job_id, status, poll_interval=load_config()["insight_jobs"]["poll_interval"])
+        if job["status"] == "done":
+            status.update(label="Report ready", state="complete")
+        else:
+            status.update(label="Report failed", state="error")
+    st.session_state.pending_insight_job = None
+    return insight_job_content(job)
+
 # Display analysis history
 for message in st.session_state.analysis_messages:
     with st.chat_message(message["role"]):
         display_analysis_content(message["content"])
 
+# Pick up a report that was still running when the page re-ran
+if st.session_state.get("pending_insight_job"):
+    with st.chat_message("assistant"):
+        content = run_insight_job(job_id=st.session_state.pending_insight_job)
+        st.session_state.analysis_messages.append({"role": "assistant", "content": content})
+        display_analysis_content(content)
+
 # Analysis input
 if prompt := st.chat_input("What would you like to analyze?"):
     st.session_state.analysis_messages.append({"role": "user", "content": prompt, "type": "markdown"})
@@ -75,12 +118,25 @@ if prompt := st.chat_input("What would you like to analyze?"):
     with st.chat_message("assistant"):
         with st.spinner("Analyzing data..."):
             try:
-                response = data_insights_crew.kickoff(inputs={"query": prompt, "messages": []})
+                inputs = {"query": prompt, "messages": []}
+                if load_config()["insight_jobs"]["enabled"]:
+                    content = run_insight_job(prompt)
+                else:
+                    if load_config()["async_execution"]["enabled"]:
+                        job = get_async_service().submit("data_insights", arun_data_insights, inputs)
+                        with st.status("Running the insights crew...") as status:
+                            response, figures = wait_for_job(job, status)
+                            status.update(label="Report ready", state="complete")
+                    else:
+                        figures = []
+                        response = str(build_data_insights_crew(figure_sink=figures).kickoff(inputs=inputs))
+                    content = [{"type": "visualization", "data": fig} for fig in figures]
+                    content.append({"type": "markdown", "data": response})
                 st.session_state.analysis_messages.append({
                     "role": "assistant",
-                    "content": [{"type": "markdown", "data": response}]
+                    "content": content
                 })
-                st.markdown(response)
+                display_analysis_content(content)
                 
             except Exception as e:
                 error_message = f"An error occurred: {str(e)}"
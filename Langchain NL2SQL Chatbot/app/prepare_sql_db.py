@@ -1,9 +1,13 @@
 import os
-import pandas as pd
-from sqlalchemy import create_engine, inspect
+from config import load_config
+from db_engine import get_engine
+from ingestion_manifest import MANIFEST_FILE, IngestionManifest, file_sha256
+from tabular_importer import INGESTION_MODES, get_tabular_importer
+from schema_catalog import get_schema_catalog
+from schema_diagram import get_schema_diagram_renderer
+from value_index import get_value_index
+from sqlalchemy import inspect
 import streamlit as st
-from sqlalchemy import create_engine, MetaData
-from sqlalchemy_schemadisplay import create_schema_graph
 
 db_user = os.getenv("db_user")
 db_password = os.getenv("db_password")
@@ -13,80 +17,115 @@ db_name = os.getenv("db_name")
 class PrepareSQLFromTabularData:
     """
     A class that prepares a SQL database from CSV or XLSX files within a specified directory.
+
+    Only files that are new or whose content changed since the last run (per the ingestion manifest)
+    are loaded. `mode` decides how a file reaches its table:
+    - replace: drop and recreate the table from the file.
+    - append: insert the rows added to the file since it was last ingested (the whole file if new).
+    - upsert: insert every row, updating rows whose primary/unique key already exists. Upserting into an
+      existing table without such a key is refused, since every row would silently be appended.
     """
-    
-    def __init__(self, files_dir) -> None:
-        print(db_user, db_password, db_host, db_name)
+
+    def __init__(self, files_dir, mode: str = None) -> None:
         self.files_directory = files_dir
-        self.file_dir_list = os.listdir(files_dir)
-        self.db = create_engine(f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}")
-        st.write("Connected to MySQL database at localhost.")
+        self.file_dir_list = [file for file in os.listdir(files_dir) if not file.startswith(MANIFEST_FILE)]
+        self.mode = mode or load_config()["sql_ingestion"]["mode"]
+        if self.mode not in INGESTION_MODES:
+            raise ValueError(f"Unknown ingestion mode {self.mode!r}, expected one of {INGESTION_MODES}")
+        self.manifest = IngestionManifest(files_dir)
+        self.db = get_engine()
+        self.importer = get_tabular_importer(self.db)
+        self.loaded_tables = []
+        st.write(f"Connected to MySQL database at {db_host}.")
+
+    def _has_key(self, table: str) -> bool:
+        insp = inspect(self.db)
+        if not insp.has_table(table):
+            # A new table is created by the load itself (with inferred keys when enabled).
+            return True
+        return bool(insp.get_pk_constraint(table).get("constrained_columns") or insp.get_unique_constraints(table))
+
+    def _load_file(self, file: str, full_file_path: str, table: str, sha256: str) -> int:
+        previous = self.manifest.get(file)
+        skip_rows = 0
+        if self.mode == "append" and previous is not None and previous["table"] == table:
+            # Uploads in append mode are treated as growing logs: only the new tail is inserted.
+            skip_rows = previous["rows"]
+        if self.mode == "upsert" and not self._has_key(table):
+            raise ValueError(f"Cannot upsert {file}: table {table} has no primary or unique key to match rows on. "
+                             f"Add a key to {table}, or load the file with mode replace or append.")
+
+        stats = self.importer.import_file(full_file_path, table, mode=self.mode, skip_rows=skip_rows)
+        st.write(f"Loaded {file}: {stats}")
+        schema = {}
+        if stats.schema is not None:
+            st.caption(stats.schema.describe())
+            schema = dict(
+                primary_key=stats.schema.primary_key,
+                foreign_keys=[fk.to_dict() for fk in stats.schema.foreign_keys],
+                indexes=stats.schema.indexes,
+            )
+        elif previous is not None:
+            # Appends and upserts keep the keys inferred when the table was created.
+            schema = {name: previous[name] for name in ("primary_key", "foreign_keys", "indexes") if name in previous}
+        self.manifest.record(file, sha256, table=table, rows=skip_rows + stats.rows, mode=self.mode,
+                             rows_per_second=round(stats.rows_per_second), **schema)
+        return stats.rows
 
     def _prepare_db(self):
+        loaded, skipped, rejected = [], [], []
+        self.loaded_tables = []
         for file in self.file_dir_list:
             full_file_path = os.path.join(self.files_directory, file)
             file_name, file_extension = os.path.splitext(file)
-            if file_extension == ".csv":
-                df = pd.read_csv(full_file_path)
-            elif file_extension == ".xlsx":
-                df = pd.read_excel(full_file_path)
-            else:
+            if file_extension not in (".csv", ".xlsx"):
                 st.error(f"Unsupported file type for file: {file}")
                 continue
-            df.to_sql(file_name, self.db, index=False, if_exists="replace")
-        st.success("All files have been saved into the SQL database.")
+            sha256 = file_sha256(full_file_path)
+            if self.manifest.is_current(file, sha256):
+                skipped.append(file)
+                continue
+            try:
+                rows = self._load_file(file, full_file_path, file_name, sha256)
+            except ValueError as e:
+                st.error(str(e))
+                rejected.append(file)
+                continue
+            get_schema_catalog().invalidate(file_name)
+            self.loaded_tables.append(file_name)
+            print(f"Ingested {file} into {file_name} ({self.mode}, {rows} rows)")
+            loaded.append(f"{file} ({rows} rows)")
+        not_loaded = f" Not loaded: {', '.join(rejected)}." if rejected else ""
+        if not loaded:
+            return f"No new or changed files loaded; {len(skipped)} already ingested.{not_loaded}"
+        return (f"Saved {', '.join(loaded)} into the SQL database ({self.mode}); "
+                f"{len(skipped)} unchanged files skipped.{not_loaded}")
 
     def _validate_db(self):
-        insp = inspect(self.engine)
+        insp = inspect(self.db)
         table_names = insp.get_table_names()
         st.info("Available tables in SQL DB: " + ", ".join(table_names))
 
     def _visualize_schema(self):
-        print("Visualizing schema")
-        metadata = MetaData()
-        metadata.reflect(bind=self.db)
-
-        # Define styling options
-        relation_options = {
-            "color": "#008080",  # Foreign key relationship lines
-            "penwidth": "1.5"
-        }
-
-        format_table_name = {
-            "color": "blue",  # Green table name text
-            "fontsize": 14,
-            "bold": True
-        }
-
-        # Generate the schema graph with styling
-        graph = create_schema_graph(metadata=metadata,
-                                    engine=self.db,
-                                    show_datatypes=False,
-                                    show_indexes=False,
-                                    rankdir='LR',
-                                    concentrate=True,
-                                    relation_options=relation_options,
-                                    format_table_name=format_table_name)
-        
-        print("Graph created")
-
-        graph.set("label",  "Schema Diagram -- "+ db_name) 
-        graph.set("fontsize", "20")  
-        graph.set("labelloc", "t")  
-        graph.set("fontcolor", "black")
-
-
-
+        """Queue background renders of the loaded tables' neighbourhood and of the full diagram."""
+        renderer = get_schema_diagram_renderer()
+        if self.loaded_tables:
+            renderer.render_async(self.loaded_tables)
+        renderer.render_async()
 
-        graph.write_png('database_schema_diagram.png')
-        print("HERE")
-        st.image('database_schema_diagram.png')
-        # st.session_state.messages.append({
-        #     "role": "assistant",
-        #     "content": "database_schema_diagram.png",
-        #     "type": "image"
-        # })
+    def _refresh_value_index(self):
+        """Rescan the loaded tables' distinct text values so entity linking sees the new rows."""
+        if not load_config()["value_index"]["enabled"]:
+            return
+        index = get_value_index()
+        for table in self.loaded_tables:
+            try:
+                index.refresh(table)
+            except Exception as e:
+                print(f"Value index refresh failed for {table}: {e}")
 
     def run_pipeline(self):
-        self._prepare_db()
-        self._visualize_schema()
\ No newline at end of file
+        result = self._prepare_db()
+        self._refresh_value_index()
+        self._visualize_schema()
+        return result
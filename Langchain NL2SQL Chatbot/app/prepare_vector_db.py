@@ -1,72 +1,375 @@
+import hashlib
+import multiprocessing
 import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pyprojroot import here
 from langchain_chroma import Chroma
 from langchain_community.document_loaders import PyPDFLoader
-from langchain_openai import OpenAIEmbeddings
+from bm25_index import BM25_FILE, BM25Index
+from config import load_config
+from embeddings import get_embeddings, get_embeddings_namespace
+from ingestion_manifest import IngestionManifest, file_sha256
+from vector_store import COLLECTION_METADATA, get_vector_store
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+VECTOR_MANIFEST_FILE = ".vector_manifest.json"
+SUPPORTED_EXTENSIONS = (".pdf", ".txt")
+_STOP = object()
+_POLL_SECONDS = 0.5
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put unless the pipeline was stopped; False means nobody will take the item."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL_SECONDS)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL_SECONDS)
+        except queue.Empty:
+            continue
+    return _STOP
+
+
+def chunk_ids(file_name: str, chunks) -> list:
+    """
+    Stable id per chunk: a hash of the file name and the chunk's text, so an unchanged chunk keeps its
+    id (and its stored embedding) when other parts of the file are edited. Repeated identical chunks
+    within a file are told apart by their occurrence number.
+    """
+    ids, seen = [], {}
+    for chunk in chunks:
+        content_hash = hashlib.sha256(chunk.page_content.encode("utf-8")).hexdigest()
+        occurrence = seen.get(content_hash, 0)
+        seen[content_hash] = occurrence + 1
+        ids.append(hashlib.sha256(f"{file_name}\0{content_hash}\0{occurrence}".encode("utf-8")).hexdigest()[:32])
+    return ids
+
+
+_splitters = {}
+
+
+def parse_file(path: str, fn: str, chunk_size: int, chunk_overlap: int):
+    """
+    Load and split one document; runs in the parser processes.
+    Returns (fn, pages, chunks) with chunks as (id, text, metadata, tokens) tuples.
+    """
+    if (chunk_size, chunk_overlap) not in _splitters:
+        _splitters[chunk_size, chunk_overlap] = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        )
+    text_splitter = _splitters[chunk_size, chunk_overlap]
+    # Choose the appropriate loader based on the file extension
+    if fn.endswith(".pdf"):
+        loader = PyPDFLoader(path)
+    else:
+        from langchain.document_loaders import TextLoader
+        loader = TextLoader(path)
+    docs = loader.load_and_split()
+    doc_splits = text_splitter.split_documents(docs)
+    chunks = [(chunk_id, split.page_content, split.metadata, text_splitter._length_function(split.page_content))
+              for chunk_id, split in zip(chunk_ids(fn, doc_splits), doc_splits)]
+    return fn, len(docs), chunks
+
+
+class _FileTracker:
+    """Counts each file's chunks still in flight and records it in the manifest once all are written."""
+
+    def __init__(self, manifest: IngestionManifest) -> None:
+        self.manifest = manifest
+        self._pending = {}
+        self._entries = {}
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def start(self, fn: str, new_chunks: int, **entry):
+        with self._lock:
+            self._pending[fn] = new_chunks
+            self._entries[fn] = entry
+        self.done(fn, 0)
+
+    def done(self, fn: str, chunks: int):
+        with self._lock:
+            self._pending[fn] -= chunks
+            if self._pending[fn] or fn in self._failed:
+                return
+            entry = self._entries.pop(fn)
+        self.manifest.record(fn, **entry)
+
+    def fail(self, fns):
+        with self._lock:
+            self._failed.update(fns)
+
+
 class PrepareVectorDB:
+    """
+    Incrementally syncs the documents in `doc_dir` into the Chroma collection.
+
+    A manifest next to the vector DB records each file's content hash and chunk ids. Unchanged files
+    are skipped without being loaded; a changed file is re-split and only chunks whose ids are not
+    already stored get embedded, while its chunks that disappeared are deleted. Files removed from
+    `doc_dir` have all their chunks deleted. Changing the chunking settings re-splits every file, and
+    changing the vector-store embedding model, or a collection created before cosine distance was
+    used, rebuilds the collection.
+
+    Ingestion is pipelined (`vector_ingestion` in the config): a process pool parses and splits
+    documents, new chunks are grouped into embedding requests of at most `embed_batch_tokens` tokens,
+    and embedder and writer threads connected by bounded queues embed the batches and upsert them
+    into Chroma concurrently. A file is recorded in the manifest only once all its chunks are written,
+    so an interrupted run picks up where it stopped.
+
+    The BM25 keyword index next to the collection is kept in step: written chunks are added to it,
+    deleted chunks removed, and it is rebuilt from the collection when missing.
+    """
+
     def __init__(self,
                  doc_dir: str,
                  chunk_size: int,
                  chunk_overlap: int,
-                 embedding_model: str,
                  vectordb_dir: str,
                  collection_name: str
                  ) -> None:
         self.doc_dir = doc_dir
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.embedding_model = embedding_model
         self.vectordb_dir = vectordb_dir
         self.collection_name = collection_name
+        ingestion_config = load_config()["vector_ingestion"]
+        self.parse_workers = ingestion_config["parse_workers"] or os.cpu_count() or 1
+        self.embed_workers = ingestion_config["embed_workers"]
+        self.write_workers = ingestion_config["write_workers"]
+        self.queue_size = ingestion_config["queue_size"]
+        self.embed_batch_tokens = ingestion_config["embed_batch_tokens"]
+        self.embed_batch_max_chunks = ingestion_config["embed_batch_max_chunks"]
 
     def path_maker(self, file_name: str, doc_dir: str):
         return os.path.join(here(doc_dir), file_name)
 
+    def _settings(self) -> dict:
+        return dict(namespace=get_embeddings_namespace("vector_store"),
+                    chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap)
+
+    def _is_current(self, manifest: IngestionManifest, fn: str, sha256: str, settings: dict) -> bool:
+        entry = manifest.get(fn)
+        return manifest.is_current(fn, sha256) and all(entry.get(name) == value for name, value in settings.items())
+
+    def _stored_ids(self, vectordb: Chroma, fn: str, ids: list) -> set:
+        """Ids already in the collection for `fn`: the given ids that exist, plus any stored under its source path."""
+        ids = list(dict.fromkeys(ids))
+        stored = set(vectordb.get(ids=ids, include=[])["ids"]) if ids else set()
+        # Chunks added before the manifest existed have random ids; find them by their source path.
+        stored.update(vectordb.get(where={"source": self.path_maker(fn, self.doc_dir)}, include=[])["ids"])
+        return stored
+
+    def _open(self, vectordb_path) -> Chroma:
+        return Chroma(
+            persist_directory=str(vectordb_path),
+            collection_name=self.collection_name,
+            embedding_function=get_embeddings("vector_store"),
+            collection_metadata=COLLECTION_METADATA,
+        )
+
+    def _embedder(self, embed_queue: queue.Queue, write_queue: queue.Queue, tracker: _FileTracker, errors: list,
+                  stop: threading.Event):
+        try:
+            embeddings = get_embeddings("vector_store")
+            while (batch := _get(embed_queue, stop)) is not _STOP:
+                try:
+                    vectors = embeddings.embed_documents([text for _, _, text, _ in batch])
+                except Exception as e:
+                    print(f"Embedding batch failed: {e}")
+                    errors.append(e)
+                    tracker.fail({fn for fn, _, _, _ in batch})
+                    continue
+                if not _put(write_queue, (batch, vectors), stop):
+                    return
+        except Exception as e:
+            # Without this thread the queues stop draining: stop the whole pipeline instead of hanging.
+            print(f"Embedding thread failed, stopping ingestion: {e}")
+            errors.append(e)
+            stop.set()
+
+    def _writer(self, vectordb: Chroma, keyword_index: BM25Index, write_queue: queue.Queue, tracker: _FileTracker,
+                errors: list, stop: threading.Event):
+        try:
+            while (item := _get(write_queue, stop)) is not _STOP:
+                batch, vectors = item
+                try:
+                    vectordb._collection.upsert(
+                        ids=[chunk_id for _, chunk_id, _, _ in batch],
+                        embeddings=vectors,
+                        documents=[text for _, _, text, _ in batch],
+                        metadatas=[metadata or None for _, _, _, metadata in batch],
+                    )
+                    keyword_index.add([chunk_id for _, chunk_id, _, _ in batch], [text for _, _, text, _ in batch],
+                                      [metadata for _, _, _, metadata in batch])
+                except Exception as e:
+                    print(f"Writing batch to Chroma failed: {e}")
+                    errors.append(e)
+                    tracker.fail({fn for fn, _, _, _ in batch})
+                    continue
+                counts = {}
+                for fn, _, _, _ in batch:
+                    counts[fn] = counts.get(fn, 0) + 1
+                for fn, count in counts.items():
+                    tracker.done(fn, count)
+        except Exception as e:
+            print(f"Writer thread failed, stopping ingestion: {e}")
+            errors.append(e)
+            stop.set()
+
     def run(self):
+        started = time.perf_counter()
         vectordb_path = here(self.vectordb_dir)
+        if not os.path.exists(vectordb_path):
+            os.makedirs(vectordb_path)
+            print(f"Directory '{self.vectordb_dir}' was created.")
+        manifest = IngestionManifest(str(vectordb_path), file_name=VECTOR_MANIFEST_FILE)
+        settings = self._settings()
+
+        vectordb = self._open(vectordb_path)
+        rebuilt = False
+        space = (vectordb._collection.metadata or {}).get("hnsw:space")
+        if space != COLLECTION_METADATA["hnsw:space"] and vectordb._collection.count():
+            # The distance space is fixed when a collection is created; older ones used Chroma's l2 default.
+            print(f"Collection '{self.collection_name}' uses {space or 'l2'} distance, rebuilding it in cosine space...")
+            vectordb.delete_collection()
+            vectordb = self._open(vectordb_path)
+            manifest.entries.clear()
+            manifest.save()
+            rebuilt = True
+        elif any(entry.get("namespace") != settings["namespace"] for entry in manifest.entries.values()):
+            # Vectors from another embedding model cannot share the collection.
+            print(f"Embedding model changed to {settings['namespace']}, rebuilding '{self.collection_name}'...")
+            vectordb.delete_collection()
+            vectordb = self._open(vectordb_path)
+            manifest.entries.clear()
+            manifest.save()
+            rebuilt = True
+        keyword_index = BM25Index(os.path.join(str(vectordb_path), BM25_FILE))
+        if len(keyword_index) != vectordb._collection.count():
+            keyword_index.rebuild_from(vectordb)
 
-        # Process all documents in the doc_dir
         file_list = os.listdir(here(self.doc_dir))
-        docs = []
+        to_parse, hashes = [], {}
+        skipped = 0
         for fn in file_list:
-            # Choose the appropriate loader based on the file extension
-            if fn.endswith(".pdf"):
-                loader = PyPDFLoader(self.path_maker(fn, self.doc_dir))
-            elif fn.endswith(".txt"):
-                from langchain.document_loaders import TextLoader
-                loader = TextLoader(self.path_maker(fn, self.doc_dir))
-            else:
+            if not fn.endswith(SUPPORTED_EXTENSIONS):
                 print(f"Unsupported file type: {fn}")
                 continue
-            docs.extend(loader.load_and_split())
+            hashes[fn] = file_sha256(self.path_maker(fn, self.doc_dir))
+            if self._is_current(manifest, fn, hashes[fn], settings):
+                skipped += 1
+            else:
+                to_parse.append(fn)
 
-        text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
-        )
-        doc_splits = text_splitter.split_documents(docs)
-
-        if os.path.exists(vectordb_path):
-            # Load the existing vector DB and add new documents
-            print(f"Loading existing vector DB from '{self.vectordb_dir}'...")
-            vectordb = Chroma(
-                persist_directory=str(vectordb_path),
-                collection_name=self.collection_name,
-                embedding_function=OpenAIEmbeddings(model=self.embedding_model)
-            )
-            vectordb.add_documents(doc_splits)
-            print("Existing vector DB updated with new documents.")
-            print("Number of vectors in vectordb:", vectordb._collection.count(), "\n")
-        else:
-            # Create the directory and new vector DB
-            os.makedirs(vectordb_path)
-            print(f"Directory '{self.vectordb_dir}' was created.")
-            vectordb = Chroma.from_documents(
-                documents=doc_splits,
-                collection_name=self.collection_name,
-                embedding=OpenAIEmbeddings(model=self.embedding_model),
-                persist_directory=str(vectordb_path)
-            )
-            print("Vector DB created and saved.")
-            print("Number of vectors in vectordb:", vectordb._collection.count(), "\n")
\ No newline at end of file
+        tracker = _FileTracker(manifest)
+        errors = []
+        stop = threading.Event()
+        embed_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        embedders = [threading.Thread(target=self._embedder, args=(embed_queue, write_queue, tracker, errors, stop),
+                                      name=f"vector-embed-{i}", daemon=True) for i in range(self.embed_workers)]
+        writers = [threading.Thread(target=self._writer, args=(vectordb, keyword_index, write_queue, tracker, errors, stop),
+                                    name=f"vector-write-{i}", daemon=True) for i in range(self.write_workers)]
+        for thread in embedders + writers:
+            thread.start()
+
+        pages = chunks = added = deleted = tokens = 0
+        batch, batch_tokens = [], 0
+        try:
+            # Parse results are handled as they complete, with at most `queue_size` files in flight.
+            with ProcessPoolExecutor(max_workers=min(self.parse_workers, max(len(to_parse), 1)),
+                                     mp_context=multiprocessing.get_context("spawn")) as pool:
+                pending, remaining = {}, list(reversed(to_parse))
+                while (pending or remaining) and not stop.is_set():
+                    while remaining and len(pending) < self.queue_size:
+                        fn = remaining.pop()
+                        future = pool.submit(parse_file, self.path_maker(fn, self.doc_dir), fn, self.chunk_size, self.chunk_overlap)
+                        pending[future] = fn
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        fn = pending.pop(future)
+                        try:
+                            _, file_pages, file_chunks = future.result()
+                        except Exception as e:
+                            print(f"Parsing {fn} failed: {e}")
+                            errors.append(e)
+                            continue
+                        ids = [chunk_id for chunk_id, _, _, _ in file_chunks]
+                        previous = manifest.get(fn)
+                        stored = self._stored_ids(vectordb, fn, ids + (previous["chunk_ids"] if previous else []))
+                        stale = sorted(stored - set(ids))
+                        if stale:
+                            vectordb.delete(ids=stale)
+                            keyword_index.delete(stale)
+                        new = [chunk for chunk in file_chunks if chunk[0] not in stored]
+                        print(f"{fn}: {len(new)} chunks to embed, {len(ids) - len(new)} unchanged, {len(stale)} removed")
+                        pages += file_pages
+                        chunks += len(file_chunks)
+                        added += len(new)
+                        deleted += len(stale)
+                        tracker.start(fn, len(new), sha256=hashes[fn], table=self.collection_name, rows=len(ids),
+                                      mode="upsert", chunk_ids=ids, **settings)
+                        for chunk_id, text, metadata, chunk_tokens in new:
+                            if batch and (batch_tokens + chunk_tokens > self.embed_batch_tokens
+                                          or len(batch) >= self.embed_batch_max_chunks):
+                                _put(embed_queue, batch, stop)
+                                batch, batch_tokens = [], 0
+                            batch.append((fn, chunk_id, text, metadata))
+                            batch_tokens += chunk_tokens
+                            tokens += chunk_tokens
+                if stop.is_set():
+                    for future in pending:
+                        future.cancel()
+        except Exception as e:
+            print(f"Ingestion failed, stopping the pipeline: {e}")
+            errors.append(e)
+            stop.set()
+        if batch:
+            _put(embed_queue, batch, stop)
+        for _ in embedders:
+            _put(embed_queue, _STOP, stop)
+        for thread in embedders:
+            thread.join()
+        for _ in writers:
+            _put(write_queue, _STOP, stop)
+        for thread in writers:
+            thread.join()
+        if stop.is_set():
+            # Files whose chunks were all written are already in the manifest; the rest are retried next run.
+            keyword_index.save()
+            get_vector_store().reload(reopen=rebuilt)
+            raise RuntimeError(f"Vector ingestion stopped: {errors[-1]}")
+
+        for fn in [fn for fn in manifest.entries if fn not in file_list]:
+            removed = manifest.entries[fn]["chunk_ids"]
+            if removed:
+                vectordb.delete(ids=removed)
+                keyword_index.delete(removed)
+            print(f"{fn}: deleted, {len(removed)} chunks removed")
+            deleted += len(removed)
+            manifest.remove(fn)
+
+        keyword_index.save()
+        get_vector_store().reload(reopen=rebuilt)
+
+        seconds = time.perf_counter() - started
+        print("Number of vectors in vectordb:", vectordb._collection.count(), "\n")
+        summary = (f"{len(to_parse)} files parsed ({pages} pages, {chunks} chunks), {added} chunks embedded "
+                   f"({tokens} tokens), {deleted} removed, {skipped} unchanged files skipped in {seconds:.1f}s: "
+                   f"{pages / max(seconds, 1e-9):.1f} pages/s, {chunks / max(seconds, 1e-9):.1f} chunks/s")
+        if errors:
+            summary += f"; {len(errors)} failures, their files will be retried on the next run"
+        print(summary)
+        return summary
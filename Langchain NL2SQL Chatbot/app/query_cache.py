@@ -0,0 +1,169 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+import streamlit as st
+from embeddings import get_embeddings
+
+from config import load_config
+
+
+COMPARISON_PATTERN = r"<=|>=|!=|<>|=|<|>"
+# A number with an optional sign and the comparison in front of it, e.g. "> 100000" or "= -5".
+NUMBER_PATTERN = rf"({COMPARISON_PATTERN})?\s*((?<![\w.])-)?(\d+(?:\.\d+)?)"
+
+
+def normalize_question(question: str) -> str:
+    """
+    Lowercase, drop punctuation and collapse whitespace so trivially different phrasings share a key.
+    Comparison operators and the sign of a number are kept: "credit > 100000" and "credit < 100000"
+    must not share a key.
+    """
+    question = question.lower().strip()
+    question = re.sub(r"[^\w\s'<>=!-]", " ", question)
+    question = re.sub(r"!(?!=)|-(?!\d)|(?<=\w)-", " ", question)
+    question = re.sub(rf"({COMPARISON_PATTERN})", r" \1 ", question)
+    return " ".join(question.split())
+
+
+def question_literals(question: str) -> frozenset:
+    """
+    Numbers and quoted values in a question; "top 5" and "top 10" embed almost identically but differ here.
+    Values keep the comparison in front of them and numbers their sign, e.g. ">100000", "-5" or "!=shipped".
+    """
+    quoted_pattern = rf"({COMPARISON_PATTERN})?\s*(?<!\w)[\"']([^\"']+)[\"'](?!\w)"
+    quoted = [operator + value.strip().lower() for operator, value in re.findall(quoted_pattern, question)]
+    numbers = ["".join(match) for match in re.findall(NUMBER_PATTERN, re.sub(quoted_pattern, " ", question))]
+    return frozenset(quoted + numbers)
+
+
+@dataclass
+class CacheEntry:
+    question: str
+    fingerprint: str
+    sql: str
+    response: str
+    embedding: np.ndarray = None
+    literals: frozenset = frozenset()
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+class QueryCache:
+    """
+    Two-tier cache for NL->SQL answers.
+
+    The exact tier is keyed on the normalized question plus the schema fingerprint. The similarity tier
+    compares the question embedding against cached entries for the same fingerprint and accepts anything
+    above `similarity_threshold` that mentions the same numbers and quoted values. Entries expire after `ttl_seconds` and the least recently used entry is
+    evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, embeddings=None, max_entries: int = 512, ttl_seconds: float = 900,
+                 similarity_threshold: float = 0.95) -> None:
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, question: str, fingerprint: str) -> str:
+        return f"{fingerprint}:{normalize_question(question)}"
+
+    def embed(self, question: str):
+        """Unit-normalized embedding of the normalized question, or None when the similarity tier is disabled."""
+        if self.embeddings is None:
+            return None
+        vector = np.asarray(self.embeddings.embed_query(normalize_question(question)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def aembed(self, question: str):
+        """`embed` through the async embeddings client."""
+        if self.embeddings is None:
+            return None
+        vector = np.asarray(await self.embeddings.aembed_query(normalize_question(question)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return time.time() - entry.created_at > self.ttl_seconds
+
+    def _purge_expired(self):
+        for key in [key for key, entry in self._entries.items() if self._expired(entry)]:
+            del self._entries[key]
+
+    def get(self, question: str, fingerprint: str):
+        """Exact tier: return the entry stored for this normalized question and schema, or None."""
+        key = self._key(question, fingerprint)
+        with self._lock:
+            self._purge_expired()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                entry.hits += 1
+            return entry
+
+    def get_similar(self, embedding, fingerprint: str, question: str):
+        """
+        Similarity tier: return the closest entry for the same schema if it clears the threshold, or None.
+        Only entries whose question has the same literals (numbers, quoted values) as `question` qualify.
+        """
+        if embedding is None:
+            return None
+        literals = question_literals(question)
+        with self._lock:
+            self._purge_expired()
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry.fingerprint == fingerprint and entry.embedding is not None and entry.literals == literals
+            ]
+        best_key, best_entry, best_score = None, None, -1.0
+        for key, entry in candidates:
+            score = float(np.dot(embedding, entry.embedding))
+            if score > best_score:
+                best_key, best_entry, best_score = key, entry, score
+        if best_entry is None or best_score < self.similarity_threshold:
+            return None
+        with self._lock:
+            if best_key in self._entries:
+                self._entries.move_to_end(best_key)
+                best_entry.hits += 1
+        print(f"Query cache similarity hit ({best_score:.3f}): {best_entry.question}")
+        return best_entry
+
+    def store(self, question: str, fingerprint: str, sql: str, response: str, embedding=None) -> CacheEntry:
+        if embedding is None:
+            embedding = self.embed(question)
+        entry = CacheEntry(question=question, fingerprint=fingerprint, sql=sql, response=response,
+                           embedding=embedding, literals=question_literals(question))
+        key = self._key(question, fingerprint)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+@st.cache_resource
+def get_query_cache() -> QueryCache:
+    app_config = load_config()
+    cache_config = app_config["query_cache"]
+    return QueryCache(
+        embeddings=get_embeddings(),
+        max_entries=cache_config["max_entries"],
+        ttl_seconds=cache_config["ttl_seconds"],
+        similarity_threshold=cache_config["similarity_threshold"],
+    )
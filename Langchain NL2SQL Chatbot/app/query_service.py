@@ -0,0 +1,147 @@
+import asyncio
+
+from config import load_config
+from direct_sql_pipeline import arun_direct_pipeline, run_direct_pipeline
+from example_index import get_example_index
+from query_cache import get_query_cache
+from schema_catalog import get_schema_catalog
+from sql_query_agents import sql_crew
+from result_store import get_result_store, is_result_reference
+from sql_validator import get_sql_validator
+
+
+def split_response(response: str):
+    """Split a `QUERY: ... RESULTS: ...` answer into its SQL and results parts. Returns (None, None) otherwise."""
+    if "QUERY:" not in response or "RESULTS:" not in response:
+        return None, None
+    parts = response.split("RESULTS:")
+    query_part = parts[0].replace("QUERY:", "").strip()
+    results = parts[1].strip()
+    return query_part, results
+
+
+def _reexecute(sql: str) -> str:
+    result_set = get_result_store().execute(sql)
+    return f"QUERY: {sql}\nRESULTS: {result_set.reference}"
+
+
+def _result_expired(response: str) -> bool:
+    _, results = split_response(response)
+    return is_result_reference(results) and get_result_store().get(results) is None
+
+
+SQL_MODES = ("crew", "direct")
+
+
+def _answer(inputs, mode: str) -> str:
+    if mode == "direct":
+        return run_direct_pipeline(inputs)
+    return str(sql_crew.kickoff(inputs=inputs))
+
+
+def _resolve_mode(mode: str) -> str:
+    mode = mode or load_config()["primary_agent"]["sql_mode"]
+    if mode not in SQL_MODES:
+        raise ValueError(f"Unknown SQL mode '{mode}'. Choose from: {', '.join(SQL_MODES)}")
+    return mode
+
+
+def _serve_cached(entry, cache_config) -> str:
+    print("Query cache hit:", entry.question)
+    if cache_config["reexecute_on_hit"] or _result_expired(entry.response):
+        return _reexecute(entry.sql)
+    return entry.response
+
+
+def _store_answer(cache, question: str, fingerprint: str, response: str, embedding):
+    sql, _ = split_response(response)
+    if sql:
+        cache.store(question, fingerprint, sql, response, embedding=embedding)
+
+
+def learn_example(question: str, sql: str, source: str = "accepted"):
+    """Add a question/SQL pair to the few-shot bank (de-duplicated by the index). Returns its example id."""
+    if not question or not sql:
+        return None
+    try:
+        return get_example_index().add([{"input": question, "query": sql, "source": source}])[0]
+    except Exception as e:
+        print("Could not add example:", e)
+        return None
+
+
+def _learn_from_answer(question: str, response: str):
+    """With `example_bank.auto_add: validated`, bank every answer whose SQL executed and passes the validator."""
+    if load_config()["example_bank"]["auto_add"] != "validated":
+        return None
+    sql, results = split_response(response)
+    if not sql or not is_result_reference(results) or not get_sql_validator().validate(sql).ok:
+        return None
+    return learn_example(question, sql, source="validated")
+
+
+def run_sql_query(inputs, mode: str = None) -> str:
+    """
+    Answer a question with the SQL crew or, in "direct" mode, the fixed pipeline, serving repeated and
+    near-identical questions from the query cache. Returns `QUERY: ... RESULTS: ...` text either way.
+    """
+    mode = _resolve_mode(mode)
+    cache_config = load_config()["query_cache"]
+    if not cache_config["enabled"]:
+        response = _answer(inputs, mode)
+        _learn_from_answer(inputs["query"], response)
+        return response
+
+    cache = get_query_cache()
+    question = inputs["query"]
+    fingerprint = get_schema_catalog().fingerprint()
+
+    embedding = None
+    entry = cache.get(question, fingerprint)
+    if entry is None:
+        embedding = cache.embed(question)
+        entry = cache.get_similar(embedding, fingerprint, question)
+    if entry is not None:
+        return _serve_cached(entry, cache_config)
+
+    response = _answer(inputs, mode)
+    _store_answer(cache, question, fingerprint, response, embedding)
+    _learn_from_answer(question, response)
+    return response
+
+
+async def _aanswer(job, inputs, mode: str) -> str:
+    if mode == "direct":
+        return await arun_direct_pipeline(inputs, job=job)
+    job.emit("Running the SQL agent")
+    # Sessions share one loop, so each run gets its own copy of the crew and its task state.
+    return str(await sql_crew.copy().kickoff_async(inputs=inputs))
+
+
+async def arun_sql_query(job, inputs, mode: str = None) -> str:
+    """`run_sql_query` for the async execution service; reports progress through `job`."""
+    mode = _resolve_mode(mode)
+    cache_config = load_config()["query_cache"]
+    if not cache_config["enabled"]:
+        response = await _aanswer(job, inputs, mode)
+        await asyncio.to_thread(_learn_from_answer, inputs["query"], response)
+        return response
+
+    job.emit("Checking the query cache")
+    cache = get_query_cache()
+    question = inputs["query"]
+    fingerprint = await asyncio.to_thread(get_schema_catalog().fingerprint)
+
+    embedding = None
+    entry = cache.get(question, fingerprint)
+    if entry is None and cache.embeddings is not None:
+        embedding = await cache.aembed(question)
+        entry = cache.get_similar(embedding, fingerprint, question)
+    if entry is not None:
+        job.emit("Answered from the query cache")
+        return await asyncio.to_thread(_serve_cached, entry, cache_config)
+
+    response = await _aanswer(job, inputs, mode)
+    await asyncio.to_thread(_store_answer, cache, question, fingerprint, response, embedding)
+    await asyncio.to_thread(_learn_from_answer, question, response)
+    return response
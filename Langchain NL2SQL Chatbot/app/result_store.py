@@ -0,0 +1,289 @@
+import asyncio
+import os
+import pickle
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+from sqlalchemy import text
+
+from config import load_config
+from db_engine import get_async_engine, get_engine
+from sql_governor import QueryRejected, SQLGovernor
+
+RESULT_SCHEME = "result://"
+
+
+class ResultSet:
+    """
+    Typed, out-of-band result of one query.
+
+    Rows stay in DataFrames, so neither the LLM nor the UI ever has to round-trip them through text.
+    `fetch` reads the (row-capped) result in one pass and releases its connection straight away, so no
+    cursor is left idle on the server: the first page stays in memory and later pages are spilled to a
+    temporary file and read back on demand. The file is removed once the result set is garbage
+    collected, so whoever holds on to it (e.g. a session's chat history) can page through it for as long
+    as it needs.
+    """
+
+    def __init__(self, sql: str, engine=None, page_size: int = 100, row_limit: int = None, governor=None) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.sql = sql
+        self.engine = engine
+        self.page_size = page_size
+        self.row_limit = row_limit
+        self.governor = governor
+        self.columns = None
+        self.dtypes = None
+        self.exhausted = False
+        self.truncated = False
+        self._first_page = None
+        self._page_rows = []
+        self._offsets = []
+        self._spill = None
+        self._spill_path = None
+        self._cleanup = None
+
+    @classmethod
+    def from_frame(cls, sql: str, data: pd.DataFrame, page_size: int = 100, row_limit: int = None) -> "ResultSet":
+        """A result whose rows were already fetched (e.g. by the async driver); it is paged the same way."""
+        result_set = cls(sql, page_size=page_size, row_limit=row_limit)
+        if row_limit is not None and len(data) > row_limit:
+            data = data.iloc[:row_limit]
+            result_set.truncated = True
+        result_set.columns = list(data.columns)
+        result_set.dtypes = {column: str(dtype) for column, dtype in data.dtypes.items()}
+        try:
+            for start in range(0, len(data), page_size):
+                result_set._add_page(data.iloc[start:start + page_size])
+        finally:
+            result_set._close_spill()
+        result_set.exhausted = True
+        return result_set
+
+    @property
+    def reference(self) -> str:
+        return f"{RESULT_SCHEME}{self.id}"
+
+    @property
+    def fetched_pages(self) -> int:
+        return len(self._page_rows)
+
+    @property
+    def fetched_rows(self) -> int:
+        return sum(self._page_rows)
+
+    def _add_page(self, chunk: pd.DataFrame):
+        chunk = chunk.reset_index(drop=True)
+        self._page_rows.append(len(chunk))
+        if self._first_page is None:
+            self._first_page = chunk
+            return
+        if self._spill is None:
+            fd, self._spill_path = tempfile.mkstemp(prefix=f"result_{self.id}_", suffix=".pkl")
+            self._spill = os.fdopen(fd, "wb")
+            self._cleanup = weakref.finalize(self, _remove_file, self._spill_path)
+        self._offsets.append(self._spill.tell())
+        pickle.dump(chunk, self._spill, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _close_spill(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def fetch(self):
+        """Run the query and read every (capped) row, releasing the connection before returning."""
+        if self.exhausted:
+            return
+        engine = self.engine or get_engine()
+        watchdog = None
+        try:
+            with engine.connect() as conn:
+                conn = conn.execution_options(stream_results=True)
+                if self.governor is not None:
+                    watchdog = self.governor.start_watchdog(conn)
+                for chunk in pd.read_sql_query(text(self.sql), conn, chunksize=self.page_size):
+                    if self.columns is None:
+                        self.columns = list(chunk.columns)
+                        self.dtypes = {column: str(dtype) for column, dtype in chunk.dtypes.items()}
+                    if self.row_limit is not None and self.fetched_rows + len(chunk) > self.row_limit:
+                        chunk = chunk.iloc[:self.row_limit - self.fetched_rows]
+                        self.truncated = True
+                    if not chunk.empty:
+                        self._add_page(chunk)
+                    if self.truncated:
+                        break
+        except Exception as e:
+            if watchdog is not None and watchdog.fired:
+                raise QueryRejected(f"Query cancelled after {self.governor.timeout_seconds}s") from e
+            raise
+        finally:
+            if watchdog is not None:
+                watchdog.cancel()
+            self._close_spill()
+        self.exhausted = True
+
+    def page(self, number: int) -> pd.DataFrame:
+        """Return page `number` (0-based), reading spilled pages back from disk. Empty past the end."""
+        self.fetch()
+        if number == 0 and self._first_page is not None:
+            return self._first_page
+        if 0 < number < len(self._page_rows) and self._spill_path is not None:
+            with open(self._spill_path, "rb") as f:
+                f.seek(self._offsets[number - 1])
+                return pickle.load(f)
+        return pd.DataFrame(columns=self.columns or [])
+
+    def fetch_all(self) -> pd.DataFrame:
+        """Every row (bounded by `row_limit`) as one DataFrame."""
+        self.fetch()
+        return self.to_frame()
+
+    def to_frame(self) -> pd.DataFrame:
+        pages = [self.page(number) for number in range(self.fetched_pages)]
+        if not pages:
+            return pd.DataFrame(columns=self.columns or [])
+        return pd.concat(pages, ignore_index=True)
+
+    def preview(self, rows: int = 5) -> str:
+        """Compact description for the LLM: reference, shape, column types and the first few rows."""
+        first_page = self.page(0)
+        more = f" (truncated to {self.row_limit} rows)" if self.truncated else ""
+        columns = ", ".join(f"{column} ({dtype})" for column, dtype in (self.dtypes or {}).items())
+        sample = first_page.head(rows).to_csv(sep=";", index=False) if not first_page.empty else "<no rows>"
+        return (
+            f"RESULT_ID: {self.reference}\n"
+            f"ROWS_FETCHED: {self.fetched_rows}{more}\n"
+            f"COLUMNS: {columns}\n"
+            f"PREVIEW:\n{sample}"
+        )
+
+    def close(self):
+        """Drop the spilled pages now instead of waiting for garbage collection."""
+        self._close_spill()
+        if self._cleanup is not None:
+            self._cleanup()
+        self._page_rows = self._page_rows[:1]
+        self._offsets = []
+        self._spill_path = None
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ResultStore:
+    """
+    LRU registry of recent result sets, shared by every session of the process.
+
+    Evicting a result only drops the registry's reference: a session that rendered it keeps its own
+    (see `result_view`), so other users' queries cannot expire its history. At most `max_open_cursors`
+    queries read rows at once, which keeps them below the engine's pool size.
+    """
+
+    def __init__(self, max_results: int = 16, page_size: int = 100, governor: SQLGovernor = None,
+                 max_open_cursors: int = 4) -> None:
+        self.max_results = max_results
+        self.page_size = page_size
+        self.governor = governor
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._cursors = threading.BoundedSemaphore(max_open_cursors)
+
+    def _result_set(self, sql: str, page_size: int) -> ResultSet:
+        if self.governor is None:
+            return ResultSet(sql, page_size=page_size)
+        governed = self.governor.prepare(sql)
+        return ResultSet(governed.sql, page_size=page_size, row_limit=governed.row_limit, governor=self.governor)
+
+    def read_frame(self, sql: str):
+        """Run a governed query outside the registry and return (DataFrame, truncated)."""
+        result_set = self._result_set(sql, page_size=self.page_size)
+        with self._cursors:
+            result_set.fetch()
+        return result_set.to_frame(), result_set.truncated
+
+    def execute(self, sql: str) -> ResultSet:
+        """Run a governed query, read its rows and register it. Raises QueryRejected when refused."""
+        result_set = self._result_set(sql, page_size=self.page_size)
+        with self._cursors:
+            result_set.fetch()
+        self._register(result_set)
+        return result_set
+
+    def _register(self, result_set: ResultSet):
+        with self._lock:
+            self._results[result_set.id] = result_set
+            while len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+
+    async def aexecute(self, sql: str, timeout: float = None) -> ResultSet:
+        """
+        `execute` over the asyncio driver. The capped rows are fetched in one go and the query is
+        cancelled if it has not finished after `timeout` seconds (the governor's timeout by default).
+        """
+        async_engine = get_async_engine()
+        row_limit = None
+        if self.governor is not None:
+            governed = await self.governor.aprepare(sql, async_engine)
+            sql, row_limit = governed.sql, governed.row_limit
+            timeout = timeout or self.governor.timeout_seconds
+
+        async def fetch():
+            async with async_engine.connect() as conn:
+                result = await conn.execute(text(sql))
+                return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+        try:
+            data = await asyncio.wait_for(fetch(), timeout=timeout)
+        except asyncio.TimeoutError as e:
+            raise QueryRejected(f"Query cancelled after {timeout}s") from e
+        result_set = ResultSet.from_frame(sql, data, page_size=self.page_size, row_limit=row_limit)
+        self._register(result_set)
+        return result_set
+
+    def get(self, reference: str):
+        """Look up a result by `result://<id>` reference (or bare id). Returns None once evicted."""
+        result_id = "".join(reference.strip().strip("`").replace(RESULT_SCHEME, "").split()[:1])
+        with self._lock:
+            result_set = self._results.get(result_id)
+            if result_set is not None:
+                self._results.move_to_end(result_id)
+            return result_set
+
+
+def is_result_reference(results: str) -> bool:
+    return results.strip().strip("`").startswith(RESULT_SCHEME)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_result_store() -> ResultStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            app_config = load_config()
+            results_config = app_config["query_results"]
+            governor_config = app_config["sql_governor"]
+            governor = SQLGovernor(
+                get_engine(),
+                max_rows=governor_config["max_rows"],
+                max_estimated_rows=governor_config["max_estimated_rows"],
+                timeout_seconds=governor_config["timeout_seconds"],
+                dialect=app_config["sql_validator"]["dialect"],
+            )
+            _store = ResultStore(
+                max_results=results_config["max_open_results"],
+                page_size=results_config["page_size"],
+                governor=governor,
+                max_open_cursors=results_config["max_open_cursors"],
+            )
+        return _store
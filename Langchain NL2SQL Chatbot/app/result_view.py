@@ -0,0 +1,28 @@
+import streamlit as st
+
+from result_store import get_result_store
+
+
+def render_result(reference: str, key: str):
+    """
+    Show a stored result set one page at a time. The session keeps its own reference to every result it
+    rendered, so its history stays pageable after the process-wide store has evicted them.
+    """
+    session_results = st.session_state.setdefault("result_sets", {})
+    result_set = session_results.get(reference) or get_result_store().get(reference)
+    if result_set is None:
+        st.info("This result has expired. Ask the question again to re-run the query.")
+        return
+    session_results[reference] = result_set
+
+    page_number = 0
+    if result_set.fetched_pages > 1:
+        page_number = st.number_input("Page", min_value=1, max_value=result_set.fetched_pages, value=1, step=1,
+                                      key=f"page-{key}") - 1
+    page = result_set.page(page_number)
+    if result_set.truncated:
+        st.warning(f"Results were truncated to the first {result_set.row_limit} rows. Refine the question to narrow them down.")
+    st.dataframe(page, use_container_width=True, hide_index=True)
+
+    st.caption(f"Page {page_number + 1} of {max(result_set.fetched_pages, 1)} · {len(page)} rows on this page · "
+               f"{result_set.fetched_rows} rows in total")
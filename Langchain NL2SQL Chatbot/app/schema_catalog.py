@@ -0,0 +1,177 @@
+import hashlib
+import threading
+import time
+from typing import List
+
+from langchain_community.utilities.sql_database import SQLDatabase
+from sqlalchemy import inspect, text
+
+from config import load_config
+from db_engine import get_engine
+
+COLUMNS_CHECKSUM_SQL = (
+    "SELECT table_name, column_name, column_type, column_key "
+    "FROM information_schema.columns "
+    "WHERE table_schema = DATABASE() "
+    "ORDER BY table_name, ordinal_position"
+)
+FOREIGN_KEYS_CHECKSUM_SQL = (
+    "SELECT table_name, column_name, referenced_table_name, referenced_column_name "
+    "FROM information_schema.key_column_usage "
+    "WHERE table_schema = DATABASE() AND referenced_table_name IS NOT NULL "
+    "ORDER BY table_name, constraint_name, ordinal_position"
+)
+
+
+class SchemaCatalog:
+    """
+    In-process cache of the database schema.
+
+    Table names, per-table DDL with sample rows, columns, primary and foreign keys are reflected once and kept
+    until either `invalidate` is called (e.g. after an upload writes a table) or the information_schema
+    checksum changes. The checksum itself is re-read at most every `checksum_interval` seconds.
+    """
+
+    def __init__(self, engine, sample_rows: int = 3, checksum_interval: float = 30) -> None:
+        self.engine = engine
+        self.sample_rows = sample_rows
+        self.checksum_interval = checksum_interval
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._db = None
+        self._tables = None
+        self._table_info = {}
+        self._columns = {}
+        self._foreign_keys = {}
+        self._primary_keys = {}
+        self._checksum = None
+        self._checked_at = 0.0
+
+    def _compute_checksum(self) -> str:
+        digest = hashlib.sha256()
+        with self.engine.connect() as conn:
+            for statement in (COLUMNS_CHECKSUM_SQL, FOREIGN_KEYS_CHECKSUM_SQL):
+                for row in conn.execute(text(statement)):
+                    digest.update("|".join(str(value) for value in row).encode("utf-8"))
+                    digest.update(b"\n")
+        return digest.hexdigest()
+
+    def fingerprint(self) -> str:
+        """Schema checksum; drops every cached entry when it differs from the last one seen."""
+        with self._lock:
+            if self._checksum is not None and time.time() - self._checked_at < self.checksum_interval:
+                return self._checksum
+            checksum = self._compute_checksum()
+            if self._checksum is not None and checksum != self._checksum:
+                print("Schema checksum changed, dropping cached schema")
+                self._reset()
+            self._checksum = checksum
+            self._checked_at = time.time()
+            return checksum
+
+    def invalidate(self, table: str = None):
+        """Forget cached metadata for `table` (or everything) so the next call re-reflects it."""
+        with self._lock:
+            if table is None:
+                self._reset()
+                return
+            self._db = None
+            self._tables = None
+            self._table_info.pop(table, None)
+            self._columns.pop(table, None)
+            self._primary_keys.pop(table, None)
+            self._foreign_keys.clear()
+            self._checksum = None
+
+    @property
+    def db(self) -> SQLDatabase:
+        self.fingerprint()
+        with self._lock:
+            if self._db is None:
+                self._db = SQLDatabase(self.engine, sample_rows_in_table_info=self.sample_rows)
+            return self._db
+
+    def list_tables(self) -> List[str]:
+        db = self.db
+        with self._lock:
+            if self._tables is None:
+                self._tables = sorted(db.get_usable_table_names())
+            return list(self._tables)
+
+    def get_table_info(self, table_names: List[str]) -> str:
+        """DDL plus sample rows for each table, the same text InfoSQLDatabaseTool returns."""
+        db = self.db
+        infos = []
+        for table in table_names:
+            with self._lock:
+                info = self._table_info.get(table)
+            if info is None:
+                info = db.get_table_info([table])
+                with self._lock:
+                    self._table_info[table] = info
+            infos.append(info)
+        return "\n\n".join(infos)
+
+    def get_table_info_no_throw(self, tables: str) -> str:
+        """Input is a comma-separated list of tables; unknown tables are reported instead of raising."""
+        table_names = [table.strip() for table in tables.split(",") if table.strip()]
+        known = set(self.list_tables())
+        missing = [table for table in table_names if table not in known]
+        if missing:
+            return f"Error: table_names {set(missing)} not found in database"
+        try:
+            return self.get_table_info(table_names)
+        except Exception as e:
+            return f"Error: {e}"
+
+    def get_columns(self, table: str) -> List[dict]:
+        """Reflected columns of `table` as returned by SQLAlchemy's inspector."""
+        self.fingerprint()
+        with self._lock:
+            columns = self._columns.get(table)
+        if columns is None:
+            columns = inspect(self.engine).get_columns(table)
+            with self._lock:
+                self._columns[table] = columns
+        return columns
+
+    def get_foreign_keys(self, table: str) -> List[dict]:
+        """Reflected foreign keys of `table` as returned by SQLAlchemy's inspector."""
+        self.fingerprint()
+        with self._lock:
+            foreign_keys = self._foreign_keys.get(table)
+        if foreign_keys is None:
+            foreign_keys = inspect(self.engine).get_foreign_keys(table)
+            with self._lock:
+                self._foreign_keys[table] = foreign_keys
+        return foreign_keys
+
+    def get_primary_key(self, table: str) -> List[str]:
+        """Primary key columns of `table`, empty when it has none."""
+        self.fingerprint()
+        with self._lock:
+            primary_key = self._primary_keys.get(table)
+        if primary_key is None:
+            primary_key = inspect(self.engine).get_pk_constraint(table).get("constrained_columns") or []
+            with self._lock:
+                self._primary_keys[table] = primary_key
+        return primary_key
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_schema_catalog() -> SchemaCatalog:
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            catalog_config = load_config()["schema_catalog"]
+            _catalog = SchemaCatalog(
+                get_engine(),
+                sample_rows=catalog_config["sample_rows"],
+                checksum_interval=catalog_config["checksum_interval"],
+            )
+        return _catalog
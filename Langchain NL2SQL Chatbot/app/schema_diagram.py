@@ -0,0 +1,138 @@
+import glob
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pyprojroot import here
+from sqlalchemy import MetaData, inspect
+from sqlalchemy_schemadisplay import create_schema_graph
+
+from config import load_config
+from db_engine import get_engine
+from schema_catalog import get_schema_catalog
+
+
+class SchemaDiagramRenderer:
+    """
+    Schema diagrams as cached artifacts.
+
+    Images are keyed by the schema catalog's fingerprint, so the reflect-and-render step only runs
+    after the DDL actually changed, and renders happen on a background thread so an upload never waits
+    for Graphviz. Besides the full diagram, a subgraph of a few tables plus their foreign-key neighbours
+    can be rendered on its own, which only reflects those tables.
+    """
+
+    def __init__(self, engine, cache_dir: str, db_name: str = None, max_cached: int = 20) -> None:
+        self.engine = engine
+        self.cache_dir = cache_dir
+        self.db_name = db_name or ""
+        self.max_cached = max_cached
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="schema-diagram")
+        self._pending = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, fingerprint: str, tables=None) -> str:
+        name = f"schema_{fingerprint[:16]}"
+        if tables:
+            name += "_" + hashlib.sha256(",".join(sorted(tables)).encode("utf-8")).hexdigest()[:8]
+        return os.path.join(self.cache_dir, f"{name}.png")
+
+    def cached(self, tables=None):
+        """Path of the image for the current schema, or None if it has not been rendered yet."""
+        path = self._path(get_schema_catalog().fingerprint(), tables)
+        return path if os.path.exists(path) else None
+
+    def latest(self):
+        """Most recently rendered full diagram, whatever schema it was rendered for."""
+        full_diagrams = [path for path in glob.glob(os.path.join(self.cache_dir, "schema_*.png"))
+                         if os.path.basename(path).count("_") == 1]
+        return max(full_diagrams, key=os.path.getmtime) if full_diagrams else None
+
+    def is_rendering(self) -> bool:
+        with self._lock:
+            return any(not future.done() for future in self._pending.values())
+
+    def render_async(self, tables=None):
+        """Queue a render for the current schema (or a subgraph of `tables`) unless it is cached or queued."""
+        fingerprint = get_schema_catalog().fingerprint()
+        path = self._path(fingerprint, tables)
+        if os.path.exists(path):
+            return None
+        with self._lock:
+            self._pending = {key: value for key, value in self._pending.items() if not value.done()}
+            future = self._pending.get(path)
+            if future is None:
+                future = self._executor.submit(self._render, path, tables)
+                self._pending[path] = future
+            return future
+
+    def _neighbourhood(self, tables) -> list:
+        """`tables` plus every table they reference or are referenced by."""
+        insp = inspect(self.engine)
+        wanted = set(tables)
+        for table in insp.get_table_names():
+            referred = {fk["referred_table"] for fk in insp.get_foreign_keys(table)}
+            if table in wanted:
+                wanted |= referred
+            elif referred & set(tables):
+                wanted.add(table)
+        return sorted(wanted)
+
+    def _render(self, path: str, tables=None) -> str:
+        try:
+            metadata = MetaData()
+            if tables:
+                metadata.reflect(bind=self.engine, only=self._neighbourhood(tables))
+            else:
+                metadata.reflect(bind=self.engine)
+            print(f"Rendering schema diagram for {len(metadata.tables)} tables")
+
+            graph = create_schema_graph(metadata=metadata,
+                                        engine=self.engine,
+                                        show_datatypes=False,
+                                        show_indexes=False,
+                                        rankdir='LR',
+                                        concentrate=True,
+                                        relation_options={"color": "#008080", "penwidth": "1.5"},
+                                        format_table_name={"color": "blue", "fontsize": 14, "bold": True})
+            label = "Schema Diagram -- " + self.db_name
+            if tables:
+                label += " (" + ", ".join(sorted(tables)) + ")"
+            graph.set("label", label)
+            graph.set("fontsize", "20")
+            graph.set("labelloc", "t")
+            graph.set("fontcolor", "black")
+
+            tmp_path = os.path.join(self.cache_dir, "." + os.path.basename(path))
+            graph.write_png(tmp_path)
+            os.replace(tmp_path, path)
+            self._prune()
+            return path
+        except Exception as e:
+            print(f"Schema diagram render failed: {e}")
+            raise
+
+    def _prune(self):
+        diagrams = sorted(glob.glob(os.path.join(self.cache_dir, "schema_*.png")), key=os.path.getmtime)
+        for path in diagrams[:-self.max_cached]:
+            os.remove(path)
+
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+
+def get_schema_diagram_renderer() -> SchemaDiagramRenderer:
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            diagram_config = load_config()["schema_diagram"]
+            _renderer = SchemaDiagramRenderer(
+                get_engine(),
+                str(here(diagram_config["cache_dir"])),
+                db_name=os.getenv("db_name"),
+                max_cached=diagram_config["max_cached"],
+            )
+        return _renderer
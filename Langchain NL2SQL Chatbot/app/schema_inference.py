@@ -0,0 +1,350 @@
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+import pandas as pd
+from sqlalchemy import (BigInteger, Boolean, Column, Date, DateTime, Float, Integer, MetaData, SmallInteger,
+                        String, Table, Text, bindparam, inspect, text)
+from sqlalchemy.dialects import mysql
+
+from config import load_config
+
+DATE_PATTERN = re.compile(r"^\s*(\d{4}[-/]\d{1,2}[-/]\d{1,2}|\d{1,2}[-/]\d{1,2}[-/]\d{4})([ T]\d{1,2}:\d{2}(:\d{2})?)?\s*$")
+KEY_NAME_PATTERN = re.compile(r"(^id$|_id$|id$|number$|code$|_key$)", re.IGNORECASE)
+FILTER_NAME_PATTERN = re.compile(r"(status|type|category|country|state|city|region|line|vendor|office|date)", re.IGNORECASE)
+VARCHAR_SIZES = (16, 32, 64, 128, 255, 512, 1024)
+
+KIND_RANK = {"empty": 0, "bool": 1, "int": 2, "float": 3, "string": 4}
+
+
+class ColumnProfile:
+    """Running statistics for one column, merged chunk by chunk so a file never has to fit in memory."""
+
+    def __init__(self, name: str, max_tracked_values: int, key_sample_values: int) -> None:
+        self.name = name
+        self.kind = "empty"
+        self.rows = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.integral = True
+        self.max_length = 0
+        self.all_dates = True
+        self.iso_dates = True
+        self.has_time = False
+        self.max_tracked_values = max_tracked_values
+        self.key_sample_values = key_sample_values
+        self.values = set()
+        self.unique = True
+        self.tracking_overflowed = False
+
+    def update(self, series: pd.Series):
+        self.rows += len(series)
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+        kind = self._kind(values)
+        if KIND_RANK[kind] > KIND_RANK[self.kind]:
+            self.kind = kind
+
+        if kind in ("int", "float", "bool"):
+            numbers = values.astype(float)
+            self.min = numbers.min() if self.min is None else min(self.min, numbers.min())
+            self.max = numbers.max() if self.max is None else max(self.max, numbers.max())
+            if kind == "float" and self.integral:
+                self.integral = bool((numbers == numbers.round()).all())
+        strings = values.astype(str)
+        self.max_length = max(self.max_length, int(strings.str.len().max()))
+        if kind == "string" and self.all_dates:
+            self._update_dates(strings)
+        elif kind != "string":
+            self.all_dates = False
+        self._track(values if kind != "float" else values.astype(float))
+
+    @staticmethod
+    def _kind(values: pd.Series) -> str:
+        if pd.api.types.is_bool_dtype(values):
+            return "bool"
+        if pd.api.types.is_integer_dtype(values):
+            return "int"
+        if pd.api.types.is_float_dtype(values):
+            return "float"
+        return "string"
+
+    def _update_dates(self, strings: pd.Series):
+        if not strings.str.match(DATE_PATTERN).all():
+            self.all_dates = False
+            return
+        self.iso_dates = self.iso_dates and bool(strings.str.match(r"^\s*\d{4}").all())
+        parsed = pd.to_datetime(strings, errors="coerce")
+        if parsed.isna().any():
+            self.all_dates = False
+            return
+        self.has_time = self.has_time or bool((parsed != parsed.dt.normalize()).any())
+
+    def _track(self, values: pd.Series):
+        if not self.unique or self.tracking_overflowed:
+            return
+        if values.duplicated().any():
+            self.unique = False
+            return
+        for value in values:
+            if value in self.values:
+                self.unique = False
+                return
+            self.values.add(value)
+        if len(self.values) > self.max_tracked_values:
+            # Too many values to keep in memory; uniqueness is left for the database to verify when the
+            # key is added (apply_keys drops a key the data violates).
+            self.tracking_overflowed = True
+            self.values = set(list(self.values)[:self.key_sample_values])
+
+    @property
+    def is_date(self) -> bool:
+        return self.kind == "string" and self.all_dates and self.rows > self.nulls
+
+    @property
+    def is_integer(self) -> bool:
+        return self.kind in ("int", "bool") or (self.kind == "float" and self.integral)
+
+    @property
+    def is_indexable(self) -> bool:
+        return self.is_integer or self.is_date or (self.kind == "string" and self.max_length <= 255)
+
+    @property
+    def could_be_key(self) -> bool:
+        return self.unique and self.nulls == 0 and self.rows > 0 and self.is_indexable and not self.is_date
+
+    def sample_values(self) -> list:
+        values = list(self.values)[:self.key_sample_values]
+        return [int(value) for value in values] if self.is_integer else [str(value) for value in values]
+
+    def sql_type(self, varchar_max: int = 1024):
+        """Narrowest SQLAlchemy type that holds every value seen."""
+        if self.kind == "empty":
+            return String(VARCHAR_SIZES[0])
+        if self.kind == "bool":
+            return Boolean()
+        if self.is_integer:
+            low, high = self.min or 0, self.max or 0
+            if -128 <= low and high <= 127:
+                return SmallInteger().with_variant(mysql.TINYINT(), "mysql")
+            if -32768 <= low and high <= 32767:
+                return SmallInteger()
+            if -2 ** 31 <= low and high < 2 ** 31:
+                return Integer()
+            return BigInteger()
+        if self.kind == "float":
+            return Float(precision=53).with_variant(mysql.DOUBLE(), "mysql")
+        if self.is_date:
+            return DateTime() if self.has_time else Date()
+        for size in VARCHAR_SIZES:
+            if self.max_length <= size <= varchar_max:
+                return String(size)
+        return Text()
+
+
+@dataclass
+class ForeignKey:
+    column: str
+    referred_table: str
+    referred_column: str
+    referred_type: object = None
+
+    def to_dict(self) -> dict:
+        return {"column": self.column, "referred_table": self.referred_table, "referred_column": self.referred_column}
+
+
+@dataclass
+class InferredSchema:
+    table: str
+    columns: dict
+    types: dict = field(default_factory=dict)
+    primary_key: str = None
+    foreign_keys: List[ForeignKey] = field(default_factory=list)
+    indexes: List[str] = field(default_factory=list)
+
+    @property
+    def date_columns(self) -> list:
+        return [name for name, profile in self.columns.items() if profile.is_date]
+
+    @property
+    def server_parsable(self) -> bool:
+        """True when MySQL can parse every column as written (year-first dates, no True/False), e.g. for LOAD DATA."""
+        if any(profile.kind == "bool" for profile in self.columns.values()):
+            return False
+        return all(self.columns[name].iso_dates for name in self.date_columns)
+
+    def coerce(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """Convert inferred date columns so every backend receives real dates rather than strings."""
+        for name in self.date_columns:
+            if name in chunk:
+                chunk[name] = pd.to_datetime(chunk[name], errors="coerce")
+        return chunk
+
+    def describe(self) -> str:
+        columns = ", ".join(f"{name} {column_type}" for name, column_type in self.types.items())
+        foreign_keys = ", ".join(f"{fk.column} -> {fk.referred_table}.{fk.referred_column}" for fk in self.foreign_keys)
+        return (
+            f"{self.table}({columns}); primary key: {self.primary_key or 'none'}; "
+            f"foreign keys: {foreign_keys or 'none'}; indexes: {', '.join(self.indexes) or 'none'}"
+        )
+
+
+class SchemaInferrer:
+    """
+    Derives a typed table definition for an upload instead of pandas' TEXT/BIGINT/DOUBLE defaults.
+
+    One streaming pass profiles every column; from the profile it picks the narrowest numeric, date
+    or VARCHAR type, a primary key (a unique, non-null, key-like column), foreign keys to existing
+    tables (a column named like another table's primary key whose sampled values all exist there)
+    and indexes on the likely join and filter columns. Keys and indexes are added after the data is
+    loaded, which is faster than maintaining them row by row and lets a failing key be skipped.
+    """
+
+    def __init__(self, engine, max_indexes: int = 5, varchar_max: int = 1024,
+                 key_sample_values: int = 1000, max_tracked_values: int = 50_000) -> None:
+        self.engine = engine
+        self.max_indexes = max_indexes
+        self.varchar_max = varchar_max
+        self.key_sample_values = key_sample_values
+        self.max_tracked_values = max_tracked_values
+
+    def infer(self, table: str, chunks) -> InferredSchema:
+        columns = {}
+        for chunk in chunks:
+            for name in chunk.columns:
+                profile = columns.get(name)
+                if profile is None:
+                    profile = columns[name] = ColumnProfile(name, self.max_tracked_values, self.key_sample_values)
+                profile.update(chunk[name])
+        schema = InferredSchema(table=table, columns=columns)
+        schema.types = {name: profile.sql_type(self.varchar_max) for name, profile in columns.items()}
+        schema.primary_key = self._primary_key(columns)
+        schema.foreign_keys = self._foreign_keys(table, columns, schema.primary_key)
+        for fk in schema.foreign_keys:
+            # MySQL only accepts a foreign key whose type matches the referenced column exactly.
+            schema.types[fk.column] = fk.referred_type
+        schema.indexes = self._indexes(columns, schema)
+        print(f"Inferred schema: {schema.describe()}")
+        return schema
+
+    def _primary_key(self, columns: dict):
+        candidates = [profile for profile in columns.values() if profile.could_be_key]
+        if not candidates:
+            return None
+        named = [profile for profile in candidates if KEY_NAME_PATTERN.search(profile.name)]
+        # Prefer key-like names, then integers, then the leftmost column.
+        ordered = sorted(named or candidates, key=lambda profile: not profile.is_integer)
+        return ordered[0].name
+
+    def _foreign_keys(self, table: str, columns: dict, primary_key: str) -> List[ForeignKey]:
+        insp = inspect(self.engine)
+        referenced = {}
+        for other in insp.get_table_names():
+            if other == table:
+                continue
+            key_columns = insp.get_pk_constraint(other).get("constrained_columns") or []
+            if len(key_columns) == 1:
+                key_type = next(column["type"] for column in insp.get_columns(other) if column["name"] == key_columns[0])
+                referenced[other] = (key_columns[0], key_type)
+
+        foreign_keys = []
+        for name, profile in columns.items():
+            if name == primary_key or not profile.is_indexable or profile.nulls == profile.rows:
+                continue
+            for other, (key_column, key_type) in referenced.items():
+                names = {key_column.lower(), f"{other}_{key_column}".lower(), f"{other}{key_column}".lower()}
+                if name.lower() in names and self._values_exist(profile, other, key_column):
+                    foreign_keys.append(ForeignKey(name, other, key_column, key_type))
+                    break
+        return foreign_keys
+
+    def _values_exist(self, profile: ColumnProfile, table: str, column: str) -> bool:
+        values = profile.sample_values()
+        if not values:
+            return False
+        quote = self.engine.dialect.identifier_preparer.quote
+        statement = text(
+            f"SELECT COUNT(DISTINCT {quote(column)}) FROM {quote(table)} WHERE {quote(column)} IN :values"
+        ).bindparams(bindparam("values", expanding=True))
+        try:
+            with self.engine.connect() as conn:
+                found = conn.execute(statement, {"values": values}).scalar()
+        except Exception as e:
+            print(f"Could not check {profile.name} against {table}.{column}: {e}")
+            return False
+        return found == len(set(values))
+
+    def _indexes(self, columns: dict, schema: InferredSchema) -> List[str]:
+        indexes = [fk.column for fk in schema.foreign_keys]
+        for name, profile in columns.items():
+            if name == schema.primary_key or name in indexes or not profile.is_indexable:
+                continue
+            if profile.is_date or (KEY_NAME_PATTERN.search(name) and not profile.unique) or FILTER_NAME_PATTERN.search(name):
+                indexes.append(name)
+        return indexes[:self.max_indexes]
+
+    def create_table(self, schema: InferredSchema, replace: bool = True, table_name: str = None):
+        """Create the (empty) table with the inferred column types, as `table_name` if given (e.g. a staging table)."""
+        metadata = MetaData()
+        table = Table(table_name or schema.table, metadata, *[
+            Column(name, column_type, nullable=name != schema.primary_key) for name, column_type in schema.types.items()
+        ])
+        if replace:
+            table.drop(self.engine, checkfirst=True)
+        table.create(self.engine)
+
+    def apply_keys(self, schema: InferredSchema) -> InferredSchema:
+        """Add the primary key, foreign keys and indexes to the loaded table. Keys the data violates are dropped."""
+        quote = self.engine.dialect.identifier_preparer.quote
+        table = quote(schema.table)
+        is_mysql = self.engine.dialect.name == "mysql"
+
+        def run(statement: str) -> bool:
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(text(statement))
+                return True
+            except Exception as e:
+                print(f"Skipping `{statement}`: {e}")
+                return False
+
+        if schema.primary_key:
+            column = quote(schema.primary_key)
+            if is_mysql:
+                added = run(f"ALTER TABLE {table} ADD PRIMARY KEY ({column})")
+            else:
+                # SQLite cannot add a primary key to an existing table; a unique index gives the same lookups.
+                added = run(f"CREATE UNIQUE INDEX {quote('pk_' + schema.table)} ON {table} ({column})")
+            if not added:
+                schema.primary_key = None
+
+        for name in schema.indexes:
+            index_name = quote(f"ix_{schema.table}_{name}"[:64])
+            if not run(f"CREATE INDEX {index_name} ON {table} ({quote(name)})"):
+                schema.indexes = [index for index in schema.indexes if index != name]
+
+        if is_mysql:
+            kept = []
+            for fk in schema.foreign_keys:
+                constraint = quote(f"fk_{schema.table}_{fk.column}"[:64])
+                if run(f"ALTER TABLE {table} ADD CONSTRAINT {constraint} FOREIGN KEY ({quote(fk.column)}) "
+                       f"REFERENCES {quote(fk.referred_table)} ({quote(fk.referred_column)})"):
+                    kept.append(fk)
+            schema.foreign_keys = kept
+        return schema
+
+
+def get_schema_inferrer(engine):
+    inference_config = load_config()["schema_inference"]
+    if not inference_config["enabled"]:
+        return None
+    return SchemaInferrer(
+        engine,
+        max_indexes=inference_config["max_indexes"],
+        varchar_max=inference_config["varchar_max"],
+        key_sample_values=inference_config["key_sample_values"],
+        max_tracked_values=inference_config["max_tracked_values"],
+    )
@@ -0,0 +1,146 @@
+import threading
+from dataclasses import dataclass
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, TokenError
+from sqlalchemy import text
+
+
+class QueryRejected(Exception):
+    """Raised when the governor refuses to run a query or cancels it."""
+
+
+@dataclass
+class GovernedQuery:
+    sql: str
+    row_limit: int
+    estimated_rows: float = None
+
+
+class SQLGovernor:
+    """
+    Guard rails for LLM-generated SQL.
+
+    Before a query runs it is rewritten so the result is capped at `max_rows` (one extra row is fetched
+    to detect truncation) and carries a MAX_EXECUTION_TIME hint, then EXPLAINed; plans estimated to
+    examine more than `max_estimated_rows` rows are rejected. While the query executes, a watchdog
+    issues KILL QUERY from a separate connection if it is still running after `timeout_seconds`.
+    """
+
+    def __init__(self, engine, max_rows: int = 1000, max_estimated_rows: float = 1_000_000,
+                 timeout_seconds: float = 30, dialect: str = "mysql") -> None:
+        self.engine = engine
+        self.max_rows = max_rows
+        self.max_estimated_rows = max_estimated_rows
+        self.timeout_seconds = timeout_seconds
+        self.dialect = dialect
+
+    @property
+    def is_mysql(self) -> bool:
+        return self.engine.dialect.name == "mysql"
+
+    def _existing_limit(self, statement):
+        limit = statement.args.get("limit")
+        if limit is None:
+            return None
+        value = limit.args.get("expression")
+        if isinstance(value, exp.Literal) and value.is_int:
+            return int(value.name)
+        return None
+
+    def rewrite(self, sql: str) -> str:
+        """Clamp or inject LIMIT and add the execution-time hint."""
+        sql = sql.strip().rstrip(";")
+        try:
+            statement = sqlglot.parse_one(sql, read=self.dialect)
+        except (ParseError, TokenError):
+            # Could not rewrite safely; wrapping still bounds the number of rows returned.
+            return f"SELECT * FROM ({sql}) AS governed_query LIMIT {self.max_rows + 1}"
+
+        existing = self._existing_limit(statement)
+        if existing is None or existing > self.max_rows:
+            statement = statement.limit(self.max_rows + 1)
+
+        if self.is_mysql and self.timeout_seconds:
+            first_select = statement
+            while first_select is not None and not isinstance(first_select, exp.Select):
+                first_select = first_select.this
+            if first_select is not None and first_select.args.get("hint") is None:
+                timeout_ms = exp.Literal.number(int(self.timeout_seconds * 1000))
+                first_select.set("hint", exp.Hint(expressions=[
+                    exp.Anonymous(this="MAX_EXECUTION_TIME", expressions=[timeout_ms])
+                ]))
+        return statement.sql(dialect=self.dialect)
+
+    def estimate_rows(self, sql: str):
+        """
+        Rows the MySQL optimizer expects to examine, from EXPLAIN. For each query block the tables are
+        joined in plan order, so every step examines `rows` for each row produced by the steps before it.
+        Returns None for other backends.
+        """
+        if not self.is_mysql:
+            return None
+        with self.engine.connect() as conn:
+            plan = conn.execute(text(f"EXPLAIN {sql}")).mappings().all()
+        return self.estimate_from_plan(plan)
+
+    async def aestimate_rows(self, sql: str, async_engine):
+        """`estimate_rows` over an asyncio engine."""
+        if not self.is_mysql:
+            return None
+        async with async_engine.connect() as conn:
+            plan = (await conn.execute(text(f"EXPLAIN {sql}"))).mappings().all()
+        return self.estimate_from_plan(plan)
+
+    @staticmethod
+    def estimate_from_plan(plan) -> float:
+        blocks = {}
+        for step in plan:
+            blocks.setdefault(step["id"], []).append(step)
+        examined_total = 0.0
+        for steps in blocks.values():
+            produced, examined = 1.0, 0.0
+            for step in steps:
+                rows = float(step["rows"] or 1)
+                filtered = float(step["filtered"] or 100) / 100
+                examined += produced * rows
+                produced *= max(rows * filtered, 1.0)
+            examined_total += examined
+        return examined_total
+
+    def _check_estimate(self, estimated_rows):
+        if estimated_rows is not None and estimated_rows > self.max_estimated_rows:
+            raise QueryRejected(
+                f"Query rejected: the plan is estimated to examine {estimated_rows:,.0f} rows "
+                f"(limit {self.max_estimated_rows:,.0f}). Add filters or join conditions."
+            )
+
+    def prepare(self, sql: str) -> GovernedQuery:
+        governed_sql = self.rewrite(sql)
+        estimated_rows = self.estimate_rows(governed_sql)
+        self._check_estimate(estimated_rows)
+        return GovernedQuery(sql=governed_sql, row_limit=self.max_rows, estimated_rows=estimated_rows)
+
+    async def aprepare(self, sql: str, async_engine) -> GovernedQuery:
+        governed_sql = self.rewrite(sql)
+        estimated_rows = await self.aestimate_rows(governed_sql, async_engine)
+        self._check_estimate(estimated_rows)
+        return GovernedQuery(sql=governed_sql, row_limit=self.max_rows, estimated_rows=estimated_rows)
+
+    def start_watchdog(self, conn):
+        """Start a timer that cancels the query running on `conn` once the timeout elapses."""
+        if not self.is_mysql or not self.timeout_seconds:
+            return None
+        connection_id = conn.execute(text("SELECT CONNECTION_ID()")).scalar()
+        timer = threading.Timer(self.timeout_seconds, lambda: self._kill(connection_id, timer))
+        timer.daemon = True
+        timer.fired = False
+        timer.start()
+        return timer
+
+    def _kill(self, connection_id, timer):
+        print(f"Query on connection {connection_id} exceeded {self.timeout_seconds}s, cancelling")
+        timer.fired = True
+        with self.engine.connect() as conn:
+            conn.execute(text(f"KILL QUERY {int(connection_id)}"))
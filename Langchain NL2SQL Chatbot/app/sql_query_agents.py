@@ -1,7 +1,7 @@
 from crewai import Agent, Crew, Process, Task
 from crewai_tools import tool
 from textwrap import dedent
-from tools import sql_tool, list_tables, tables_schema, execute_sql, check_sql, display_table
+from tools import sql_tool, list_tables, tables_schema, join_path, find_values, execute_sql, check_sql, display_table
 from langchain_utils import get_llm
 import streamlit as st
 
@@ -18,12 +18,16 @@ sql_dev = Agent(
         
         Always use list_tables first to see available tables, then use tables_schema to understand
         the structure of the tables you need. Make sure to use the exact column names from the schema.
+        When a query spans tables that do not reference each other directly, use join_path to find
+        the intermediate tables and join columns instead of guessing them.
+        When the question names a specific value (a product, country, customer...), use find_values
+        to get the exact literal stored in the database before filtering on it.
         
         Use the `sql_tool` to get the executed SQL response from it, by passing the `query` and `messages` to it.
         """
     ),
     llm=llm,
-    tools=[list_tables, tables_schema, execute_sql, check_sql, sql_tool],
+    tools=[list_tables, tables_schema, join_path, find_values, execute_sql, check_sql, sql_tool],
     allow_delegation=False,
 )
 
@@ -35,18 +39,20 @@ extract_data = Task(
         
         First, use list_tables to see available tables.
         Then use tables_schema to understand the structure of relevant tables.
+        Use join_path to find how to join tables that are not directly related.
         Make sure to use exact column names from the schema in your SQL query.
+        Run the final query with execute_sql. It returns a RESULT_ID and a short preview of the rows.
         
         Format your response exactly like this:
         QUERY: <the SQL query with proper indentation and uppercase keywords>
-        RESULTS: <the query results in semicolon-separated format csv>
+        RESULTS: <the RESULT_ID returned by execute_sql, e.g. result://1a2b3c4d5e6f>
 
         Important:
-        - Your response should always be in the format of "QUERY: <sql query> RESULTS: <semicolon-separated csv of results>"
-        - Make sure the csv is semicolon-separated and not comma-separated
+        - Your response should always be in the format of "QUERY: <sql query> RESULTS: <RESULT_ID>"
+        - Do not copy the rows into your answer, the application displays them from the RESULT_ID
         """
     ),
-    expected_output="SQL query and semicolon-separated results csv",
+    expected_output="SQL query and the RESULT_ID returned by execute_sql",
     agent=sql_dev,
 )
 
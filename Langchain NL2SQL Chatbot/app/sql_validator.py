@@ -0,0 +1,168 @@
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+import sqlglot
+from sqlglot import exp
+from sqlglot.errors import ParseError, TokenError
+
+from config import load_config
+from schema_catalog import get_schema_catalog
+
+READ_ONLY_STATEMENTS = (exp.Select, exp.Union, exp.Intersect, exp.Except)
+WRITE_EXPRESSIONS = (exp.Insert, exp.Update, exp.Delete, exp.Drop, exp.Create, exp.Command)
+READ_ONLY_PREFIXES = ("select", "with")
+# SELECT ... INTO writes a table, variable or file; FOR UPDATE / FOR SHARE / LOCK IN SHARE MODE take row locks.
+SIDE_EFFECT_EXPRESSIONS = (exp.Into, exp.Lock)
+SIDE_EFFECT_PATTERN = re.compile(r"\binto\b|\bfor\s+(update|share)\b|\block\s+in\s+share\s+mode\b", re.IGNORECASE)
+STRING_LITERAL_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+SIDE_EFFECT_MESSAGE = "SELECT ... INTO and locking reads (FOR UPDATE, FOR SHARE) may not be executed."
+
+
+@dataclass
+class ValidationIssue:
+    code: str
+    message: str
+
+    def __str__(self):
+        return f"[{self.code}] {self.message}"
+
+
+@dataclass
+class ValidationResult:
+    sql: str
+    issues: List[ValidationIssue] = field(default_factory=list)
+    ambiguous: bool = False  # The parser gave up; the query may still be valid MySQL.
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues and not self.ambiguous
+
+    def __str__(self):
+        if self.ok:
+            return f"The query is valid:\n{self.sql}"
+        return "The query is invalid:\n" + "\n".join(f"- {issue}" for issue in self.issues)
+
+
+class SQLValidator:
+    """
+    Local replacement for the LLM-based query checker.
+
+    Parses the query with sqlglot in the configured dialect, rejects anything that is not a single
+    read-only statement (SELECT ... INTO and locking reads included), and resolves every table and
+    column against the schema catalog. When the parser itself fails the result is marked ambiguous, so
+    callers can fall back to the LLM checker or refuse the query.
+    """
+
+    def __init__(self, catalog, dialect: str = "mysql") -> None:
+        self.catalog = catalog
+        self.dialect = dialect
+
+    def validate(self, sql: str) -> ValidationResult:
+        sql = sql.strip()
+        result = ValidationResult(sql=sql)
+        try:
+            statements = [statement for statement in sqlglot.parse(sql, read=self.dialect) if statement is not None]
+        except (ParseError, TokenError) as e:
+            # Still refuse obvious writes even when the full grammar is not understood.
+            if not sql.lstrip("( \n\t").lower().startswith(READ_ONLY_PREFIXES):
+                result.issues.append(ValidationIssue("not_select", "Only SELECT queries may be executed."))
+            elif SIDE_EFFECT_PATTERN.search(STRING_LITERAL_PATTERN.sub("''", sql)):
+                result.issues.append(ValidationIssue("side_effects", SIDE_EFFECT_MESSAGE))
+            else:
+                result.ambiguous = True
+                result.issues.append(ValidationIssue("parse_error", str(e).splitlines()[0]))
+            return result
+
+        if not statements:
+            result.issues.append(ValidationIssue("empty", "The query is empty."))
+            return result
+        if len(statements) > 1:
+            result.issues.append(ValidationIssue("multiple_statements", "Only a single statement may be executed."))
+            return result
+        statement = statements[0]
+        if not isinstance(statement, READ_ONLY_STATEMENTS) or statement.find(*WRITE_EXPRESSIONS):
+            result.issues.append(ValidationIssue("not_select", "Only SELECT queries may be executed."))
+            return result
+        if statement.find(*SIDE_EFFECT_EXPRESSIONS):
+            result.issues.append(ValidationIssue("side_effects", SIDE_EFFECT_MESSAGE))
+            return result
+
+        result.issues.extend(self._resolve(statement))
+        return result
+
+    @staticmethod
+    def _output_columns(derived_table):
+        """Lower-cased output column names of a CTE or aliased subquery; None when they cannot be known (SELECT *)."""
+        alias = derived_table.args.get("alias")
+        if alias is not None and alias.columns:
+            return {column.name.lower() for column in alias.columns}
+        query = derived_table.this
+        while isinstance(query, (exp.Union, exp.Intersect, exp.Except)):
+            query = query.this
+        if not isinstance(query, exp.Select) or any(isinstance(select, exp.Star) or select.is_star for select in query.selects):
+            return None
+        return {name.lower() for name in query.named_selects}
+
+    def _resolve(self, statement) -> List[ValidationIssue]:
+        issues = []
+        known_tables = {table.lower(): table for table in self.catalog.list_tables()}
+        # Output columns of every derived table (CTEs and aliased subqueries), None when unknown.
+        derived = {cte.alias_or_name.lower(): self._output_columns(cte) for cte in statement.find_all(exp.CTE)}
+        derived.update((subquery.alias.lower(), self._output_columns(subquery))
+                       for subquery in statement.find_all(exp.Subquery) if subquery.alias)
+
+        sources = {}
+        for table in statement.find_all(exp.Table):
+            name = table.name.lower()
+            alias = table.alias_or_name.lower()
+            if name in derived:
+                derived[alias] = derived[name]
+                continue
+            if table.db and table.db.lower() == "information_schema":
+                derived[alias] = None
+                continue
+            if name not in known_tables:
+                issues.append(ValidationIssue("unknown_table", f"Table '{table.name}' does not exist."))
+                derived[alias] = None
+                continue
+            sources[alias] = known_tables[name]
+
+        columns_by_table = {
+            table: {column["name"].lower() for column in self.catalog.get_columns(table)}
+            for table in set(sources.values())
+        }
+        select_aliases = {alias.alias.lower() for alias in statement.find_all(exp.Alias)}
+
+        for column in statement.find_all(exp.Column):
+            if isinstance(column.this, exp.Star):
+                continue
+            name = column.name.lower()
+            qualifier = column.table.lower()
+            if qualifier:
+                if qualifier in derived:
+                    continue
+                if qualifier not in sources:
+                    issues.append(ValidationIssue("unknown_table", f"Table or alias '{column.table}' is not in the FROM clause."))
+                elif name not in columns_by_table[sources[qualifier]]:
+                    issues.append(ValidationIssue("unknown_column", f"Column '{column.name}' does not exist in table '{sources[qualifier]}'."))
+                continue
+            if name in select_aliases:
+                continue
+            derived_columns = list(derived.values())
+            if any(columns is None for columns in derived_columns):
+                continue
+            if not any(name in columns for columns in list(columns_by_table.values()) + derived_columns):
+                tables = ", ".join(sorted(set(columns_by_table) | set(derived))) or "the referenced tables"
+                issues.append(ValidationIssue("unknown_column", f"Column '{column.name}' does not exist in {tables}."))
+        return issues
+
+
+_validator = None
+
+
+def get_sql_validator() -> SQLValidator:
+    global _validator
+    if _validator is None:
+        _validator = SQLValidator(get_schema_catalog(), dialect=load_config()["sql_validator"]["dialect"])
+    return _validator
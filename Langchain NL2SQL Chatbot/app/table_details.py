@@ -23,6 +23,13 @@ def get_table_details():
     return table_details
 
 
+@st.cache_data
+def get_table_descriptions() -> dict:
+    """Table name -> description from database_table_descriptions.csv."""
+    table_description = pd.read_csv("database_table_descriptions.csv")
+    return dict(zip(table_description["Table"], table_description["Description"]))
+
+
 class Table(BaseModel):
     """Table in SQL database."""
 
@@ -52,4 +59,19 @@ Remember to include ALL POTENTIALLY RELEVANT tables, even if you're not sure tha
     ]
 )
 
-table_chain = {"input": itemgetter("question")} | create_extraction_chain_pydantic(Table, llm, system_message=table_details_prompt) | get_tables
\ No newline at end of file
+table_chain = {"input": itemgetter("question")} | create_extraction_chain_pydantic(Table, llm, system_message=table_details_prompt) | get_tables
+
+
+def llm_select_tables(question: str, candidates: dict) -> List[str]:
+    """LLM table extraction over only the given candidate tables (name -> description)."""
+    candidate_details = "".join(
+        "Table Name:" + name + "\n" + "Table Description:" + description + "\n\n" for name, description in candidates.items()
+    )
+    system_message = f"""Return the names of ALL the SQL tables that MIGHT be relevant to the user question. \
+The tables are:
+
+{candidate_details}
+
+Remember to include ALL POTENTIALLY RELEVANT tables, even if you're not sure that they're needed."""
+    chain = {"input": itemgetter("question")} | create_extraction_chain_pydantic(Table, llm, system_message=system_message) | get_tables
+    return chain.invoke({"question": question})
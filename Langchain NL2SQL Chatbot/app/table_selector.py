@@ -0,0 +1,126 @@
+import asyncio
+import threading
+from typing import List
+
+import numpy as np
+
+from config import load_config
+from embeddings import get_embeddings
+from schema_catalog import get_schema_catalog
+from table_details import get_table_descriptions, llm_select_tables
+
+
+class TableSelector:
+    """
+    Retrieval-based table pre-selection.
+
+    Every table is described by its name, its entry in `database_table_descriptions.csv` (when there
+    is one) and its column names. The descriptions are embedded once per schema fingerprint (and
+    persistently cached by text, so only new or changed tables are embedded again); a question then
+    picks the `k` most similar tables, and the foreign-key graph pulls in the tables they reference
+    plus junction tables linking two selected tables, e.g. `orderdetails` between `orders` and `products`.
+
+    Only when the best match scores below `min_score` does it fall back to the LLM, and even then the
+    LLM only sees the `fallback_candidates` best-ranked tables rather than the whole database.
+    """
+
+    def __init__(self, catalog, embeddings, k: int = 4, min_score: float = 0.25,
+                 fallback_candidates: int = 20, expand_foreign_keys: bool = True) -> None:
+        self.catalog = catalog
+        self.embeddings = embeddings
+        self.k = k
+        self.min_score = min_score
+        self.fallback_candidates = fallback_candidates
+        self.expand_foreign_keys = expand_foreign_keys
+        self._fingerprint = None
+        self._tables = []
+        self._descriptions = {}
+        self._vectors = None
+        self._lock = threading.Lock()
+
+    def describe(self, table: str) -> str:
+        description = get_table_descriptions().get(table, "")
+        columns = ", ".join(column["name"] for column in self.catalog.get_columns(table))
+        return f"Table: {table}\nDescription: {description}\nColumns: {columns}"
+
+    def _ensure_index(self):
+        fingerprint = self.catalog.fingerprint()
+        with self._lock:
+            if fingerprint == self._fingerprint and self._vectors is not None:
+                return self._tables, self._vectors
+        tables = self.catalog.list_tables()
+        descriptions = {table: self.describe(table) for table in tables}
+        vectors = np.asarray(self.embeddings.embed_documents([descriptions[table] for table in tables]), dtype=np.float32)
+        if len(tables):
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        with self._lock:
+            self._fingerprint = fingerprint
+            self._tables, self._descriptions, self._vectors = tables, descriptions, vectors
+        print(f"Table selector indexed {len(tables)} tables")
+        return tables, vectors
+
+    def rank(self, question: str):
+        """Every table with its cosine similarity to `question`, best first."""
+        tables, vectors = self._ensure_index()
+        if not tables:
+            return []
+        query = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        query /= max(np.linalg.norm(query), 1e-12)
+        scores = vectors @ query
+        order = np.argsort(-scores)
+        return [(tables[i], float(scores[i])) for i in order]
+
+    def expand(self, tables: List[str]) -> List[str]:
+        """Add the tables `tables` reference, and junction tables that reference two or more of them."""
+        selected = list(tables)
+        for table in tables:
+            for fk in self.catalog.get_foreign_keys(table):
+                if fk["referred_table"] not in selected:
+                    selected.append(fk["referred_table"])
+        chosen = set(tables)
+        for table in self.catalog.list_tables():
+            if table in selected:
+                continue
+            referred = {fk["referred_table"] for fk in self.catalog.get_foreign_keys(table)}
+            if len(referred & chosen) >= 2:
+                selected.append(table)
+        return selected
+
+    def select(self, question: str) -> List[str]:
+        ranked = self.rank(question)
+        if not ranked:
+            return []
+        best_score = ranked[0][1]
+        if best_score >= self.min_score:
+            selected = [table for table, score in ranked[:self.k]]
+            print(f"Embedding table selection (best {best_score:.2f}):", selected)
+        else:
+            candidates = {table: self._descriptions.get(table, table) for table, _ in ranked[:self.fallback_candidates]}
+            selected = [table for table in llm_select_tables(question, candidates) if table in candidates]
+            print(f"Low-confidence table match ({best_score:.2f}), LLM picked:", selected)
+            if not selected:
+                selected = [table for table, _ in ranked[:self.k]]
+        return self.expand(selected) if self.expand_foreign_keys else selected
+
+    async def aselect(self, question: str) -> List[str]:
+        return await asyncio.to_thread(self.select, question)
+
+
+_selector = None
+_selector_lock = threading.Lock()
+
+
+def get_table_selector() -> TableSelector:
+    global _selector
+    with _selector_lock:
+        if _selector is None:
+            selector_config = load_config()["table_selector"]
+            _selector = TableSelector(
+                get_schema_catalog(),
+                get_embeddings(),
+                k=selector_config["k"],
+                min_score=selector_config["min_score"],
+                fallback_candidates=selector_config["fallback_candidates"],
+                expand_foreign_keys=selector_config["expand_foreign_keys"],
+            )
+        return _selector
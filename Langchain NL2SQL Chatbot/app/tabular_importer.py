@@ -0,0 +1,348 @@
+import argparse
+import csv
+import os
+import tempfile
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+
+import pandas as pd
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import mysql
+
+from config import load_config
+from db_engine import get_engine
+from schema_inference import SchemaInferrer, get_schema_inferrer
+
+INGESTION_MODES = ("replace", "append", "upsert")
+STAGING_SUFFIX = "__staging"
+
+
+def upsert_rows(pd_table, conn, keys, data_iter):
+    """`DataFrame.to_sql` insertion method that updates rows whose primary/unique key already exists."""
+    rows = [dict(zip(keys, row)) for row in data_iter]
+    if not rows:
+        return 0
+    if conn.dialect.name == "mysql":
+        statement = mysql.insert(pd_table.table).values(rows)
+        statement = statement.on_duplicate_key_update({key: statement.inserted[key] for key in keys})
+    elif conn.dialect.name == "sqlite":
+        statement = pd_table.table.insert().prefix_with("OR REPLACE").values(rows)
+    else:
+        raise NotImplementedError(f"Upsert is not supported for {conn.dialect.name}")
+    return conn.execute(statement).rowcount
+
+
+def _integrity_error(error: BaseException):
+    """The key violation behind `error`, if any; pandas wraps driver errors raised inside `to_sql`."""
+    while error is not None:
+        if isinstance(error, IntegrityError):
+            return error
+        error = error.__cause__
+    return None
+
+
+@dataclass
+class ImportStats:
+    table: str
+    rows: int = 0
+    seconds: float = 0.0
+    method: str = "insert"
+    schema: object = None
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.rows:,} rows into {self.table} in {self.seconds:.1f}s ({self.rows_per_second:,.0f} rows/s, {self.method})"
+
+
+class TabularImporter:
+    """
+    Streaming CSV/XLSX loader.
+
+    Files are read `chunk_rows` at a time (CSV via pandas' chunked reader, XLSX via openpyxl's read-only
+    mode), so memory stays flat regardless of file size. Each chunk is written with multi-row INSERTs
+    of `insert_batch_rows` rows inside its own transaction. On MySQL, CSV files can instead be handed to
+    `LOAD DATA LOCAL INFILE`, which skips pandas for the data itself.
+
+    With an `inferrer`, new or replaced tables are created from an inferred schema (an extra streaming
+    pass over the file) and get their keys and indexes once the rows are in.
+
+    New and replaced tables are loaded into a `<table>__staging` table that is swapped in only once every
+    row is in, so a load that fails part way (e.g. a later chunk that does not fit the column types
+    guessed from the first one) leaves the previous table untouched. Foreign keys in other tables that
+    point at a replaced table are dropped for the swap and re-added once the new table has its keys.
+    Appends and upserts into an existing table run in a single transaction, so rows that violate its
+    keys roll the whole file back instead of leaving part of it loaded.
+    """
+
+    def __init__(self, engine=None, chunk_rows: int = 50_000, insert_batch_rows: int = 1000,
+                 load_data_local_infile: bool = False, inferrer=None) -> None:
+        self.engine = engine or get_engine()
+        self.chunk_rows = chunk_rows
+        self.insert_batch_rows = insert_batch_rows
+        self.load_data_local_infile = load_data_local_infile
+        self.inferrer = inferrer
+
+    def read_chunks(self, path: str, skip_rows: int = 0):
+        """Yield DataFrames of at most `chunk_rows` rows, skipping the first `skip_rows` data rows."""
+        extension = os.path.splitext(path)[1].lower()
+        if extension == ".csv":
+            skiprows = range(1, skip_rows + 1) if skip_rows else None
+            yield from pd.read_csv(path, skiprows=skiprows, chunksize=self.chunk_rows)
+        elif extension == ".xlsx":
+            yield from self._read_xlsx_chunks(path, skip_rows)
+        else:
+            raise ValueError(f"Unsupported file type for file: {path}")
+
+    def _read_xlsx_chunks(self, path: str, skip_rows: int):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(value) for value in next(rows, ())]
+            batch, yielded = [], False
+            for index, row in enumerate(rows):
+                if index < skip_rows:
+                    continue
+                batch.append(row)
+                if len(batch) >= self.chunk_rows:
+                    yield pd.DataFrame(batch, columns=header).infer_objects()
+                    batch, yielded = [], True
+            if batch or not yielded:
+                yield pd.DataFrame(batch, columns=header).infer_objects()
+        finally:
+            workbook.close()
+
+    def _insert_method(self, mode: str):
+        if mode == "upsert":
+            return upsert_rows
+        # sqlite3's executemany is already its fastest path; multi-row VALUES only adds parsing.
+        return None if self.engine.dialect.name == "sqlite" else "multi"
+
+    def _batch_rows(self, columns: int) -> int:
+        if self.engine.dialect.name == "sqlite":
+            # Older SQLite builds cap a statement at 999 bound parameters.
+            return max(1, min(self.insert_batch_rows, 999 // max(columns, 1)))
+        return self.insert_batch_rows
+
+    def import_file(self, path: str, table: str, mode: str = "replace", skip_rows: int = 0) -> ImportStats:
+        """Load `path` into `table`. `skip_rows` data rows are skipped (used for append-only tails)."""
+        if mode not in INGESTION_MODES:
+            raise ValueError(f"Unknown ingestion mode {mode!r}, expected one of {INGESTION_MODES}")
+        started = time.perf_counter()
+        creating = mode == "replace" or not inspect(self.engine).has_table(table)
+        target = f"{table}{STAGING_SUFFIX}" if creating else table
+        schema = None
+        try:
+            if creating:
+                self._drop_table(target)
+            if creating and self.inferrer is not None:
+                schema = self.inferrer.infer(table, self.read_chunks(path, skip_rows))
+                self.inferrer.create_table(schema, table_name=target)
+
+            use_load_data = (
+                self.load_data_local_infile
+                and self.engine.dialect.name == "mysql"
+                and path.lower().endswith(".csv")
+                and (schema is None or schema.server_parsable)
+            )
+            if use_load_data:
+                stats = self._load_data_infile(path, target, mode, skip_rows, created=schema is not None, creating=creating)
+            else:
+                stats = self._insert_chunks(path, target, mode, skip_rows, schema, creating=creating)
+        except Exception as e:
+            if creating:
+                self._drop_table(target)
+            conflict = _integrity_error(e)
+            if conflict is not None:
+                raise ValueError(f"Rows in {os.path.basename(path)} conflict with the keys of {table}; "
+                                 f"nothing was loaded. {conflict.orig}") from e
+            raise
+        referencing_keys = []
+        if creating:
+            referencing_keys = self._swap_in(target, table)
+            stats.table = table
+        if schema is not None:
+            stats.schema = self.inferrer.apply_keys(schema)
+        self._restore_foreign_keys(table, referencing_keys)
+        stats.seconds = time.perf_counter() - started
+        return stats
+
+    def _drop_table(self, table: str):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {self.engine.dialect.identifier_preparer.quote(table)}"))
+
+    def _referencing_keys(self, table: str) -> list:
+        """(table, foreign key) pairs in other tables that reference `table`."""
+        insp = inspect(self.engine)
+        return [(other, fk) for other in insp.get_table_names() if other != table
+                for fk in insp.get_foreign_keys(other) if fk["referred_table"] == table and fk.get("name")]
+
+    def _swap_in(self, staging: str, table: str) -> list:
+        """
+        Replace `table` with the fully loaded `staging` table. On MySQL, foreign keys referencing `table`
+        would follow it to the old name and block dropping it; they are dropped first and returned.
+        """
+        quote = self.engine.dialect.identifier_preparer.quote
+        old = f"{table}__old"
+        self._drop_table(old)
+        exists = inspect(self.engine).has_table(table)
+        referencing_keys = self._referencing_keys(table) if exists and self.engine.dialect.name == "mysql" else []
+        for other, fk in referencing_keys:
+            print(f"Dropping foreign key {fk['name']} on {other} while {table} is replaced")
+            with self.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {quote(other)} DROP FOREIGN KEY {quote(fk['name'])}"))
+        with self.engine.begin() as conn:
+            if self.engine.dialect.name == "mysql":
+                # One RENAME TABLE statement swaps both names atomically.
+                renames = f"{quote(table)} TO {quote(old)}, " if exists else ""
+                conn.execute(text(f"RENAME TABLE {renames}{quote(staging)} TO {quote(table)}"))
+            else:
+                if exists:
+                    conn.execute(text(f"ALTER TABLE {quote(table)} RENAME TO {quote(old)}"))
+                conn.execute(text(f"ALTER TABLE {quote(staging)} RENAME TO {quote(table)}"))
+        self._drop_table(old)
+        return referencing_keys
+
+    def _restore_foreign_keys(self, table: str, referencing_keys: list):
+        """Re-add the foreign keys dropped by `_swap_in`; ones the new table no longer satisfies are reported."""
+        quote = self.engine.dialect.identifier_preparer.quote
+        for other, fk in referencing_keys:
+            columns = ", ".join(quote(column) for column in fk["constrained_columns"])
+            referred = ", ".join(quote(column) for column in fk["referred_columns"])
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE {quote(other)} ADD CONSTRAINT {quote(fk['name'])} "
+                                      f"FOREIGN KEY ({columns}) REFERENCES {quote(table)} ({referred})"))
+            except Exception as e:
+                print(f"Could not restore foreign key {fk['name']} on {other} after replacing {table}: {e}")
+
+    def _insert_chunks(self, path: str, table: str, mode: str, skip_rows: int, schema=None,
+                       creating: bool = False) -> ImportStats:
+        stats = ImportStats(table=table, method="multi-row insert" if mode != "upsert" else "upsert")
+        started = time.perf_counter()
+        method = self._insert_method(mode)
+        # A staging table is thrown away on failure, so each chunk can commit on its own; an existing
+        # table gets the whole file in one transaction.
+        with (nullcontext() if creating else self.engine.begin()) as shared:
+            for number, chunk in enumerate(self.read_chunks(path, skip_rows)):
+                if_exists = "replace" if number == 0 and creating and schema is None else "append"
+                if schema is not None:
+                    chunk = schema.coerce(chunk)
+                with (self.engine.begin() if shared is None else nullcontext(shared)) as conn:
+                    chunk.to_sql(table, conn, index=False, if_exists=if_exists, method=method,
+                                 chunksize=self._batch_rows(len(chunk.columns)))
+                stats.rows += len(chunk)
+                stats.seconds = time.perf_counter() - started
+                print(f"Imported chunk {number} of {os.path.basename(path)}: {stats}")
+        return stats
+
+    @staticmethod
+    def _line_terminator(path: str) -> str:
+        """The file's line ending as a MySQL string literal body: CRLF if the first lines use it, else LF."""
+        with open(path, "rb") as f:
+            head = f.read(1 << 16)
+        return "\\r\\n" if b"\r\n" in head else "\\n"
+
+    @staticmethod
+    def _write_tail(path: str, skip_rows: int) -> str:
+        """
+        Copy the data records after the first `skip_rows` to a headerless temporary CSV. LOAD DATA's
+        IGNORE n LINES counts physical lines, which is wrong once a quoted field contains a newline.
+        """
+        fd, tail_path = tempfile.mkstemp(prefix="tail_", suffix=".csv")
+        with open(path, newline="", encoding="utf-8") as source, os.fdopen(fd, "w", newline="", encoding="utf-8") as tail:
+            reader = csv.reader(source)
+            writer = csv.writer(tail, lineterminator="\n")
+            next(reader, None)
+            for index, row in enumerate(reader):
+                if index >= skip_rows:
+                    writer.writerow(row)
+        return tail_path
+
+    def _load_data_infile(self, path: str, table: str, mode: str, skip_rows: int, created: bool = False,
+                          creating: bool = False) -> ImportStats:
+        stats = ImportStats(table=table, method="LOAD DATA LOCAL INFILE")
+        started = time.perf_counter()
+        if creating and not created:
+            # Create the table with types guessed from a sample; the server loads the data itself.
+            pd.read_csv(path, nrows=1000).head(0).to_sql(table, self.engine, index=False, if_exists="replace")
+
+        with open(path, newline="", encoding="utf-8") as f:
+            header = next(csv.reader(f))
+        variables = [f"@v{i}" for i in range(len(header))]
+        assignments = ", ".join(f"`{column}` = NULLIF({variable}, '')" for column, variable in zip(header, variables))
+        duplicate_handling = "REPLACE" if mode == "upsert" else ""
+        load_path, ignore_lines, terminator = path, 1, self._line_terminator(path)
+        if skip_rows:
+            load_path, ignore_lines, terminator = self._write_tail(path, skip_rows), 0, "\\n"
+        statement = (
+            f"LOAD DATA LOCAL INFILE :path {duplicate_handling} INTO TABLE `{table}` "
+            "CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            f"LINES TERMINATED BY '{terminator}' "
+            f"IGNORE {ignore_lines} LINES "
+            f"({', '.join(variables)}) SET {assignments}"
+        )
+        infile_engine = get_engine(self.engine.url.render_as_string(hide_password=False), local_infile=True)
+        try:
+            with infile_engine.begin() as conn:
+                stats.rows = conn.execute(text(statement), {"path": os.path.abspath(load_path)}).rowcount
+        finally:
+            if load_path != path:
+                os.remove(load_path)
+        stats.seconds = time.perf_counter() - started
+        print(f"Imported {os.path.basename(path)}: {stats}")
+        return stats
+
+
+def get_tabular_importer(engine=None) -> TabularImporter:
+    importer_config = load_config()["tabular_importer"]
+    engine = engine or get_engine()
+    return TabularImporter(
+        engine=engine,
+        chunk_rows=importer_config["chunk_rows"],
+        insert_batch_rows=importer_config["insert_batch_rows"],
+        load_data_local_infile=importer_config["load_data_local_infile"],
+        inferrer=get_schema_inferrer(engine),
+    )
+
+
+def _generate_csv(path: str, rows: int):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "customer", "amount", "created_at"])
+        for i in range(rows):
+            writer.writerow([i, f"customer_{i % 5000}", round((i * 7919) % 100000 / 100, 2), f"2024-01-{i % 28 + 1:02d}"])
+
+
+if __name__ == "__main__":
+    # Local benchmark, e.g.: python tabular_importer.py bench.csv --generate 1000000 --url sqlite:///bench.sqlite3
+    parser = argparse.ArgumentParser(description="Benchmark the streaming CSV/XLSX importer.")
+    parser.add_argument("path")
+    parser.add_argument("--url", default="sqlite:///importer_bench.sqlite3")
+    parser.add_argument("--table", default="importer_bench")
+    parser.add_argument("--mode", default="replace", choices=INGESTION_MODES)
+    parser.add_argument("--chunk-rows", type=int, default=50_000)
+    parser.add_argument("--insert-batch-rows", type=int, default=1000)
+    parser.add_argument("--load-data", action="store_true", help="Use LOAD DATA LOCAL INFILE (MySQL only)")
+    parser.add_argument("--generate", type=int, default=0, help="Write a synthetic CSV with this many rows first")
+    parser.add_argument("--infer-schema", action="store_true", help="Create typed columns, keys and indexes")
+    args = parser.parse_args()
+
+    if args.generate:
+        _generate_csv(args.path, args.generate)
+    engine = get_engine(args.url)
+    importer = TabularImporter(
+        engine=engine,
+        chunk_rows=args.chunk_rows,
+        insert_batch_rows=args.insert_batch_rows,
+        load_data_local_infile=args.load_data,
+        inferrer=SchemaInferrer(engine) if args.infer_schema else None,
+    )
+    print(importer.import_file(args.path, args.table, mode=args.mode))
@@ -1,54 +1,34 @@
 from langchain.agents import Tool
 from langchain_utils import invoke_chain, get_llm
 from crewai_tools import tool
-import os
-from langchain_community.utilities.sql_database import SQLDatabase
-from sqlalchemy import create_engine
+from db_engine import get_engine, get_sql_database
+from schema_catalog import get_schema_catalog
+from join_graph import get_join_graph
+from value_index import get_value_index
+from sql_validator import get_sql_validator
+from result_store import get_result_store
 
-from langchain_community.tools.sql_database.tool import (
-    InfoSQLDatabaseTool,
-    ListSQLDatabaseTool,
-    QuerySQLCheckerTool,
-    QuerySQLDataBaseTool,
-)
-from langchain_chroma import Chroma
-from langchain_openai import OpenAIEmbeddings
+from langchain_community.tools.sql_database.tool import QuerySQLCheckerTool
 from plotly import graph_objects as go
 import pandas as pd
 import plotly.express as px
 import streamlit as st
-from pyprojroot import here
-import yaml
-from vector_db_query_tool import VectorDBQueryTool
+from config import load_config
+from vector_store import get_vector_store
 
 
-with open(here("Langchain NL2SQL Chatbot/configs/tools_config.yml")) as cfg:
-        app_config = yaml.load(cfg, Loader=yaml.FullLoader)
+app_config = load_config()
 
 llm = get_llm()
 
-db_user = os.getenv("db_user")
-db_password = os.getenv("db_password")
-db_host = os.getenv("db_host")
-db_name = os.getenv("db_name")
-
-connection_string = f"mysql+pymysql://{db_user}:{db_password}@{db_host}/{db_name}"
-db = SQLDatabase.from_uri(connection_string)
-engine = create_engine(connection_string)
-
-vectordb_path = here(app_config["unstructured_data"]["vectordb"])
-if os.path.exists(vectordb_path):
-    vector_db_instance = Chroma(
-        persist_directory=str(vectordb_path),
-        collection_name=app_config["unstructured_data"]["collection_name"],
-        embedding_function=OpenAIEmbeddings(model=app_config["unstructured_data"]["embedding_model"])
-    )
+db = get_sql_database()
+engine = get_engine()
 
 
 @tool("list_tables")
 def list_tables() -> str:
     """List the available tables in the database"""
-    return ListSQLDatabaseTool(db=db).invoke("")
+    return ", ".join(get_schema_catalog().list_tables())
 
 @tool("tables_schema")
 def tables_schema(tables: str) -> str:
@@ -57,13 +37,59 @@ def tables_schema(tables: str) -> str:
     for those tables. Be sure that the tables actually exist by calling `list_tables` first!
     Example Input: table1, table2, table3
     """
-    tool = InfoSQLDatabaseTool(db=db)
-    return tool.invoke(tables)
+    return get_schema_catalog().get_table_info_no_throw(tables)
+
+@tool("join_path")
+def join_path(tables: str) -> str:
+    """
+    Input is two comma-separated table names, output is the shortest chain of JOINs between them
+    (including any intermediate tables) with the key columns to join on.
+    Example Input: customers, products
+    """
+    names = [table.strip() for table in tables.split(",") if table.strip()]
+    if len(names) != 2:
+        return "Error: expected exactly two comma-separated table names"
+    return get_join_graph().describe_path(names[0], names[1])
+
+@tool("find_values")
+def find_values(phrase: str) -> str:
+    """
+    Input is a phrase from the question that names a specific thing (a product, a country, a customer...),
+    output is the exact values stored in the database that match it, with their table and column.
+    Use it instead of running SELECT DISTINCT queries to discover literal values.
+    Example Input: 68 ford mustang
+    """
+    matches = get_value_index().link(phrase)
+    if not matches:
+        return f"No stored values match {phrase!r}."
+    return "\n".join(str(match) for match in matches)
 
 @tool("execute_sql")
 def execute_sql(sql_query: str) -> str:
-    """Execute a SQL query against the database. Returns the result"""
-    return QuerySQLDataBaseTool(db=db).invoke(sql_query)
+    """
+    Execute a SQL query against the database. Returns a RESULT_ID referencing the stored rows,
+    the column types and a short preview of the first rows.
+    """
+    try:
+        result_set = get_result_store().execute(sql_query)
+    except Exception as e:
+        return f"Error: {e}"
+    return result_set.preview(app_config["query_results"]["preview_rows"])
+
+@tool("fetch_sql_rows")
+def fetch_sql_rows(sql_query: str) -> str:
+    """
+    Execute a SQL query and return all of its rows (up to the query row limit) as semicolon-separated
+    CSV, for analysing the data rather than just displaying it.
+    """
+    try:
+        data, truncated = get_result_store().read_frame(sql_query)
+    except Exception as e:
+        return f"Error: {e}"
+    if data.empty:
+        return "<no rows>"
+    note = f"\n(truncated to the first {len(data)} rows)" if truncated else ""
+    return data.to_csv(sep=";", index=False) + note
 
 @tool("check_sql")
 def check_sql(sql_query: str) -> str:
@@ -71,7 +97,12 @@ def check_sql(sql_query: str) -> str:
     Use this tool to double check if your query is correct before executing it. Always use this
     tool before executing a query with `execute_sql`.
     """
-    return QuerySQLCheckerTool(db=db, llm=llm).invoke({"query": sql_query})
+    result = get_sql_validator().validate(sql_query)
+    if result.ambiguous:
+        # The local parser could not decide; let the LLM checker have a look instead.
+        print("Local validation was inconclusive, falling back to the LLM checker:", result.issues)
+        return QuerySQLCheckerTool(db=db, llm=llm).invoke({"query": sql_query})
+    return str(result)
 
 @tool("sql_tool")
 def sql_tool(query: str, messages):
@@ -83,8 +114,7 @@ def sql_tool(query: str, messages):
     print(messages)
     return invoke_chain(query, messages)
 
-@tool("create_visualization")
-def create_visualization(query: str, type_of_graph: str, title: str, x: str, y: str = None) -> str:
+def _create_visualization(query: str, type_of_graph: str, title: str, x: str, y: str = None, sink: list = None) -> str:
     """
     Create and display an interactive visualization using Plotly.
     
@@ -122,11 +152,13 @@ def create_visualization(query: str, type_of_graph: str, title: str, x: str, y:
         
         print("Cleaned Query:", query)
         
-        # Get data from SQL query
-        data = pd.read_sql_query(query, engine)
+        # Get data from SQL query, capped and time-limited by the query governor
+        data, truncated = get_result_store().read_frame(query)
         
         if data.empty:
             return "No data to visualize"
+        if truncated and sink is None:
+            st.warning(f"Only the first {len(data)} rows are plotted; the query returned more.")
 
         print("DataFrame columns:", data.columns.tolist())
         print("Visualization type:", type_of_graph)
@@ -215,21 +247,40 @@ def create_visualization(query: str, type_of_graph: str, title: str, x: str, y:
                 )
 
         # Display the visualization with specific height and width
-        st.plotly_chart(fig, use_container_width=True, height=600)
+        if sink is not None:
+            sink.append(fig)
+        else:
+            st.plotly_chart(fig, use_container_width=True, height=600)
         
+        if truncated:
+            return f"Visualization has been created and displayed from the first {len(data)} rows (results were truncated)"
         return "Visualization has been created and displayed"
         
     except Exception as e:
         return f"Error creating visualization: {str(e)}"
  
+def visualization_tool(sink: list = None):
+    """
+    Build a `create_visualization` tool. With a `sink`, figures are appended to it instead of being drawn,
+    for crews that run off the page's script thread (background jobs, parallel tasks).
+    """
+    def create_visualization(query: str, type_of_graph: str, title: str, x: str, y: str = None) -> str:
+        return _create_visualization(query, type_of_graph, title, x, y, sink=sink)
+    create_visualization.__doc__ = _create_visualization.__doc__
+    return tool("create_visualization")(create_visualization)
+
+create_visualization = visualization_tool()
+
 @tool("lookup_vector_db")
 def lookup_vector_db(query: str) -> str:
     """
     Input is a query string for searching the unstructured document store (vector DB).
     Returns the relevant document chunks or answers based on vector similarity.
     """
-    tool = VectorDBQueryTool(vector_db=vector_db_instance)
-    return tool.invoke(query)
+    query_tool = get_vector_store().query_tool()
+    if query_tool is None:
+        return "Error: the document store has not been created yet, no documents can be searched."
+    return query_tool.invoke(query)
 
 @tool("decide_route")
 def decide_route(query: str) -> str:
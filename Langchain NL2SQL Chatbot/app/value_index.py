@@ -0,0 +1,323 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import List
+
+from pyprojroot import here
+from sqlalchemy import text
+from sqlalchemy.types import String
+
+from config import load_config
+from db_engine import get_engine
+from schema_catalog import get_schema_catalog
+
+NON_ALNUM = re.compile(r"[^0-9a-z]+")
+QUOTED = re.compile(r"[\"']([^\"']{2,})[\"']")
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "give", "how", "in", "is", "list", "many",
+    "me", "much", "of", "on", "or", "show", "the", "to", "was", "were", "what", "which", "who", "with",
+    "all", "each", "per", "their", "that", "this", "have", "has", "get", "find", "total", "number",
+}
+
+
+def normalize_value(value: str) -> str:
+    return NON_ALNUM.sub(" ", value.lower()).strip()
+
+
+def trigrams(value: str) -> set:
+    """pg_trgm-style trigrams: each word padded with two leading blanks and one trailing blank."""
+    grams = set()
+    for word in normalize_value(value).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def _words_match(word: str, other: str) -> bool:
+    if word == other:
+        return True
+    if len(word) >= 2 and (other.endswith(word) or other.startswith(word)):
+        return True  # "68" in "1968", "mustang" in "mustangs"
+    word_grams, other_grams = trigrams(word), trigrams(other)
+    return len(word_grams & other_grams) / len(word_grams | other_grams) >= 0.5
+
+
+def word_overlap(mention: str, value: str) -> float:
+    """
+    Word-level score for partial mentions: the share of the mention's words found in the value (exactly,
+    as a prefix or suffix, or as a close spelling), weighted 2:1 against the share of the value's words
+    that were mentioned. "68 Mustang" against "1968 Ford Mustang" scores (2 * 2/2 + 2/3) / 3 = 0.89.
+    """
+    mention_words, value_words = normalize_value(mention).split(), normalize_value(value).split()
+    if not mention_words or not value_words:
+        return 0.0
+    found, matched = 0, set()
+    for word in mention_words:
+        for i, other in enumerate(value_words):
+            if _words_match(word, other):
+                found += 1
+                matched.add(i)
+                break
+    return (2 * found / len(mention_words) + len(matched) / len(value_words)) / 3
+
+
+@dataclass
+class ValueMatch:
+    mention: str
+    table: str
+    column: str
+    value: str
+    score: float
+
+    def __str__(self) -> str:
+        escaped = self.value.replace("'", "''")
+        return f"'{self.mention}' -> {self.table}.{self.column} = '{escaped}' (similarity {self.score:.2f})"
+
+
+class ValueIndex:
+    """
+    Trigram index over the distinct values of low-cardinality text columns, for entity linking.
+
+    A question like "orders for the 68 Mustang" needs the literal `'1968 Ford Mustang'`; instead of
+    the model guessing it or running `SELECT DISTINCT` probes, `link` matches the question's phrases
+    against the indexed values and returns the exact value and column. Values sharing trigrams with a
+    phrase are scored by the better of trigram Jaccard similarity (whole-value spelling variants) and
+    `word_overlap` (partial mentions). Phrases shorter than three characters, such as "UK", only link
+    to values they equal exactly, and only when written in capitals or quoted.
+
+    Each table's values are scanned once (text columns with at most `max_distinct` distinct values)
+    and persisted as `<table>.json` in `directory`, together with a signature of its text columns.
+    When the schema fingerprint changes, only tables that are new or whose text columns changed are
+    scanned again; ingestion calls `refresh(table)` for the tables it loaded, and any table older
+    than `max_age` seconds is rescanned. Scans run on a background thread (`warm_up`, started when a
+    page loads and whenever a lookup finds the index out of date), so a question never waits for one;
+    lookups use whatever is indexed so far.
+    """
+
+    def __init__(self, catalog, engine, directory: str, max_distinct: int = 5000, max_value_length: int = 100,
+                 min_similarity: float = 0.5, max_ngram: int = 4, max_matches: int = 5, max_age: float = 86400) -> None:
+        self.catalog = catalog
+        self.engine = engine
+        self.directory = directory
+        self.max_distinct = max_distinct
+        self.max_value_length = max_value_length
+        self.min_similarity = min_similarity
+        self.max_ngram = max_ngram
+        self.max_matches = max_matches
+        self.max_age = max_age
+        self._fingerprint = None
+        self._tables = {}
+        self._values = []
+        self._postings = {}
+        self._exact = {}
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._syncing = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, table: str) -> str:
+        return os.path.join(self.directory, NON_ALNUM.sub("_", table.lower()) + ".json")
+
+    def _text_columns(self, table: str) -> List[str]:
+        return [column["name"] for column in self.catalog.get_columns(table) if isinstance(column["type"], String)]
+
+    def _signature(self, table: str) -> str:
+        columns = [f"{column['name']}:{column['type']}" for column in self.catalog.get_columns(table)
+                   if isinstance(column["type"], String)]
+        return hashlib.sha256("|".join(columns).encode("utf-8")).hexdigest()
+
+    def _scan(self, table: str) -> dict:
+        quote = self.engine.dialect.identifier_preparer.quote
+        columns = {}
+        started = time.perf_counter()
+        with self.engine.connect() as conn:
+            for column in self._text_columns(table):
+                rows = conn.execute(text(
+                    f"SELECT DISTINCT {quote(column)} FROM {quote(table)} "
+                    f"WHERE {quote(column)} IS NOT NULL LIMIT {self.max_distinct + 1}"
+                )).fetchall()
+                if len(rows) > self.max_distinct:
+                    continue
+                values = [str(row[0]) for row in rows if 0 < len(str(row[0])) <= self.max_value_length]
+                if values:
+                    columns[column] = values
+        print(f"Value index scanned {table}: {sum(len(v) for v in columns.values())} values "
+              f"in {len(columns)} columns ({time.perf_counter() - started:.2f}s)")
+        return {"table": table, "signature": self._signature(table), "scanned_at": time.time(), "columns": columns}
+
+    def _load(self, table: str):
+        try:
+            with open(self._path(table), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, entry: dict):
+        path = self._path(entry["table"])
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+
+    def _publish(self, tables: dict):
+        """Build the postings for `tables` and swap them in; lookups only hold the lock for the swap."""
+        values, postings, exact = [], defaultdict(list), defaultdict(list)
+        for table, entry in tables.items():
+            for column, column_values in entry["columns"].items():
+                for value in column_values:
+                    grams = trigrams(value)
+                    if not grams:
+                        continue
+                    for gram in grams:
+                        postings[gram].append(len(values))
+                    exact[normalize_value(value)].append(len(values))
+                    values.append((table, column, value, len(grams)))
+        with self._lock:
+            self._tables, self._values, self._postings, self._exact = tables, values, dict(postings), dict(exact)
+
+    def refresh(self, table: str = None):
+        """Rescan `table` (or every table) now, e.g. right after an upload wrote it."""
+        with self._sync_lock:
+            tables = dict(self._tables)
+            for name in [table] if table else self.catalog.list_tables():
+                entry = self._scan(name)
+                self._save(entry)
+                tables[name] = entry
+            self._publish(tables)
+
+    def _out_of_date(self) -> bool:
+        now = time.time()
+        return (self.catalog.fingerprint() != self._fingerprint
+                or any(now - entry["scanned_at"] > self.max_age for entry in self._tables.values()))
+
+    def _sync(self):
+        with self._sync_lock:
+            if not self._out_of_date():
+                return
+            fingerprint = self.catalog.fingerprint()
+            now = time.time()
+            tables = {}
+            changed = False
+            for table in self.catalog.list_tables():
+                entry = self._tables.get(table) or self._load(table)
+                if entry is None or entry["signature"] != self._signature(table) or now - entry["scanned_at"] > self.max_age:
+                    entry = self._scan(table)
+                    self._save(entry)
+                    changed = True
+                elif table not in self._tables:
+                    changed = True
+                tables[table] = entry
+            if changed or set(tables) != set(self._tables):
+                self._publish(tables)
+            self._fingerprint = fingerprint
+
+    def _sync_quietly(self):
+        try:
+            self._sync()
+        except Exception as e:
+            print(f"Value index sync failed: {e}")
+
+    def warm_up(self):
+        """Bring the index up to date on a background thread, unless a sync is already running."""
+        with self._lock:
+            if self._syncing is not None and self._syncing.is_alive():
+                return
+            self._syncing = threading.Thread(target=self._sync_quietly, name="value-index-sync", daemon=True)
+            self._syncing.start()
+
+    def _mentions(self, question: str) -> List[tuple]:
+        """
+        (start, end, phrase) candidates: quoted strings and word n-grams not bounded by stopwords.
+        Phrases under three characters are kept only when written in capitals, e.g. "UK".
+        """
+        words = question.split()
+        normalized = [normalize_value(word) for word in words]
+        mentions = [(-1, -1, normalize_value(match.group(1))) for match in QUOTED.finditer(question)]
+        for start in range(len(words)):
+            for end in range(start + 1, min(start + self.max_ngram, len(words)) + 1):
+                if normalized[start] in STOPWORDS or normalized[end - 1] in STOPWORDS:
+                    continue
+                phrase = " ".join(normalized[start:end])
+                length = len(phrase.replace(" ", ""))
+                if length >= 3 or (length == 2 and "".join(words[start:end]).isupper()):
+                    mentions.append((start, end, phrase))
+        return mentions
+
+    def link(self, question: str) -> List[ValueMatch]:
+        """Exact database values the question most likely refers to, best first."""
+        if self._out_of_date():
+            self.warm_up()
+        with self._lock:
+            values, postings, exact = self._values, self._postings, self._exact
+        candidates = []
+        for start, end, phrase in self._mentions(question):
+            if len(phrase.replace(" ", "")) < 3:
+                for value_id in exact.get(phrase, ()):
+                    table, column, value, _ = values[value_id]
+                    candidates.append((1.0, end - start, start, end, ValueMatch(phrase, table, column, value, 1.0)))
+                continue
+            grams = trigrams(phrase)
+            hits = defaultdict(int)
+            for gram in grams:
+                for value_id in postings.get(gram, ()):
+                    hits[value_id] += 1
+            for value_id, shared in hits.items():
+                if shared / len(grams) < self.min_similarity:
+                    continue  # Too little of the phrase appears in the value for either score to pass.
+                table, column, value, size = values[value_id]
+                score = max(shared / (len(grams) + size - shared), word_overlap(phrase, value))
+                if score >= self.min_similarity:
+                    candidates.append((score, end - start, start, end, ValueMatch(phrase, table, column, value, score)))
+
+        # Greedy by score (longer phrases first on ties): once a phrase is linked, overlapping phrases
+        # are only kept when they link to an equally good value, e.g. a country in two tables.
+        matches, taken, seen = [], [], set()
+        for score, _, start, end, match in sorted(candidates, key=lambda c: (-c[0], -c[1])):
+            key = (match.table, match.column, match.value)
+            if key in seen:
+                continue
+            overlapping = [best for s, e, best in taken if start >= 0 and s < end and start < e]
+            if overlapping and score < max(overlapping) - 0.05:
+                continue
+            seen.add(key)
+            taken.append((start, end, score))
+            matches.append(match)
+            if len(matches) >= self.max_matches:
+                break
+        return matches
+
+    def hints(self, question: str) -> str:
+        """Prompt text listing the linked values, or an empty string when nothing matched."""
+        matches = self.link(question)
+        if not matches:
+            return ""
+        return ("Values in the database that the question likely refers to (use these exact literals):\n"
+                + "\n".join(f"- {match}" for match in matches))
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_value_index() -> ValueIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            index_config = load_config()["value_index"]
+            _index = ValueIndex(
+                get_schema_catalog(),
+                get_engine(),
+                str(here(index_config["directory"])),
+                max_distinct=index_config["max_distinct"],
+                max_value_length=index_config["max_value_length"],
+                min_similarity=index_config["min_similarity"],
+                max_ngram=index_config["max_ngram"],
+                max_matches=index_config["max_matches"],
+                max_age=index_config["max_age_hours"] * 3600,
+            )
+        return _index
@@ -1,9 +1,103 @@
+import os
+
+import tiktoken
+
+from bm25_index import get_bm25_index
+from config import load_config
+
+SEARCH_TYPES = ("similarity", "mmr")
+
 
 class VectorDBQueryTool:
-    def __init__(self, vector_db):
+    """
+    Retrieval over the document store, configured by `unstructured_data` in the config.
+
+    Returns at most `k` chunks whose relevance score (1 - cosine distance) is at least `score_threshold`. With
+    `search_type: mmr` the `fetch_k` best candidates are re-ranked for diversity (`lambda_mult` 1 is pure
+    relevance, 0 pure diversity), so near-duplicate chunks do not crowd out the rest. `filter` is a
+    Chroma metadata filter, e.g. {"source": "..."}. The chunks are concatenated best first until the
+    `max_tokens` budget is spent. Any of these can be overridden per instance.
+
+    With `hybrid: true` the dense results are fused with the BM25 keyword index's `fetch_k` best chunks
+    by reciprocal-rank fusion (score = sum of 1 / (`rrf_k` + rank) over both lists), which recovers
+    exact-term matches such as FAQ questions that embeddings rank poorly. Keyword-only hits skip
+    the relevance threshold, since BM25 scores are not on the same scale. The keyword index applies
+    the same `filter`; when it uses an operator the index does not support, only dense results are
+    returned.
+    """
+
+    def __init__(self, vector_db, k: int = None, search_type: str = None, score_threshold: float = None,
+                 fetch_k: int = None, lambda_mult: float = None, filter: dict = None, max_tokens: int = None,
+                 hybrid: bool = None, keyword_index=None):
+        retrieval_config = load_config()["unstructured_data"]
         self.vector_db = vector_db
+        self.k = k or retrieval_config["k"]
+        self.search_type = search_type or retrieval_config["search_type"]
+        if self.search_type not in SEARCH_TYPES:
+            raise ValueError(f"Unknown search type {self.search_type!r}, expected one of {SEARCH_TYPES}")
+        self.score_threshold = score_threshold if score_threshold is not None else retrieval_config["score_threshold"]
+        self.fetch_k = fetch_k or retrieval_config["fetch_k"]
+        self.lambda_mult = lambda_mult if lambda_mult is not None else retrieval_config["lambda_mult"]
+        self.filter = filter if filter is not None else retrieval_config["filter"]
+        self.max_tokens = max_tokens or retrieval_config["max_tokens"]
+        self.hybrid = hybrid if hybrid is not None else retrieval_config["hybrid"]
+        self.rrf_k = retrieval_config["rrf_k"]
+        self.keyword_index = keyword_index or (get_bm25_index() if self.hybrid else None)
+        self.encoding = tiktoken.get_encoding("cl100k_base")
+
+    def _dense_search(self, query: str, k: int) -> list:
+        fetch_k = max(self.fetch_k if self.search_type == "mmr" else k, k)
+        scored = self.vector_db.similarity_search_with_relevance_scores(query, k=fetch_k, filter=self.filter)
+        scored = [(doc, score) for doc, score in scored if score >= self.score_threshold]
+        if self.search_type == "similarity" or len(scored) <= 1:
+            return scored[:k]
+        scores = {doc.page_content: score for doc, score in scored}
+        diverse = self.vector_db.max_marginal_relevance_search(query, k=k, fetch_k=fetch_k,
+                                                               lambda_mult=self.lambda_mult, filter=self.filter)
+        return [(doc, scores[doc.page_content]) for doc in diverse if doc.page_content in scores]
+
+    def _fuse(self, *rankings) -> list:
+        fused, docs = {}, {}
+        for ranking in rankings:
+            for rank, (doc, _) in enumerate(ranking, start=1):
+                docs.setdefault(doc.page_content, doc)
+                fused[doc.page_content] = fused.get(doc.page_content, 0.0) + 1.0 / (self.rrf_k + rank)
+        ranked = sorted(fused.items(), key=lambda item: -item[1])
+        return [(docs[content], score) for content, score in ranked[:self.k]]
+
+    def search(self, query: str) -> list:
+        """(document, score) pairs, best first: relevance scores, or fused RRF scores when hybrid."""
+        if not self.hybrid:
+            return self._dense_search(query, self.k)
+        # Fusion needs deeper lists than the final k to reward chunks both retrievers rank well.
+        dense = self._dense_search(query, self.fetch_k)
+        try:
+            keyword = self.keyword_index.search(query, k=self.fetch_k, filter=self.filter)
+        except ValueError as e:
+            # Fusing keyword hits from a looser filter would let in chunks the dense search excluded.
+            print(f"Keyword search skipped, the filter cannot be applied to it: {e}")
+            return dense[:self.k]
+        return self._fuse(dense, keyword)
+
+    def _header(self, doc, score: float) -> str:
+        source = os.path.basename(str(doc.metadata.get("source", "document")))
+        page = doc.metadata.get("page")
+        return f"[{source}" + (f", page {page + 1}" if isinstance(page, int) else "") + f", score {score:.3f}]"
 
     def invoke(self, query: str) -> str:
-        docs = self.vector_db.similarity_search(query)
-        results = "\n\n".join([doc.page_content for doc in docs])
-        return results
+        results = self.search(query)
+        if not results:
+            return "No relevant documents found."
+        chunks, budget = [], self.max_tokens
+        for doc, score in results:
+            text = f"{self._header(doc, score)}\n{doc.page_content}"
+            tokens = self.encoding.encode(text)
+            if len(tokens) > budget:
+                if not chunks:
+                    # The best chunk alone is over budget: return its beginning rather than nothing.
+                    chunks.append(self.encoding.decode(tokens[:budget]))
+                break
+            chunks.append(text)
+            budget -= len(tokens)
+        print(f"Vector DB lookup: {len(chunks)} of {len(results)} chunks, {self.max_tokens - budget} tokens")
+        return "\n\n".join(chunks)
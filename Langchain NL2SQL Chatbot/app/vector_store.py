@@ -0,0 +1,121 @@
+import glob
+import os
+import threading
+import time
+
+from langchain_chroma import Chroma
+from pyprojroot import here
+
+from bm25_index import BM25_FILE
+from config import load_config
+from embeddings import get_embeddings
+from vector_db_query_tool import VectorDBQueryTool
+
+HNSW_FILES = ("header.bin", "data_level0.bin", "length.bin", "link_lists.bin")
+# Relevance scores are 1 - distance, which is only a 0-1 similarity in cosine space (Chroma defaults to squared l2).
+COLLECTION_METADATA = {"hnsw:space": "cosine"}
+
+
+class VectorStoreService:
+    """
+    Process-wide handle on the Chroma document store.
+
+    The collection is opened on first use rather than at import, and the client and its
+    VectorDBQueryTool are reused by every session. Opening also prewarms the HNSW index: the segment
+    files are read into the page cache and one query by a stored vector (no embedding call) makes
+    Chroma load the index into memory, so the first user lookup does not pay for either. `warm_up`
+    does this on a background thread, for pages that are likely to need documents.
+
+    PrepareVectorDB calls `reload` after ingesting in this process; other processes notice the BM25
+    index file it writes at the end of every run and reopen the collection on their next lookup. Chroma's
+    client cache is shared with every other session and PrepareVectorDB, so it is never cleared.
+    """
+
+    def __init__(self, path: str, collection_name: str, prewarm: bool = True) -> None:
+        self.path = path
+        self.collection_name = collection_name
+        self.prewarm = prewarm
+        self._vectordb = None
+        self._query_tool = None
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _ingested_at(self):
+        marker = os.path.join(self.path, BM25_FILE)
+        return os.path.getmtime(marker) if os.path.exists(marker) else None
+
+    def _prewarm(self, vectordb: Chroma):
+        started = time.perf_counter()
+        warmed = 0
+        for name in HNSW_FILES:
+            for path in glob.glob(os.path.join(self.path, "*", name)):
+                with open(path, "rb") as f:
+                    while block := f.read(1 << 20):
+                        warmed += len(block)
+        sample = vectordb._collection.get(limit=1, include=["embeddings"])
+        if sample["ids"]:
+            vectordb._collection.query(query_embeddings=[list(sample["embeddings"][0])], n_results=1)
+        print(f"Vector store prewarmed: {warmed / 1e6:.1f} MB of HNSW files in {time.perf_counter() - started:.2f}s")
+
+    def _open(self):
+        vectordb = Chroma(
+            persist_directory=self.path,
+            collection_name=self.collection_name,
+            embedding_function=get_embeddings("vector_store"),
+            collection_metadata=COLLECTION_METADATA,
+        )
+        if self.prewarm:
+            try:
+                self._prewarm(vectordb)
+            except Exception as e:
+                print(f"Vector store prewarm failed: {e}")
+        self._vectordb = vectordb
+        self._query_tool = VectorDBQueryTool(vector_db=vectordb)
+        self._opened_at = self._ingested_at()
+
+    def get(self):
+        """The open Chroma collection, or None if no document store has been created yet."""
+        with self._lock:
+            if not self.exists:
+                return None
+            if self._vectordb is None or self._ingested_at() != self._opened_at:
+                self._open()
+            return self._vectordb
+
+    def query_tool(self):
+        return self._query_tool if self.get() is not None else None
+
+    def reload(self, reopen: bool = False):
+        """
+        Called by PrepareVectorDB after it wrote to the store in this process. Those writes are already
+        visible through the open client, so only the marker is refreshed; `reopen` is needed when the
+        collection itself was deleted and recreated.
+        """
+        with self._lock:
+            self._opened_at = object() if reopen else self._ingested_at()
+
+    def warm_up(self):
+        """Open and prewarm the store on a background thread unless it is already open."""
+        if self._vectordb is None and self.exists:
+            threading.Thread(target=self.get, name="vector-store-warm-up", daemon=True).start()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStoreService:
+    global _store
+    with _store_lock:
+        if _store is None:
+            store_config = load_config()["unstructured_data"]
+            _store = VectorStoreService(
+                str(here(store_config["vectordb"])),
+                store_config["collection_name"],
+                prewarm=store_config["prewarm"],
+            )
+        return _store